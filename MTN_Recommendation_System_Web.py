@@ -9,17 +9,70 @@ import re
 import time
 import pandas as pd
 import streamlit as st
-from io import StringIO, BytesIO  # Added BytesIO import here
+from io import BytesIO
 import matplotlib.pyplot as plt
 from PIL import Image
-from vertexai.generative_models import GenerativeModel
-from google.cloud import aiplatform
+from model_backends import create_backend, DEFAULT_BACKEND
+from resilience import ResilientModel, get_circuit_breaker
+from rate_limiter import SharedRateLimiter, RateLimitedModel
+from single_flight import SingleFlight
+from recommendation_pipeline import (
+    generate_batched, estimate_prompt_tokens, BatchStream, prompt_template_for, NO_INSIGHTS_TEXT, DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_OUTPUT_MODE, OUTPUT_MODE_JSON, OUTPUT_MODE_MARKDOWN, OUTPUT_MODE_IDS, is_incomplete
+)
+from batch_planner import plan_batches, MAX_BATCH_SIZE
+from fast_recommender import recommend_fast
+from eligibility import DEFAULT_CONSTRAINTS
+from profile_dedup import ProfileGroups
+from segmentation import SubscriberSegmenter, generate_segmented, DEFAULT_NUM_CLUSTERS
+from neighbour_reuse import NeighbourIndex, DEFAULT_MAX_DISTANCE
+from health_monitor import HealthMonitor
+from subscriber_store import load_subscribers, iter_subscribers, DEFAULT_CHUNK_ROWS
+from chunked_pipeline import generate_chunked, write_chunked, read_results_preview, insights_path_for, preview_subscribers
+from msisdn_index import MsisdnIndex, split_msisdn_text, read_msisdn_upload
+from catalogue_index import DEFAULT_CANDIDATE_TOP_K
+from recommendation_cache import (
+    RecommendationCache, SubscriberResultStore, make_cache_key, make_context_key, stitch_results, covers_subscribers
+)
 
 # Constants
 LOGO_FILE = "New-mtn-logo.jpg"
 SUBSCRIBER_FILE = "SubscriberProfileData.csv"
 PRODUCT_FILE = "ProductCatalogue.csv"
 CREDENTIALS_FILE = "hackathon2025-454908-0a52f19ef9b1.json"
+MODEL_NAME = "gemini-1.5-flash-001"
+# "vertex" for Gemini on Vertex AI, "local" for the deterministic offline stand-in
+MODEL_BACKEND = DEFAULT_BACKEND
+CACHE_FILE = "recommendation_cache.db"
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 500
+HEALTH_CHECK_INTERVAL_SECONDS = 300
+# Project quota for Gemini, shared by every session and replica through RATE_LIMIT_FILE
+RATE_LIMIT_FILE = "rate_limit.db"
+RATE_LIMIT_REQUESTS_PER_MINUTE = 60
+RATE_LIMIT_TOKENS_PER_MINUTE = 1000000
+AUTO_BATCH_SIZE = 0
+# Country codes stripped from pasted or uploaded MSISDNs; any other extra leading digits make a miss
+COUNTRY_CODES = ("256",)
+# Chunked "All MSISDNs" runs write to RESULTS_DIR; files above MAX_DOWNLOAD_MB are not offered for download
+RESULTS_DIR = "results"
+MAX_DOWNLOAD_MB = 200
+
+# Gemini decides every row, or the local scorer picks products and the model at most phrases reasons
+ENGINE_MODEL = "model"
+ENGINE_FAST = "fast"
+ENGINE_SEGMENTS = "segments"
+ENGINE_LABELS = {
+    ENGINE_MODEL: "Gemini AI",
+    ENGINE_SEGMENTS: "Gemini AI per segment (k-means)",
+    ENGINE_FAST: "Fast rules (no model calls)",
+}
+
+OUTPUT_MODE_LABELS = {
+    OUTPUT_MODE_JSON: "Structured JSON",
+    OUTPUT_MODE_IDS: "Product IDs (details filled from catalogue)",
+    OUTPUT_MODE_MARKDOWN: "Markdown table"
+}
 
 # Category colors for visualization
 category_colors = {
@@ -39,57 +92,67 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Model backend selected by MODEL_BACKEND, shared by all sessions
+@st.cache_resource
+def get_model_backend():
+    return create_backend(MODEL_BACKEND, MODEL_NAME, credentials_file=CREDENTIALS_FILE)
+
+# Initialized model client, created once and shared by all sessions;
+# calls queue on the quota shared with other processes, retry transient errors
+# and fail fast while the endpoint is down
+@st.cache_resource
+def get_model_client():
+    backend = get_model_backend()
+    backend.initialize()
+    limiter = SharedRateLimiter(
+        backend.model_id, RATE_LIMIT_FILE,
+        requests_per_minute=RATE_LIMIT_REQUESTS_PER_MINUTE, tokens_per_minute=RATE_LIMIT_TOKENS_PER_MINUTE
+    )
+    return ResilientModel(RateLimitedModel(backend.get_model(), limiter), breaker=get_circuit_breaker(backend.model_id))
+
 # Initialize Google Cloud credentials
 def initialize_google_cloud():
     try:
-        if os.path.exists(CREDENTIALS_FILE):
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_FILE
-            aiplatform.init()
-            return True
-        else:
-            st.error(f"Google Cloud credentials file not found: {CREDENTIALS_FILE}")
-            return False
+        get_model_client()
+        return True
+    except FileNotFoundError as e:
+        st.error(str(e))
+        return False
     except Exception as e:
         st.error(f"Failed to initialize Google Cloud: {str(e)}")
         return False
 
-# Check integration health
-def check_integration_health():
-    status = {
-        "Google Cloud API": False,
-        "Data Files": False,
-        "Gemini AI": False
-    }
-    
-    tooltips = {
-        "Google Cloud API": "Connection to Google Cloud services",
-        "Data Files": "Required data files for analysis",
-        "Gemini AI": "Access to Gemini AI model"
+# Integration health probes
+def probe_google_cloud():
+    get_model_backend().initialize()
+    return True
+
+def probe_data_files():
+    return os.path.exists(SUBSCRIBER_FILE) and os.path.exists(PRODUCT_FILE)
+
+def probe_gemini():
+    return get_model_backend().health_check()
+
+HEALTH_TOOLTIPS = {
+    "Google Cloud API": "Connection to Google Cloud services",
+    "Data Files": "Required data files for analysis",
+    "Gemini AI": "Access to Gemini AI model"
+}
+
+# Background health monitor shared by all sessions
+@st.cache_resource
+def get_health_monitor():
+    probes = {
+        "Google Cloud API": probe_google_cloud,
+        "Data Files": probe_data_files,
+        "Gemini AI": probe_gemini
     }
-    
-    # Check Google Cloud API
-    try:
-        if os.path.exists(CREDENTIALS_FILE):
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_FILE
-            aiplatform.init()
-            status["Google Cloud API"] = True
-    except:
-        pass
-    
-    # Check data files
-    if os.path.exists(SUBSCRIBER_FILE) and os.path.exists(PRODUCT_FILE):
-        status["Data Files"] = True
-    
-    # Check Gemini AI
-    try:
-        model = GenerativeModel("gemini-1.5-flash-001")
-        response = model.generate_content("Hello")
-        if response:
-            status["Gemini AI"] = True
-    except:
-        pass
-    
-    return status, tooltips
+    return HealthMonitor(probes, interval_seconds=HEALTH_CHECK_INTERVAL_SECONDS).start()
+
+# Check integration health (reads the last background snapshot, never blocks on a probe)
+def check_integration_health():
+    snapshot = get_health_monitor().snapshot()
+    return snapshot, HEALTH_TOOLTIPS
 
 # Load MTN logo
 @st.cache_data
@@ -104,19 +167,28 @@ def load_logo():
 
 # Load data files
 @st.cache_data
-def load_data():
+def load_product_data():
     try:
-        subscriber_df = pd.read_csv(SUBSCRIBER_FILE, on_bad_lines='skip')
         product_df = pd.read_csv(PRODUCT_FILE, on_bad_lines='skip')
         
         # Clean column names
-        subscriber_df.columns = [str(col).strip() for col in subscriber_df.columns]
         product_df.columns = [str(col).strip() for col in product_df.columns]
         
-        return subscriber_df, product_df
+        return product_df
     except Exception as e:
         st.error(f"Failed to load data: {str(e)}")
-        return None, None
+        return None
+
+# The whole subscriber base, loaded on first use by the selection modes that need it
+@st.cache_data
+def load_subscriber_data():
+    try:
+        # Typed and compact (categoricals, float32 metrics); read from the Parquet copy of the CSV,
+        # built on first load, when pyarrow is installed
+        return load_subscribers(SUBSCRIBER_FILE, compact=True)
+    except Exception as e:
+        st.error(f"Failed to load data: {str(e)}")
+        return None
 
 # Extract bullet points from text
 def extract_bullet_points(text):
@@ -133,58 +205,249 @@ def format_markdown_text(text):
     formatted_text = re.sub(r'^\s+\*\s+', '    • ', formatted_text, flags=re.MULTILINE)
     return formatted_text
 
-# Generate recommendations
-def generate_recommendations(selected_subscribers, product_df, variables):
-    with st.spinner("Generating AI recommendations..."):
-        try:
-            model = GenerativeModel("gemini-1.5-flash-001")
-            
-            subscriber_data_str = selected_subscribers.to_string(index=False)
-            product_data_str = product_df.to_string(index=False)
-            filters = "\n".join(f"- Include {k}" for k, v in variables.items() if v)
-            
-            prompt = f"""
-Compare the data and use it to compare with the product catalogue below. Recommend one product for each of the following subscribers:
+# Shared response cache (one per process)
+@st.cache_resource
+def get_response_cache():
+    return RecommendationCache(CACHE_FILE, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES)
 
-{subscriber_data_str}
+# Shared in-flight request registry (one per process)
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
 
-Use the product catalogue below:
+# Shared per-MSISDN result store (one per process)
+@st.cache_resource
+def get_subscriber_store():
+    return SubscriberResultStore(CACHE_FILE, ttl_seconds=CACHE_TTL_SECONDS)
 
-{product_data_str}
+# Segmenter fitted once per segment count on the whole subscriber base; subscribers it has not seen
+# are folded in incrementally
+@st.cache_resource
+def get_segmenter(num_segments):
+    subscriber_df = load_subscriber_data()
+    return SubscriberSegmenter(num_clusters=num_segments).fit(subscriber_df)
 
-Variables to consider for profiling:
-{filters}
+# MSISDN -> row position index over the loaded subscribers (one per process)
+@st.cache_resource
+def get_msisdn_index():
+    subscriber_df = load_subscriber_data()
+    return MsisdnIndex(subscriber_df["MSISDN"])
 
-Output a clean markdown-style table with the following columns exactly:
-MSISDN | RecommendedProduct  | Category | Tier | ProductPrice | Reason | UpsellOption | CrossSellOption
-use product names instead of product codes
-After the table, include a short bullet-point section with additional upsell and cross-sell insights or strategy tips. Do not include general commentary—just the table and the follow-up list.
-always make the recommendations always.
-"""
-            
-            response = model.generate_content(prompt)
-            response_text = response.text
-            
-            # Extract table from response
-            potential_table_match = re.search(r"((?:\|.+\|\n)+)", response_text)
-            table_df = None
-            if potential_table_match:
-                table_text = potential_table_match.group(1)
-                try:
-                    table_df = pd.read_csv(StringIO(table_text), sep="|", engine='python')
-                    table_df = table_df.dropna(axis=1, how='all').dropna(axis=0, how='all')
-                    table_df.columns = [col.strip() for col in table_df.columns]
-                except:
-                    table_df = None
-            
-            # Extract explanation text
-            explanation_text = response_text.replace(table_text, "") if potential_table_match else "No additional upsell/cross-sell insights were provided."
+# Feature vectors of answered subscribers, scaled on the full subscriber base (one per process)
+@st.cache_resource
+def get_neighbour_index():
+    subscriber_df = load_subscriber_data()
+    return NeighbourIndex(subscriber_df)
+
+# Run the model for one request: reuse stored rows, query the misses and store the merged result
+def run_recommendations(selected_subscribers, subscriber_df, product_df, variables, cache_key, prompt_template,
+                        settings, batch_size, max_concurrency, candidate_top_k, output_mode, stream_results,
+                        apply_eligibility, dedupe_profiles, reuse_distance):
+    # Only subscribers without a stored recommendation go to the model
+    store = get_subscriber_store()
+    context_key = make_context_key(product_df, variables, get_model_backend().model_id, prompt_template, settings)
+    subscriber_keys, cached_rows, missing_subscribers = store.lookup(selected_subscribers, context_key)
+    
+    # Subscribers within reuse_distance of one the model already answered take that answer
+    reused_df = None
+    if reuse_distance is not None and not missing_subscribers.empty:
+        # Answers stored before a restart or by other replicas are searched too
+        get_neighbour_index().refresh(store, context_key, subscriber_df, get_msisdn_index())
+        reused_df, missing_subscribers, reuse_stats = get_neighbour_index().reuse(
+            missing_subscribers, context_key, reuse_distance, product_df, apply_eligibility
+        )
+        if reuse_stats["hits"]:
+            st.caption(
+                f"Reused the nearest answered subscriber for {reuse_stats['hits']:,} of {reuse_stats['queries']:,} "
+                f"subscribers ({reuse_stats['hit_rate']:.0%} hit rate, mean distance "
+                f"{reuse_stats['mean_hit_distance']:.3f})"
+            )
+    
+    fresh_df, explanation_text, full_response = None, NO_INSIGHTS_TEXT, ""
+    if not missing_subscribers.empty:
+        model = get_model_client()
+        
+        # Size batches to the model's context and output limits unless a size was forced
+        plan = plan_batches(missing_subscribers, product_df, variables, MODEL_NAME, candidate_top_k, output_mode)
+        if batch_size == AUTO_BATCH_SIZE:
+            batch_size = plan["batch_size"]
+        generation_config = {"max_output_tokens": plan["max_output_tokens"]}
+        
+        token_counts = estimate_prompt_tokens(
+            missing_subscribers, product_df, variables, batch_size, candidate_top_k, output_mode, apply_eligibility,
+            dedupe_profiles
+        )
+        if dedupe_profiles:
+            num_profiles = ProfileGroups(missing_subscribers, variables).num_groups
+            st.caption(
+                f"{len(missing_subscribers):,} subscribers share {num_profiles:,} distinct profiles; "
+                f"the model answers once per profile"
+            )
+        st.caption(
+            f"Estimated input tokens: {sum(token_counts):,} across {len(token_counts)} prompt(s), "
+            f"up to {max(token_counts):,} per prompt"
+        )
+        
+        # Subscribers are split into batches that run concurrently and are merged into one table
+        options = dict(
+            batch_size=batch_size, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+            generation_config=generation_config, output_mode=output_mode, apply_eligibility=apply_eligibility,
+            dedupe_profiles=dedupe_profiles
+        )
+        if stream_results:
+            # Show rows as each batch streams them in, starting with the ones already stored
+            live_table = st.empty()
+            live_rows = [pd.DataFrame([cached_rows[key] for key in subscriber_keys if key in cached_rows])]
+            batch_stream = BatchStream(model, missing_subscribers, product_df, variables, **options)
+            for rows in batch_stream:
+                live_rows.append(rows)
+                live_table.dataframe(pd.concat(live_rows, ignore_index=True), use_container_width=True)
+            fresh_df, explanation_text, full_response = batch_stream.result()
+            live_table.empty()
+        else:
+            fresh_df, explanation_text, full_response = generate_batched(
+                model, missing_subscribers, product_df, variables, **options
+            )
+        store.record(fresh_df, missing_subscribers, context_key)
+        get_neighbour_index().add(fresh_df, missing_subscribers, context_key)
+    if reused_df is not None:
+        fresh_df = pd.concat([reused_df, fresh_df], ignore_index=True) if fresh_df is not None else reused_df
+    if cached_rows:
+        st.toast(f"Reused stored recommendations for {len(cached_rows)} of {len(selected_subscribers)} subscribers")
+    
+    table_df = stitch_results(selected_subscribers, subscriber_keys, cached_rows, fresh_df)
+    # A run with failed batches or missing rows is not cached whole, so the next run retries the gaps
+    if not is_incomplete(explanation_text) and covers_subscribers(table_df, selected_subscribers):
+        get_response_cache().put(cache_key, table_df, explanation_text, full_response)
+    return table_df, explanation_text, full_response
+
+# Generate recommendations
+def generate_recommendations(selected_subscribers, subscriber_df, product_df, variables,
+                             batch_size=AUTO_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                             candidate_top_k=DEFAULT_CANDIDATE_TOP_K, output_mode=DEFAULT_OUTPUT_MODE,
+                             stream_results=True, apply_eligibility=True, dedupe_profiles=True, reuse_distance=None):
+    prompt_template = prompt_template_for(output_mode)
+    # Run options that change the catalogue rows in the prompt are part of the cache keys
+    settings = {
+        "candidate_top_k": candidate_top_k,
+        "eligibility": DEFAULT_CONSTRAINTS if apply_eligibility else None,
+        "dedupe_profiles": dedupe_profiles,
+    }
+    with st.spinner("Generating AI recommendations..."):
+        try:
+            # Identical subscribers, catalogue, variables, model and prompt reuse the stored answer
+            cache = get_response_cache()
+            # Neighbour reuse changes the answer but not what the model is shown, so it only keys whole results
+            cache_key = make_cache_key(
+                selected_subscribers, product_df, variables, get_model_backend().model_id, prompt_template,
+                dict(settings, reuse_distance=reuse_distance)
+            )
+            cached = cache.get(cache_key)
+            if cached is not None:
+                st.toast("Loaded recommendations from cache")
+                return cached
             
-            return table_df, explanation_text, response_text
+            # Concurrent identical requests from other sessions wait on this one call and share its result
+            (table_df, explanation_text, full_response), shared = get_single_flight().do(
+                cache_key,
+                lambda: run_recommendations(
+                    selected_subscribers, subscriber_df, product_df, variables, cache_key, prompt_template, settings,
+                    batch_size, max_concurrency, candidate_top_k, output_mode, stream_results, apply_eligibility,
+                    dedupe_profiles, reuse_distance
+                )
+            )
+            if shared:
+                st.toast("Joined an identical analysis that was already running")
+                table_df = table_df.copy() if table_df is not None else None
+            return table_df, explanation_text, full_response
+        except Exception as e:
+            st.error(f"Failed to generate recommendations: {str(e)}")
+            return None, f"Error: {str(e)}", None
+
+# Score subscribers locally; the model is only asked to phrase reasons and insights when requested
+def generate_fast_recommendations(selected_subscribers, product_df, variables, explain_with_model=False,
+                                  max_concurrency=DEFAULT_MAX_CONCURRENCY, apply_eligibility=True):
+    with st.spinner("Scoring subscribers against the catalogue..."):
+        try:
+            model = get_model_client() if explain_with_model else None
+            return recommend_fast(
+                selected_subscribers, product_df, variables, model=model, max_concurrency=max_concurrency,
+                apply_eligibility=apply_eligibility
+            )
         except Exception as e:
             st.error(f"Failed to generate recommendations: {str(e)}")
             return None, f"Error: {str(e)}", None
 
+# Ask the model once per behavioural segment and personalize the answer for each member locally
+def generate_segment_recommendations(selected_subscribers, product_df, variables, num_segments=DEFAULT_NUM_CLUSTERS,
+                                     max_concurrency=DEFAULT_MAX_CONCURRENCY, candidate_top_k=DEFAULT_CANDIDATE_TOP_K,
+                                     output_mode=DEFAULT_OUTPUT_MODE, apply_eligibility=True):
+    with st.spinner("Generating AI recommendations per segment..."):
+        try:
+            segmenter = get_segmenter(num_segments)
+            plan = plan_batches(selected_subscribers, product_df, variables, MODEL_NAME, candidate_top_k, output_mode)
+            return generate_segmented(
+                get_model_client(), selected_subscribers, product_df, variables, segmenter,
+                apply_eligibility=apply_eligibility, batch_size=plan["batch_size"], max_concurrency=max_concurrency,
+                candidate_top_k=candidate_top_k, output_mode=output_mode,
+                generation_config={"max_output_tokens": plan["max_output_tokens"]}
+            )
+        except Exception as e:
+            st.error(f"Failed to generate recommendations: {str(e)}")
+            return None, f"Error: {str(e)}", None
+
+# Stream the whole subscriber file through the pipeline in chunks and append the results to a CSV in
+# RESULTS_DIR. Only the current chunk of subscribers and results is in memory, as main() does not load
+# the subscriber base for these runs. Returns a preview of the results and the file path.
+def generate_chunked_recommendations(product_df, variables, engine, chunk_rows=DEFAULT_CHUNK_ROWS,
+                                     batch_size=AUTO_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                                     candidate_top_k=DEFAULT_CANDIDATE_TOP_K, output_mode=DEFAULT_OUTPUT_MODE,
+                                     apply_eligibility=True, dedupe_profiles=True, explain_with_model=False):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output_path = os.path.join(RESULTS_DIR, f"MTN_Recommendations_All_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv")
+    chunks = iter_subscribers(SUBSCRIBER_FILE, chunk_rows, compact=True)
+    try:
+        if engine == ENGINE_FAST:
+            model = get_model_client() if explain_with_model else None
+            progress_stream = write_chunked(
+                chunks,
+                lambda chunk: recommend_fast(
+                    chunk, product_df, variables, model=model, max_concurrency=max_concurrency,
+                    apply_eligibility=apply_eligibility
+                ),
+                output_path
+            )
+        else:
+            progress_stream = generate_chunked(
+                get_model_client(), chunks, product_df, variables, output_path, MODEL_NAME,
+                batch_size=batch_size or None, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+                output_mode=output_mode, apply_eligibility=apply_eligibility, dedupe_profiles=dedupe_profiles
+            )
+        
+        status = st.empty()
+        progress = {"chunks": 0, "subscribers": 0, "rows": 0, "seconds": 0.0, "failed_chunks": 0, "failed_subscribers": 0}
+        for progress in progress_stream:
+            status.info(
+                f"Chunk {progress['chunks']:,}: {progress['subscribers']:,} subscribers processed, "
+                f"{progress['rows']:,} recommendations written in {progress['seconds']:.0f}s"
+            )
+        status.empty()
+        
+        table_df, explanation_text = read_results_preview(output_path)
+        summary = (
+            f"{progress['subscribers']:,} subscribers in {progress['chunks']:,} chunks of up to {chunk_rows:,}; "
+            f"{progress['rows']:,} recommendations written to {output_path} in {progress['seconds']:.0f}s"
+        )
+        if progress["failed_chunks"]:
+            summary += (
+                f"; {progress['failed_chunks']:,} chunk(s) with {progress['failed_subscribers']:,} subscribers failed "
+                f"and have no results (see the insights file)"
+            )
+        return table_df, explanation_text, summary, output_path
+    except Exception as e:
+        st.error(f"Failed to generate recommendations: {str(e)}")
+        return None, f"Error: {str(e)}", None, None
+
 # Create comparison chart
 def create_comparison_chart(table_df):
     if table_df is not None:
@@ -239,6 +502,8 @@ def main():
         st.session_state.selection_mode = None
     if "variables" not in st.session_state:
         st.session_state.variables = None
+    if "results_file" not in st.session_state:
+        st.session_state.results_file = None
     
     # Display MTN logo
     logo = load_logo()
@@ -258,14 +523,20 @@ def main():
         # Health check section
         st.subheader("System Health")
         status, tooltips = check_integration_health()
-        for service, ok in status.items():
-            if ok:
+        for service, result in status.items():
+            if result["checked_at"] is None:
+                st.info(f"{service}: CHECKING - {tooltips[service]}")
+            elif result["ok"]:
                 st.success(f"{service}: OK - {tooltips[service]}")
             else:
                 st.error(f"{service}: FAILED - {tooltips[service]}")
+            if result["checked_at"] is not None:
+                checked_at = time.strftime("%H:%M:%S", time.localtime(result["checked_at"]))
+                st.caption(f"Checked at {checked_at} in {result['latency_ms']:.0f} ms")
         
         if st.button("Refresh Health Check"):
-            st.rerun()
+            get_health_monitor().refresh()
+            st.toast("Health check started in the background")
         
         st.markdown("---")
         
@@ -273,14 +544,34 @@ def main():
         st.subheader("MSISDN Selection")
         selection_mode = st.radio(
             "Select MSISDN Input Method:",
-            ["Specific MSISDN", "Random sample of MSISDNs", "All MSISDNs"],
-            index=1
+            ["Specific MSISDN", "List of MSISDNs", "Random sample of MSISDNs", "All MSISDNs"],
+            index=2
         )
         
         if selection_mode == "Specific MSISDN":
             specific_msisdn = st.text_input("Enter MSISDN:")
+        elif selection_mode == "List of MSISDNs":
+            pasted_msisdns = st.text_area(
+                "Paste MSISDNs:",
+                help="One per line or separated by commas; country codes and leading zeros are stripped"
+            )
+            uploaded_msisdns = st.file_uploader(
+                "Or upload a list:", type=["csv", "txt", "xlsx"],
+                help="Uses the column whose header mentions MSISDN, otherwise every value in the file"
+            )
         elif selection_mode == "Random sample of MSISDNs":
-            random_count = st.number_input("Number of random MSISDNs:", min_value=1, max_value=20, value=4)
+            random_count = st.number_input("Number of random MSISDNs:", min_value=1, value=4)
+        else:
+            stream_to_file = st.checkbox(
+                "Process in chunks and write results to a file",
+                value=False,
+                help="Reads the subscriber file chunk by chunk and appends each chunk's recommendations to a "
+                     "CSV, so memory stays bounded by the chunk size; only a preview is shown here. The per-segment "
+                     "engine always runs on the loaded base"
+            )
+            chunk_rows = st.number_input(
+                "Subscribers per chunk:", min_value=1000, max_value=1000000, value=DEFAULT_CHUNK_ROWS, step=1000
+            ) if stream_to_file else DEFAULT_CHUNK_ROWS
         
         # Variables to consider
         st.subheader("Profiling Variables")
@@ -288,6 +579,53 @@ def main():
         for field in ["DemographicSegment", "DeviceType", "CurrentPlan", "VASUsed"]:
             variables[field] = st.checkbox(field, value=True)
         
+        # Recommendation engine
+        st.subheader("Recommendation Engine")
+        engine = st.radio(
+            "Choose products with:",
+            list(ENGINE_LABELS),
+            format_func=ENGINE_LABELS.get
+        )
+        explain_with_model = False
+        num_segments = DEFAULT_NUM_CLUSTERS
+        if engine == ENGINE_FAST:
+            explain_with_model = st.checkbox("Write reasons and insights with Gemini AI", value=False)
+        elif engine == ENGINE_SEGMENTS:
+            num_segments = st.number_input("Number of segments:", min_value=2, max_value=500, value=DEFAULT_NUM_CLUSTERS)
+        apply_eligibility = st.checkbox(
+            "Only recommend eligible products",
+            value=True,
+            help="Skips products priced far above the subscriber's ARPU, outside their plan's tier range, "
+                 "unusable on their device or duplicating a VAS they already have"
+        )
+        
+        # Batch settings
+        with st.expander("Performance Settings"):
+            batch_size = st.number_input("Subscribers per batch (0 = auto):", min_value=0, max_value=MAX_BATCH_SIZE, value=AUTO_BATCH_SIZE)
+            max_concurrency = st.number_input("Concurrent batches:", min_value=1, max_value=32, value=DEFAULT_MAX_CONCURRENCY)
+            candidate_top_k = st.number_input("Catalogue products per prompt (0 = all):", min_value=0, max_value=500, value=DEFAULT_CANDIDATE_TOP_K)
+            output_mode = st.selectbox(
+                "Model output format:",
+                list(OUTPUT_MODE_LABELS),
+                index=list(OUTPUT_MODE_LABELS).index(DEFAULT_OUTPUT_MODE),
+                format_func=OUTPUT_MODE_LABELS.get
+            )
+            stream_results = st.checkbox("Stream results as they are generated", value=True)
+            dedupe_profiles = st.checkbox(
+                "One model answer per distinct profile",
+                value=True,
+                help="Subscribers with the same profiling variables and usage buckets share one recommendation"
+            )
+            reuse_neighbours = st.checkbox(
+                "Reuse answers of near-identical subscribers",
+                value=False,
+                help="A subscriber whose profile is within the distance below of one already answered by the "
+                     "model takes that answer without a model call"
+            )
+            reuse_distance = st.number_input(
+                "Reuse distance:", min_value=0.0, max_value=5.0, value=DEFAULT_MAX_DISTANCE, step=0.05
+            ) if reuse_neighbours else None
+        
         # Run button
         run_button = st.button("Run Analysis", type="primary")
     
@@ -295,34 +633,86 @@ def main():
     if not cloud_initialized:
         st.warning("Google Cloud API is not initialized. Please check your credentials.")
     
-    # Load data
-    subscriber_df, product_df = load_data()
-    if subscriber_df is None or product_df is None:
+    # Load data; a chunked "All MSISDNs" run reads the subscriber file itself, so the base is not loaded
+    stream_all = selection_mode == "All MSISDNs" and stream_to_file and engine != ENGINE_SEGMENTS
+    product_df = load_product_data()
+    subscriber_df = load_subscriber_data() if not stream_all else None
+    if product_df is None or (subscriber_df is None and not stream_all):
         st.error("Failed to load data files. Please check if the files exist.")
         return
     
     # Run analysis when button is clicked
     if run_button:
+        results_file = None
         # Select subscribers based on mode
         if selection_mode == "Specific MSISDN":
             try:
                 msisdn = int(specific_msisdn)
-                selected_subscribers = subscriber_df[subscriber_df['MSISDN'] == msisdn]
+                selected_subscribers = subscriber_df.iloc[get_msisdn_index().lookup(msisdn)]
                 if selected_subscribers.empty:
                     st.error(f"MSISDN {msisdn} not found in dataset.")
                     return
             except:
                 st.error("Invalid MSISDN format. Please enter a valid number.")
                 return
+        elif selection_mode == "List of MSISDNs":
+            # Pasted and uploaded numbers are normalized together and resolved in one indexed join
+            requested = [split_msisdn_text(pasted_msisdns)]
+            if uploaded_msisdns is not None:
+                try:
+                    requested.append(read_msisdn_upload(uploaded_msisdns.getvalue(), uploaded_msisdns.name))
+                except Exception as e:
+                    st.error(f"Failed to read {uploaded_msisdns.name}: {str(e)}")
+                    return
+            requested = pd.concat(requested, ignore_index=True)
+            if requested.empty:
+                st.error("Paste or upload at least one MSISDN.")
+                return
+            
+            positions, misses = get_msisdn_index().resolve(requested, COUNTRY_CODES)
+            if not misses.empty:
+                st.warning(f"{len(misses):,} of {len(requested):,} MSISDNs were not found in the dataset.")
+                with st.expander("Unmatched MSISDNs"):
+                    st.dataframe(misses, use_container_width=True)
+            if len(positions) == 0:
+                st.error("None of the MSISDNs were found in the dataset.")
+                return
+            st.caption(f"Matched {len(positions):,} subscribers from {len(requested):,} MSISDNs")
+            selected_subscribers = subscriber_df.iloc[positions]
         elif selection_mode == "Random sample of MSISDNs":
             selected_subscribers = subscriber_df.sample(min(random_count, len(subscriber_df)))
         else:  # All MSISDNs
-            selected_subscribers = subscriber_df.copy()
+            selected_subscribers = subscriber_df
         
         # Generate recommendations
-        table_df, explanation_text, full_response = generate_recommendations(
-            selected_subscribers, product_df, variables
-        )
+        if stream_all:
+            table_df, explanation_text, full_response, results_file = generate_chunked_recommendations(
+                product_df, variables, engine, chunk_rows=chunk_rows,
+                batch_size=batch_size, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+                output_mode=output_mode, apply_eligibility=apply_eligibility, dedupe_profiles=dedupe_profiles,
+                explain_with_model=explain_with_model
+            )
+            # The subscribers behind the preview rows, matched by MSISDN
+            selected_subscribers = preview_subscribers(SUBSCRIBER_FILE, table_df, chunk_rows)
+        elif engine == ENGINE_SEGMENTS:
+            table_df, explanation_text, full_response = generate_segment_recommendations(
+                selected_subscribers, product_df, variables,
+                num_segments=num_segments, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+                output_mode=output_mode, apply_eligibility=apply_eligibility
+            )
+        elif engine == ENGINE_FAST:
+            table_df, explanation_text, full_response = generate_fast_recommendations(
+                selected_subscribers, product_df, variables,
+                explain_with_model=explain_with_model, max_concurrency=max_concurrency,
+                apply_eligibility=apply_eligibility
+            )
+        else:
+            table_df, explanation_text, full_response = generate_recommendations(
+                selected_subscribers, subscriber_df, product_df, variables,
+                batch_size=batch_size, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+                output_mode=output_mode, stream_results=stream_results, apply_eligibility=apply_eligibility,
+                dedupe_profiles=dedupe_profiles, reuse_distance=reuse_distance
+            )
         
         # Store results in session state
         st.session_state.has_run_analysis = True
@@ -332,6 +722,7 @@ def main():
         st.session_state.selected_subscribers = selected_subscribers
         st.session_state.selection_mode = selection_mode
         st.session_state.variables = variables
+        st.session_state.results_file = results_file
     
     # Display results if analysis has been run
     if st.session_state.has_run_analysis and st.session_state.table_df is not None:
@@ -342,6 +733,7 @@ def main():
         selected_subscribers = st.session_state.selected_subscribers
         selection_mode = st.session_state.selection_mode
         variables = st.session_state.variables
+        results_file = st.session_state.results_file
         
         # Display results in tabs
         tabs = st.tabs(["Recommendations", "Upsell & Cross-sell Insights", "Comparison View", "Raw Data"])
@@ -352,6 +744,8 @@ def main():
             st.dataframe(selected_subscribers, use_container_width=True)
             
             st.subheader("Recommended Products")
+            if results_file:
+                st.caption(f"Showing the first {len(table_df):,} rows of {results_file}")
             # Modified styling to be more subtle and improve visibility
             st.dataframe(
                 table_df.style.apply(
@@ -374,6 +768,20 @@ def main():
                     key='download-csv',
                     on_click=lambda: None  # Prevents reload
                 )
+                # The full results of a chunked run stay on disk; offered as a download up to MAX_DOWNLOAD_MB
+                if results_file and os.path.exists(results_file):
+                    if os.path.getsize(results_file) <= MAX_DOWNLOAD_MB * 1024 * 1024:
+                        with open(results_file, "rb") as f:
+                            st.download_button(
+                                "Download Full Results CSV",
+                                f.read(),
+                                os.path.basename(results_file),
+                                "text/csv",
+                                key='download-full-csv',
+                                on_click=lambda: None  # Prevents reload
+                            )
+                    else:
+                        st.caption(f"Full results: {results_file} (insights in {insights_path_for(results_file)})")
             
             with col2:
                 buffer = BytesIO()
@@ -491,7 +899,10 @@ def main():
         # Raw Data tab
         with tabs[3]:
             st.subheader("Raw Subscriber Data")
-            st.dataframe(subscriber_df, use_container_width=True)
+            if subscriber_df is not None:
+                st.dataframe(subscriber_df, use_container_width=True)
+            else:
+                st.caption("The subscriber base is not loaded for chunked runs; see the results file instead.")
             
             st.subheader("Product Catalogue")
             st.dataframe(product_df, use_container_width=True)
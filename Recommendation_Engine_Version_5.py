@@ -8,13 +8,22 @@ Created on Thu Mar 27 16:20:46 2025
 import os
 import re
 import requests
-import vertexai
 import pandas as pd
 import tkinter as tk
-from io import StringIO
 from tkinter import ttk, scrolledtext, filedialog, messagebox
 from PIL import Image, ImageTk
-from vertexai.preview.generative_models import GenerativeModel
+from recommendation_pipeline import generate_batched, estimate_prompt_tokens, prompt_template_for, OUTPUT_MODE_JSON
+from batch_planner import plan_batches
+from fast_recommender import recommend_fast
+from segmentation import SubscriberSegmenter, generate_segmented
+from neighbour_reuse import NeighbourIndex
+from recommendation_cache import make_context_key
+from subscriber_store import load_subscribers, iter_subscribers, source_version
+from chunked_pipeline import generate_chunked, write_chunked, read_results_preview, preview_subscribers
+from msisdn_index import get_msisdn_index, split_msisdn_text, read_msisdn_upload
+from model_backends import create_backend, DEFAULT_BACKEND
+from resilience import ResilientModel, get_circuit_breaker
+from rate_limiter import SharedRateLimiter, RateLimitedModel
 import threading
 import time
 
@@ -26,6 +35,35 @@ PRODUCT_FILE = "./ProductCatalogue.csv"
 CREDENTIALS_FILE = "./hackathon2025-454908-0a52f19ef9b1.json"
 #CREDENTIALS_FILE = "./testproject-21156-533ad1f570c0.json"
 LOGO_FILE = "./New-mtn-logo.jpg"
+PROJECT_ID = "hackathon2025-454908"
+# PROJECT_ID = "testproject-21156"
+LOCATION = "us-central1"
+MODEL_NAME = "gemini-2.0-flash-001"
+MODEL_BACKEND = DEFAULT_BACKEND  # "local" runs the deterministic offline stand-in instead of Vertex AI
+BATCH_SIZE = None  # None lets the batch planner size batches to the model limits
+MAX_CONCURRENCY = 4
+CANDIDATE_TOP_K = 12
+RATE_LIMIT_FILE = "./rate_limit.db"
+RATE_LIMIT_REQUESTS_PER_MINUTE = 60
+RATE_LIMIT_TOKENS_PER_MINUTE = 1000000
+OUTPUT_MODE = OUTPUT_MODE_JSON  # OUTPUT_MODE_IDS fills names, category, tier and price from the catalogue
+FAST_PATH = False  # True picks products with the local scorer instead of Gemini
+FAST_PATH_EXPLAIN = False  # With FAST_PATH, let Gemini write the reasons and insights for the chosen rows
+APPLY_ELIGIBILITY = True  # Only offer products the subscriber can afford and use (see eligibility.py)
+DEDUPE_PROFILES = True  # Send one subscriber per distinct profile to Gemini and share its answer
+SEGMENT_CLUSTERS = 0  # >0 asks Gemini once per k-means segment and personalizes each member locally
+NEIGHBOUR_REUSE_DISTANCE = None  # e.g. 0.25 reuses the answer of a near-identical subscriber from this session
+COUNTRY_CODES = ("256",)  # Stripped from listed MSISDNs; any other extra leading digits make a miss
+CHUNK_ROWS = None  # e.g. 50000 streams "All MSISDNs" through in chunks of this many rows, appending to CHUNKED_OUTPUT_FILE
+CHUNKED_OUTPUT_FILE = "./MTN_Recommendations_All.csv"
+
+model_backend = create_backend(
+    MODEL_BACKEND, MODEL_NAME, credentials_file=CREDENTIALS_FILE, project=PROJECT_ID, location=LOCATION
+)
+# Fitted on the full base at the first segmented run; later runs only fold in new subscribers
+segmenter = SubscriberSegmenter(num_clusters=SEGMENT_CLUSTERS or 1)
+# Subscribers Gemini answered this session, searched for near-identical profiles
+neighbour_index = NeighbourIndex()
 
 # === CATEGORY COLORS ===
 category_colors = {
@@ -41,12 +79,7 @@ def check_integration_health():
     status = {}
     tooltips = {}
     try:
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_FILE
-        vertexai.init(project="hackathon2025-454908", location="us-central1")
-        # vertexai.init(project="testproject-21156", location="us-central1")
-        model = GenerativeModel("gemini-2.0-flash-001")
-        model.generate_content("ping")
-        status["Gemini API"] = True
+        status["Gemini API"] = model_backend.health_check()
     except Exception as e:
         status["Gemini API"] = False
         print(e)
@@ -253,14 +286,26 @@ def run_analysis_gui(params):
     def run_analysis_thread():
         try:
             status_var.set("Loading subscriber and product data...")
-            model = GenerativeModel("gemini-2.0-flash-001")
+            model_backend.initialize()
+            # Each batch retries transient errors on its own; the shared breaker fails fast when Gemini is down
+            limiter = SharedRateLimiter(
+                model_backend.model_id, RATE_LIMIT_FILE,
+                requests_per_minute=RATE_LIMIT_REQUESTS_PER_MINUTE, tokens_per_minute=RATE_LIMIT_TOKENS_PER_MINUTE
+            )
+            model = ResilientModel(
+                RateLimitedModel(model_backend.get_model(), limiter), breaker=get_circuit_breaker(model_backend.model_id)
+            )
             
+            mode = params['selection_mode'].get()
+            # A chunked "All MSISDNs" run reads the subscriber file itself and never loads the whole base
+            stream_all = mode == 'all' and bool(CHUNK_ROWS) and not SEGMENT_CLUSTERS
             try:
-                subscriber_df = pd.read_csv(SUBSCRIBER_FILE, on_bad_lines='skip', nrows=50)
-                product_df = pd.read_csv(PRODUCT_FILE, on_bad_lines='skip', nrows=20)
+                # Typed and compact (categoricals, float32 metrics); read from the Parquet copy of the CSV,
+                # built on first load, when pyarrow is installed
+                subscriber_df = load_subscribers(SUBSCRIBER_FILE, compact=True) if not stream_all else None
+                product_df = pd.read_csv(PRODUCT_FILE, on_bad_lines='skip')
                 
                 # Clean column names
-                subscriber_df.columns = [str(col).strip() for col in subscriber_df.columns]
                 product_df.columns = [str(col).strip() for col in product_df.columns]
                 
             except Exception as e:
@@ -268,13 +313,36 @@ def run_analysis_gui(params):
                 messagebox.showerror("Error", f"Failed to load data: {str(e)}")
                 return
 
-            mode = params['selection_mode'].get()
+            variables = {k: v.get() for k, v in params['variables'].items()}
+            # One line about how the run went, shown under the title of the results window
+            run_summary = ""
             if mode == 'specific':
                 msisdn = params['specific_msisdn'].get()
-                selected_subscribers = subscriber_df[subscriber_df['MSISDN'] == int(msisdn)]
+                # The index is built on the first lookup and kept until the subscriber file changes
+                msisdn_index = get_msisdn_index(subscriber_df['MSISDN'], source_version(SUBSCRIBER_FILE))
+                selected_subscribers = subscriber_df.iloc[msisdn_index.lookup(msisdn.strip())]
                 if selected_subscribers.empty:
                     messagebox.showerror("Error", f"MSISDN {msisdn} not found in dataset.")
                     return
+            elif mode == 'list':
+                requested = split_msisdn_text(params['msisdn_list'].get())
+                if requested.empty:
+                    loading_window.destroy()
+                    messagebox.showerror("Error", "Paste or load at least one MSISDN.")
+                    return
+                # Normalized and resolved against the MSISDN index in one join
+                msisdn_index = get_msisdn_index(subscriber_df['MSISDN'], source_version(SUBSCRIBER_FILE))
+                positions, misses = msisdn_index.resolve(requested, COUNTRY_CODES)
+                if len(positions) == 0:
+                    loading_window.destroy()
+                    messagebox.showerror("Error", "None of the MSISDNs were found in the dataset.")
+                    return
+                if not misses.empty:
+                    shown = ", ".join(misses["Input"].astype(str).head(20)) + (", ..." if len(misses) > 20 else "")
+                    messagebox.showwarning(
+                        "Unmatched MSISDNs", f"{len(misses)} of {len(requested)} MSISDNs were not found:\n{shown}"
+                    )
+                selected_subscribers = subscriber_df.iloc[positions]
             elif mode == 'random':
                 try:
                     n = int(params['random_count'].get())
@@ -282,45 +350,114 @@ def run_analysis_gui(params):
                 except:
                     messagebox.showerror("Error", "Invalid number for random MSISDNs.")
                     return
+            elif not stream_all:
+                selected_subscribers = subscriber_df
+
+            if stream_all:
+                # Each chunk is generated and appended to CHUNKED_OUTPUT_FILE; only a preview is shown
+                chunks = iter_subscribers(SUBSCRIBER_FILE, CHUNK_ROWS, compact=True)
+                if FAST_PATH:
+                    progress_stream = write_chunked(
+                        chunks,
+                        lambda chunk: recommend_fast(
+                            chunk, product_df, variables, model=model if FAST_PATH_EXPLAIN else None,
+                            max_concurrency=MAX_CONCURRENCY, apply_eligibility=APPLY_ELIGIBILITY
+                        ),
+                        CHUNKED_OUTPUT_FILE
+                    )
+                else:
+                    progress_stream = generate_chunked(
+                        model, chunks, product_df, variables, CHUNKED_OUTPUT_FILE, MODEL_NAME,
+                        batch_size=BATCH_SIZE, max_concurrency=MAX_CONCURRENCY, candidate_top_k=CANDIDATE_TOP_K,
+                        output_mode=OUTPUT_MODE, apply_eligibility=APPLY_ELIGIBILITY, dedupe_profiles=DEDUPE_PROFILES
+                    )
+                progress = {"chunks": 0, "subscribers": 0, "rows": 0, "seconds": 0.0, "failed_chunks": 0, "failed_subscribers": 0}
+                for progress in progress_stream:
+                    status_var.set(
+                        f"Chunk {progress['chunks']:,}: {progress['subscribers']:,} subscribers, "
+                        f"{progress['rows']:,} recommendations written..."
+                    )
+                table_df, explanation_text = read_results_preview(CHUNKED_OUTPUT_FILE)
+                run_summary = response_text = (
+                    f"{progress['subscribers']:,} subscribers in {progress['chunks']:,} chunks; "
+                    f"{progress['rows']:,} recommendations written to {CHUNKED_OUTPUT_FILE} "
+                    f"(the tables below show the first {len(table_df) if table_df is not None else 0:,})"
+                )
+                if progress['failed_chunks']:
+                    run_summary = response_text = (
+                        f"{run_summary}; {progress['failed_chunks']:,} chunk(s) with "
+                        f"{progress['failed_subscribers']:,} subscribers failed and have no results"
+                    )
+                # The subscribers behind the preview rows, matched by MSISDN
+                selected_subscribers = preview_subscribers(SUBSCRIBER_FILE, table_df, CHUNK_ROWS)
+            elif FAST_PATH:
+                # Products are chosen locally; Gemini only phrases the reasons when asked to
+                status_var.set("Scoring subscribers against the catalogue...")
+                table_df, explanation_text, response_text = recommend_fast(
+                    selected_subscribers, product_df, variables,
+                    model=model if FAST_PATH_EXPLAIN else None, max_concurrency=MAX_CONCURRENCY,
+                    apply_eligibility=APPLY_ELIGIBILITY
+                )
+            elif SEGMENT_CLUSTERS:
+                # One Gemini answer per k-means segment, personalized locally for each member
+                if segmenter.centers is None:
+                    status_var.set("Segmenting subscriber base...")
+                    segmenter.fit(subscriber_df)
+                plan = plan_batches(
+                    selected_subscribers, product_df, variables, MODEL_NAME, CANDIDATE_TOP_K, OUTPUT_MODE
+                )
+                status_var.set("Generating AI recommendations per segment...")
+                table_df, explanation_text, response_text = generate_segmented(
+                    model, selected_subscribers, product_df, variables, segmenter,
+                    apply_eligibility=APPLY_ELIGIBILITY, batch_size=BATCH_SIZE or plan["batch_size"],
+                    max_concurrency=MAX_CONCURRENCY, candidate_top_k=CANDIDATE_TOP_K, output_mode=OUTPUT_MODE,
+                    generation_config={"max_output_tokens": plan["max_output_tokens"]}
+                )
             else:
-                selected_subscribers = subscriber_df.copy()
+                # Subscribers close to one Gemini already answered under the same settings take that answer
+                requested_subscribers, reused_df = selected_subscribers, None
+                if NEIGHBOUR_REUSE_DISTANCE is not None:
+                    if neighbour_index.encoder is None:
+                        neighbour_index.fit(subscriber_df)
+                    context_key = make_context_key(
+                        product_df, variables, model_backend.model_id, prompt_template_for(OUTPUT_MODE),
+                        {"candidate_top_k": CANDIDATE_TOP_K, "eligibility": APPLY_ELIGIBILITY, "dedupe_profiles": DEDUPE_PROFILES}
+                    )
+                    reused_df, selected_subscribers, reuse_stats = neighbour_index.reuse(
+                        selected_subscribers, context_key, NEIGHBOUR_REUSE_DISTANCE, product_df, APPLY_ELIGIBILITY
+                    )
+                    if reuse_stats["hits"]:
+                        run_summary = (
+                            f"Reused the nearest answered subscriber for {reuse_stats['hits']:,} of "
+                            f"{reuse_stats['queries']:,} subscribers (mean distance {reuse_stats['mean_hit_distance']:.3f})"
+                        )
 
-            subscriber_data_str = selected_subscribers.to_string(index=False)
-            product_data_str = product_df.to_string(index=False)
-            filters = "\n".join(f"- Include {k}" for k, v in params['variables'].items() if v.get())
+                plan = plan_batches(
+                    selected_subscribers, product_df, variables, MODEL_NAME, CANDIDATE_TOP_K, OUTPUT_MODE
+                )
+                batch_size = BATCH_SIZE or plan["batch_size"]
+                generation_config = {"max_output_tokens": plan["max_output_tokens"]}
+                token_counts = estimate_prompt_tokens(
+                    selected_subscribers, product_df, variables, batch_size, CANDIDATE_TOP_K, OUTPUT_MODE,
+                    APPLY_ELIGIBILITY, DEDUPE_PROFILES
+                )
 
-            prompt = f"""
-    Compare the data and use it to compare with the product catalogue below. Recommend one product for each of the following subscribers:
-    
-    {subscriber_data_str}
-    
-    Use the product catalogue below:
-    
-    {product_data_str}
-    
-    Variables to consider for profiling:
-    {filters}
-    
-    Output a clean markdown-style table with the following columns exactly:
-    MSISDN | RecommendedProduct  | Category | Tier | ProductPrice | Reason | UpsellOption | CrossSellOption
-    use product names instaed of product codes
-    After the table, include a short bullet-point section with additional upsell and cross-sell insights or strategy tips. Do not include general commentary—just the table and the follow-up list.
-    always make the recomednations always .
-    """
-
-            response = model.generate_content(prompt)
-            response_text = response.text
-            potential_table_match = re.search(r"((?:\|.+\|\n)+)", response_text)
-            table_df = None
-            if potential_table_match:
-                table_text = potential_table_match.group(1)
-                try:
-                    table_df = pd.read_csv(StringIO(table_text), sep="|", engine='python')
-                    table_df = table_df.dropna(axis=1, how='all').dropna(axis=0, how='all')
-                    table_df.columns = [col.strip() for col in table_df.columns]
-                except:
-                    table_df = None
-            explanation_text = response_text.replace(table_text, "") if potential_table_match else "No additional upsell/cross-sell insights were provided."
+                # Subscribers are sent in concurrent batches and merged back into one table
+                status_var.set(f"Generating AI recommendations (~{sum(token_counts):,} input tokens)...")
+                table_df, explanation_text, response_text = generate_batched(
+                    model, selected_subscribers, product_df, variables,
+                    batch_size=batch_size, max_concurrency=MAX_CONCURRENCY, candidate_top_k=CANDIDATE_TOP_K,
+                    generation_config=generation_config, output_mode=OUTPUT_MODE, apply_eligibility=APPLY_ELIGIBILITY,
+                    dedupe_profiles=DEDUPE_PROFILES
+                ) if not selected_subscribers.empty else (None, "", "")
+                if NEIGHBOUR_REUSE_DISTANCE is not None:
+                    neighbour_index.add(table_df, selected_subscribers, context_key)
+                    if reused_df is not None:
+                        table_df = pd.concat([reused_df, table_df], ignore_index=True)
+                        response_text = f"Reused answers for {len(reused_df)} subscriber(s)\n\n{response_text}"
+                    selected_subscribers = requested_subscribers
+
+            subscriber_data_str = selected_subscribers.to_string(index=False)
 
             # In the run_analysis_gui function, update the GUI layout section:
             gui = tk.Toplevel()
@@ -331,6 +468,8 @@ def run_analysis_gui(params):
             # Main title
             ttk.Label(gui, text="Gemini AI Product Recommendations for Subscribers", 
                       font=("Arial", 18, "bold"), background="#f0f4f8").pack(pady=10)
+            if run_summary:
+                ttk.Label(gui, text=run_summary, font=("Arial", 10), background="#f0f4f8").pack()
 
             # Create horizontal paned window for tables
             table_paned = ttk.PanedWindow(gui, orient=tk.HORIZONTAL)
@@ -627,6 +766,12 @@ except:
 # Title
 ttk.Label(launcher, text="Amabutho AI Product Recommendation Engine", font=("Arial", 14, "bold"), background="#eef5f9").pack(pady=5)
 
+# Warm the shared model client once at startup so each analysis only pays for inference
+try:
+    model_backend.get_model()
+except Exception as e:
+    print(f"Model warm-up failed: {e}")
+
 # Health Check Frame
 status, tooltips = check_integration_health()
 health_frame = ttk.LabelFrame(launcher, text="Integration Health Check", padding=10)
@@ -659,7 +804,8 @@ params = {
     "variables": {},
     "selection_mode": tk.StringVar(value="random"),
     "random_count": tk.StringVar(value="4"),
-    "specific_msisdn": tk.StringVar()
+    "specific_msisdn": tk.StringVar(),
+    "msisdn_list": tk.StringVar()
 }
 
 # MSISDN Input
@@ -667,6 +813,26 @@ ttk.Label(settings_frame, text="Select MSISDN Input Method:").pack(anchor="w")
 ttk.Radiobutton(settings_frame, text="Specific MSISDN", variable=params["selection_mode"], value="specific").pack(anchor="w")
 ttk.Entry(settings_frame, textvariable=params["specific_msisdn"]).pack(fill="x", pady=2)
 
+# Bulk list: pasted (comma, semicolon or newline separated) or loaded from a CSV, TXT or Excel file
+def load_msisdn_file():
+    path = filedialog.askopenfilename(filetypes=[("MSISDN lists", "*.csv *.txt *.xlsx"), ("All files", "*.*")])
+    if not path:
+        return
+    try:
+        with open(path, "rb") as f:
+            values = read_msisdn_upload(f.read(), os.path.basename(path))
+    except Exception as e:
+        messagebox.showerror("Error", f"Failed to read {os.path.basename(path)}: {str(e)}")
+        return
+    params["msisdn_list"].set(", ".join(values.astype(str)))
+    params["selection_mode"].set("list")
+
+ttk.Radiobutton(settings_frame, text="List of MSISDNs", variable=params["selection_mode"], value="list").pack(anchor="w")
+msisdn_list_frame = ttk.Frame(settings_frame)
+msisdn_list_frame.pack(fill="x", pady=2)
+ttk.Entry(msisdn_list_frame, textvariable=params["msisdn_list"]).pack(side="left", fill="x", expand=True)
+ttk.Button(msisdn_list_frame, text="Load file...", command=load_msisdn_file).pack(side="left", padx=(5, 0))
+
 ttk.Radiobutton(settings_frame, text="Random sample of MSISDNs", variable=params["selection_mode"], value="random").pack(anchor="w")
 ttk.Entry(settings_frame, textvariable=params["random_count"]).pack(fill="x", pady=2)
 
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Batch Planner
+Chooses batch sizes that keep every prompt and response inside the model's token limits
+"""
+
+import math
+from prompt_serializer import serialize_subscribers, serialize_products, estimate_tokens
+from recommendation_pipeline import (
+    OUTPUT_MODE_MARKDOWN, OUTPUT_MODE_JSON, OUTPUT_MODE_IDS, prompt_template_for, product_columns_for
+)
+
+# Token limits per model
+MODEL_LIMITS = {
+    "gemini-1.5-flash-001": {"context_tokens": 1000000, "max_output_tokens": 8192},
+    "gemini-2.0-flash-001": {"context_tokens": 1000000, "max_output_tokens": 8192},
+}
+DEFAULT_MODEL_LIMITS = {"context_tokens": 32768, "max_output_tokens": 8192}
+
+# Output budget: one table row per subscriber plus the insights section
+OUTPUT_TOKENS_PER_ROW = 80
+OUTPUT_TOKENS_PER_ROW_BY_MODE = {
+    OUTPUT_MODE_MARKDOWN: OUTPUT_TOKENS_PER_ROW,
+    OUTPUT_MODE_JSON: 90,
+    OUTPUT_MODE_IDS: 35,
+}
+INSIGHTS_OUTPUT_TOKENS = 400
+
+# Share of each limit the plan may use, leaving room for estimation error
+SAFETY_MARGIN = 0.8
+
+# Rows per batch are also capped so one bad response never costs too much work
+MAX_BATCH_SIZE = 50
+SAMPLE_ROWS = 200
+
+def get_model_limits(model_name):
+    return MODEL_LIMITS.get(model_name, DEFAULT_MODEL_LIMITS)
+
+# Average input tokens per serialized row, measured on a sample of the frame
+def tokens_per_row(df, serialize):
+    if df.empty:
+        return 0
+    sample = df.head(SAMPLE_ROWS)
+    header_tokens = estimate_tokens(serialize(sample.head(0)))
+    return max(1, math.ceil((estimate_tokens(serialize(sample)) - header_tokens) / len(sample)))
+
+# Pick a batch size that fits both the context window and max_output_tokens
+def plan_batches(selected_subscribers, product_df, variables, model_name, candidate_top_k=None,
+                 output_mode=OUTPUT_MODE_MARKDOWN):
+    limits = get_model_limits(model_name)
+    prompt_template = prompt_template_for(output_mode)
+    output_tokens_per_row = OUTPUT_TOKENS_PER_ROW_BY_MODE.get(output_mode, OUTPUT_TOKENS_PER_ROW)
+    catalogue_rows = min(candidate_top_k, len(product_df)) if candidate_top_k else len(product_df)
+
+    subscriber_row_tokens = tokens_per_row(selected_subscribers, lambda df: serialize_subscribers(df, variables))
+    # The catalogue as the prompt shows it in this output mode
+    product_columns = product_columns_for(output_mode)
+    catalogue_tokens = tokens_per_row(product_df, lambda df: serialize_products(df, columns=product_columns)) * catalogue_rows
+    fixed_tokens = estimate_tokens(prompt_template) + catalogue_tokens
+
+    input_budget = limits["context_tokens"] * SAFETY_MARGIN - fixed_tokens
+    output_budget = limits["max_output_tokens"] * SAFETY_MARGIN - INSIGHTS_OUTPUT_TOKENS
+    by_input = input_budget // max(subscriber_row_tokens, 1)
+    by_output = output_budget // output_tokens_per_row
+    batch_size = int(max(1, min(by_input, by_output, MAX_BATCH_SIZE)))
+
+    num_batches = math.ceil(len(selected_subscribers) / batch_size) if len(selected_subscribers) else 0
+    return {
+        "batch_size": batch_size,
+        "num_batches": num_batches,
+        "input_tokens_per_batch": int(fixed_tokens + subscriber_row_tokens * batch_size),
+        "output_tokens_per_batch": INSIGHTS_OUTPUT_TOKENS + output_tokens_per_row * batch_size,
+        "max_output_tokens": limits["max_output_tokens"],
+    }
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Subscriber Load Benchmark
+Compares load time and peak RSS of the CSV and Parquet subscriber loaders on a synthetic file, and
+the memory per million rows of the typed and compact in-memory layouts
+
+Usage: python benchmark_subscriber_store.py [--rows 2000000] [--workdir bench_data]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import numpy as np
+import pandas as pd
+from subscriber_store import (
+    read_csv_typed, read_parquet_dataset, convert_csv_to_parquet, pyarrow_available, compact_subscribers,
+    memory_per_million_rows, dataset_parts
+)
+
+SAMPLE_FILE = "SubscriberProfileData.csv"
+# Columns a recommendation run typically needs when only a few profiling variables are switched on
+PROJECTED_COLUMNS = ["MSISDN", "AvgDataLast90Days (GB)", "CurrentPlan", "VASUsed", "ARPU"]
+
+LOADERS = {
+    "csv (pd.read_csv, inferred)": lambda csv_path, dataset_dir: pd.read_csv(csv_path, on_bad_lines="skip"),
+    "csv (typed)": lambda csv_path, dataset_dir: read_csv_typed(csv_path),
+    "csv (typed, projected)": lambda csv_path, dataset_dir: read_csv_typed(csv_path, PROJECTED_COLUMNS),
+    "csv (typed, compact)": lambda csv_path, dataset_dir: compact_subscribers(read_csv_typed(csv_path)),
+    "parquet": lambda csv_path, dataset_dir: read_parquet_dataset(dataset_dir),
+    "parquet (projected)": lambda csv_path, dataset_dir: read_parquet_dataset(dataset_dir, PROJECTED_COLUMNS),
+    "parquet (compact)": lambda csv_path, dataset_dir: compact_subscribers(read_parquet_dataset(dataset_dir, categories=True)),
+}
+
+def peak_rss_mb():
+    # VmHWM is this process's own high-water mark; ru_maxrss survives exec and so includes the parent's
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+    except (OSError, StopIteration):
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Tile the sample rows to the requested size with unique MSISDNs and jittered usage
+def write_synthetic_csv(path, rows, seed=0):
+    sample = pd.read_csv(SAMPLE_FILE, on_bad_lines="skip")
+    sample.columns = [str(col).strip() for col in sample.columns]
+    random = np.random.default_rng(seed)
+    chunk_rows = 500000
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        chunk = sample.iloc[random.integers(len(sample), size=n)].reset_index(drop=True)
+        chunk["MSISDN"] = 770000000000 + start + np.arange(n)
+        for col in ["AvgDataLast90Days (GB)", "ARPU"]:
+            chunk[col] = (chunk[col] * random.uniform(0.5, 1.5, n)).round(2)
+        for col in ["AvgVoiceLast90Days (min)", "AvgSMSLast90Days"]:
+            chunk[col] = (chunk[col] * random.uniform(0.5, 1.5, n)).round().astype(int)
+        chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+# Run one loader in this (fresh) process and print its timing as JSON
+def run_child(loader, csv_path, dataset_dir):
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    df = LOADERS[loader](csv_path, dataset_dir)
+    seconds = time.perf_counter() - started
+    print(json.dumps({
+        "loader": loader,
+        "rows": len(df),
+        "columns": len(df.columns),
+        "seconds": seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "baseline_rss_mb": baseline,
+        "frame_mb": df.memory_usage(deep=True).sum() / (1024 * 1024),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[1])
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--workdir", default="bench_data")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    csv_path = os.path.join(args.workdir, "subscribers.csv")
+    dataset_dir = os.path.join(args.workdir, "subscribers.parquet")
+    if args.child:
+        run_child(args.child, csv_path, dataset_dir)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    print(f"Writing {args.rows:,} synthetic subscribers to {csv_path}...")
+    write_synthetic_csv(csv_path, args.rows)
+    print(f"CSV size: {os.path.getsize(csv_path) / (1024 * 1024):,.1f} MB")
+
+    loaders = list(LOADERS)
+    if pyarrow_available():
+        started = time.perf_counter()
+        convert_csv_to_parquet(csv_path, dataset_dir)
+        size = sum(os.path.getsize(part) for part in dataset_parts(dataset_dir))
+        print(f"One-off Parquet conversion: {time.perf_counter() - started:.2f}s, {size / (1024 * 1024):,.1f} MB on disk")
+    else:
+        print("pyarrow is not installed; only the CSV loaders are measured")
+        loaders = [loader for loader in loaders if not loader.startswith("parquet")]
+
+    print(f"\n{'Loader':<30}{'Rows':>12}{'Cols':>6}{'Load (s)':>10}{'Peak RSS (MB)':>15}{'Load RSS (MB)':>15}{'Frame (MB)':>12}")
+    for loader in loaders:
+        # Each loader runs in its own interpreter so peak RSS is not carried over between them
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--rows", str(args.rows), "--workdir", args.workdir, "--child", loader],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{loader:<30}{result['rows']:>12,}{result['columns']:>6}{result['seconds']:>10.2f}"
+            f"{result['peak_rss_mb']:>15,.0f}{result['peak_rss_mb'] - result['baseline_rss_mb']:>15,.0f}"
+            f"{result['frame_mb']:>12,.0f}"
+        )
+
+    # Per-column footprint of the loaded frame before and after compact_subscribers
+    typed = read_csv_typed(csv_path)
+    report = pd.DataFrame({
+        "typed (MB / 1M rows)": memory_per_million_rows(typed) / (1024 * 1024),
+        "compact (MB / 1M rows)": memory_per_million_rows(compact_subscribers(typed)) / (1024 * 1024),
+    })
+    print(f"\n{report.round(1).to_string()}")
+
+if __name__ == "__main__":
+    main()
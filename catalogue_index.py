@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Catalogue Candidate Index
+Local TF-IDF index over the product catalogue used to shortlist products for each prompt
+"""
+
+import re
+import hashlib
+import threading
+import numpy as np
+
+# Retrieval defaults
+DEFAULT_CANDIDATE_TOP_K = 12
+CANDIDATES_PER_SUBSCRIBER = 4
+MAX_CACHED_INDEXES = 4
+
+INDEX_TEXT_COLUMNS = ["ProductName", "ProductDescription", "Category", "Tier"]
+
+# Usage thresholds above which a subscriber counts as a heavy user of that service
+DATA_HEAVY_GB = 5.0
+VOICE_HEAVY_MIN = 120.0
+SMS_HEAVY = 20.0
+ARPU_PREMIUM = 30.0
+ARPU_LOW = 10.0
+
+# Catalogue words each profile attribute should pull towards
+VAS_TERMS = {
+    "music": "music streaming content social",
+    "streaming": "streaming video content premium",
+    "kidstv": "educational learning content family",
+    "gaming": "gaming games multiplayer",
+}
+SEGMENT_TERMS = {
+    "youth": "social media gaming data student",
+    "professional": "business international calls data",
+    "family": "family health educational",
+    "senior": "health voice calls",
+}
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", str(text).lower())
+
+# Content hash of the catalogue, used as its version
+def catalogue_version(product_df):
+    return hashlib.sha256(product_df.to_csv(index=False).encode("utf-8")).hexdigest()
+
+# Free-text query describing one subscriber's usage profile
+def subscriber_query(row):
+    terms = []
+    if float(row.get("AvgDataLast90Days (GB)", 0) or 0) >= DATA_HEAVY_GB:
+        terms.append("data unlimited streaming")
+    else:
+        terms.append("data")
+    if float(row.get("AvgVoiceLast90Days (min)", 0) or 0) >= VOICE_HEAVY_MIN:
+        terms.append("voice calls minutes unlimited")
+    if float(row.get("AvgSMSLast90Days", 0) or 0) >= SMS_HEAVY:
+        terms.append("sms")
+
+    arpu = float(row.get("ARPU", 0) or 0)
+    if arpu >= ARPU_PREMIUM:
+        terms.append("premium")
+    elif arpu <= ARPU_LOW:
+        terms.append("low basic")
+    else:
+        terms.append("mid plus")
+
+    terms.append(profile_query(row.get("VASUsed", ""), row.get("DemographicSegment", "")))
+    return " ".join(terms)
+
+# Catalogue words implied by a subscriber's VAS usage and demographic segment
+def profile_query(vas_used, segment):
+    terms = [VAS_TERMS.get(vas.strip().lower(), vas) for vas in str(vas_used or "").split(",")]
+    terms.append(SEGMENT_TERMS.get(str(segment or "").strip().lower(), ""))
+    return " ".join(terms)
+
+class CatalogueIndex:
+    def __init__(self, product_df):
+        self.product_df = product_df.reset_index(drop=True)
+        documents = [
+            tokenize(" ".join(str(row[col]) for col in INDEX_TEXT_COLUMNS if col in self.product_df.columns))
+            for _, row in self.product_df.iterrows()
+        ]
+        self.vocabulary = {term: i for i, term in enumerate(sorted({t for doc in documents for t in doc}))}
+
+        counts = self._count_matrix(documents)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+        self.matrix = self._normalize(counts * self.idf)
+
+    def _count_matrix(self, documents):
+        counts = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for i, doc in enumerate(documents):
+            for term in doc:
+                j = self.vocabulary.get(term)
+                if j is not None:
+                    counts[i, j] += 1
+        return counts
+
+    @staticmethod
+    def _normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    # Cosine similarity of each free-text query against every product
+    def score_texts(self, texts):
+        query_matrix = self._normalize(self._count_matrix([tokenize(text) for text in texts]) * self.idf)
+        return query_matrix @ self.matrix.T
+
+    # Cosine similarity of every subscriber in the batch against every product
+    def score(self, selected_subscribers):
+        return self.score_texts([subscriber_query(row) for _, row in selected_subscribers.iterrows()])
+
+    # Catalogue rows worth showing the model for this batch, best first; with an eligibility mask
+    # (subscribers x products) only products eligible for someone in the batch are considered
+    def candidates(self, selected_subscribers, top_k=DEFAULT_CANDIDATE_TOP_K, per_subscriber=CANDIDATES_PER_SUBSCRIBER,
+                   eligible=None):
+        if selected_subscribers.empty:
+            return self.product_df
+        if eligible is not None:
+            allowed = np.flatnonzero(eligible.any(axis=0))
+            if top_k is None or top_k >= len(allowed):
+                return self.product_df.iloc[allowed]
+        elif top_k is None or top_k >= len(self.product_df):
+            return self.product_df
+        scores = self.score(selected_subscribers)
+        if eligible is not None:
+            scores = np.where(eligible, scores, -np.inf)
+
+        # Every subscriber keeps its own best matches, then the batch-wide best fill the rest
+        per_subscriber = min(per_subscriber, scores.shape[1])
+        chosen = set(np.argsort(-scores, axis=1)[:, :per_subscriber].ravel().tolist())
+        best_scores = scores.max(axis=0)
+        best_overall = [i for i in np.argsort(-best_scores) if best_scores[i] > -np.inf]
+        ranked = [i for i in best_overall if i in chosen] + [i for i in best_overall if i not in chosen]
+        return self.product_df.iloc[sorted(ranked[:max(top_k, 1)])]
+
+# === INDEX CACHE ===
+# One index per catalogue version, shared by every caller in the process
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_catalogue_index(product_df):
+    version = catalogue_version(product_df)
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is None:
+            index = CatalogueIndex(product_df)
+            if len(_indexes) >= MAX_CACHED_INDEXES:
+                _indexes.pop(next(iter(_indexes)))
+            _indexes[version] = index
+        return index
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Chunked Pipeline
+Runs recommendations over a subscriber base chunk by chunk and appends each chunk's results to disk,
+so peak memory follows the chunk size instead of the size of the base
+"""
+
+import os
+import time
+import pandas as pd
+from recommendation_pipeline import generate_batched, add_incomplete_note, NO_INSIGHTS_TEXT, OUTPUT_MODE_MARKDOWN
+from batch_planner import plan_batches
+from subscriber_store import iter_subscribers, DEFAULT_CHUNK_ROWS
+from msisdn_index import normalize_msisdns
+
+# Results file defaults; insights are written next to the results CSV
+INSIGHTS_SUFFIX = ".insights.md"
+DEFAULT_PREVIEW_ROWS = 1000
+DEFAULT_PREVIEW_CHARS = 20000
+
+def insights_path_for(output_path):
+    return os.path.splitext(output_path)[0] + INSIGHTS_SUFFIX
+
+# Run generate(chunk) -> (table_df, explanation_text, full_response) over every chunk, appending the
+# table rows to output_path as CSV (header once, columns of the first table) and the insights to the
+# insights file. A chunk whose generate() raises (e.g. every batch failed) is counted in failed_chunks
+# and noted in the insights, and the run goes on. Yields a progress dict after each chunk; nothing but
+# the current chunk is kept.
+def write_chunked(chunks, generate, output_path):
+    insights_path = insights_path_for(output_path)
+    for path in (output_path, insights_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    columns = None
+    progress = {"chunks": 0, "subscribers": 0, "rows": 0, "seconds": 0.0, "failed_chunks": 0, "failed_subscribers": 0}
+    started = time.perf_counter()
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        try:
+            table_df, explanation_text, _ = generate(chunk)
+        except Exception as e:
+            table_df = None
+            explanation_text = add_incomplete_note("", f"no results for these {len(chunk):,} subscribers ({e}).")
+            progress["failed_chunks"] += 1
+            progress["failed_subscribers"] += len(chunk)
+        if table_df is not None and not table_df.empty:
+            if columns is None:
+                columns = list(table_df.columns)
+            table_df.reindex(columns=columns).to_csv(
+                output_path, mode="a", header=not progress["rows"], index=False, encoding="utf-8"
+            )
+            progress["rows"] += len(table_df)
+        if explanation_text and explanation_text.strip() and explanation_text.strip() != NO_INSIGHTS_TEXT:
+            with open(insights_path, "a", encoding="utf-8") as f:
+                f.write(f"## Chunk {progress['chunks'] + 1}\n\n{explanation_text.strip()}\n\n")
+        progress["chunks"] += 1
+        progress["subscribers"] += len(chunk)
+        progress["seconds"] = time.perf_counter() - started
+        yield dict(progress)
+
+# write_chunked over the batched model pipeline. Batches are planned once, on the first chunk, unless
+# batch_size is given; options are passed on to generate_batched.
+def generate_chunked(model, chunks, product_df, variables, output_path, model_name, batch_size=None,
+                     candidate_top_k=None, output_mode=OUTPUT_MODE_MARKDOWN, **options):
+    plan = {}
+
+    def generate(chunk):
+        if not plan:
+            plan.update(plan_batches(chunk, product_df, variables, model_name, candidate_top_k, output_mode))
+        return generate_batched(
+            model, chunk, product_df, variables, batch_size=batch_size or plan["batch_size"],
+            candidate_top_k=candidate_top_k, output_mode=output_mode,
+            generation_config={"max_output_tokens": plan["max_output_tokens"]}, **options
+        )
+
+    return write_chunked(chunks, generate, output_path)
+
+# First rows of a results file and the start of its insights, for display
+def read_results_preview(output_path, rows=DEFAULT_PREVIEW_ROWS, chars=DEFAULT_PREVIEW_CHARS):
+    table_df = pd.read_csv(output_path, nrows=rows) if os.path.exists(output_path) else None
+    explanation_text = NO_INSIGHTS_TEXT
+    if os.path.exists(insights_path_for(output_path)):
+        with open(insights_path_for(output_path), encoding="utf-8") as f:
+            explanation_text = f.read(chars)
+    return table_df, explanation_text
+
+# Subscribers behind the rows of a results preview, found by MSISDN in a scan of the subscriber file
+# that stops once every MSISDN has turned up. Rows follow the order of the table; MSISDNs the file
+# no longer has are left out.
+def preview_subscribers(csv_path, table_df, chunk_rows=DEFAULT_CHUNK_ROWS, compact=True):
+    if table_df is None or table_df.empty or "MSISDN" not in table_df.columns:
+        return pd.DataFrame()
+    wanted = normalize_msisdns(table_df["MSISDN"]).drop_duplicates()
+    remaining = set(wanted[wanted != ""])
+    found = []
+    for chunk in iter_subscribers(csv_path, chunk_rows, compact=compact):
+        if not remaining:
+            break
+        keys = normalize_msisdns(chunk["MSISDN"]).to_numpy()
+        matched = chunk.assign(_key=keys)[pd.Series(keys).isin(remaining).to_numpy()]
+        matched = matched.drop_duplicates("_key")
+        remaining.difference_update(matched["_key"])
+        found.append(matched)
+    if not found:
+        return pd.DataFrame()
+    subscribers = pd.concat(found).set_index("_key")
+    return subscribers.loc[[key for key in wanted if key in subscribers.index]].reset_index(drop=True)
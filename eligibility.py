@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Product Eligibility
+Declarative constraints evaluated as NumPy masks over subscribers x products, so only products a
+subscriber can afford and use reach the prompt or the fast-path scorer
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from catalogue_index import catalogue_version
+
+TIER_LEVELS = {"Low": 0, "Mid": 1, "Premium": 2}
+
+# The constraint set. Rules are applied in order; a rule that would leave a subscriber with no
+# eligible product is skipped for that subscriber, so earlier rules take precedence.
+DEFAULT_CONSTRAINTS = {
+    # Products the handset cannot use
+    "device_excluded_categories": {
+        "FeaturePhone": ["Video", "Gaming"],
+    },
+    # Entry-tier products that duplicate a VAS the subscriber already pays for
+    "vas_covered_categories": {
+        "Gaming": ["Gaming"],
+        "Streaming": ["Video"],
+        "KidsTV": ["Education"],
+    },
+    "vas_covered_max_tier": "Low",
+    # Tier progression: stay within this many tiers below or above the current plan
+    "plan_tiers": {
+        "BasicPrepaid": "Low",
+        "PremiumPrepaid": "Mid",
+        "Postpaid10": "Mid",
+        "Postpaid20": "Premium",
+    },
+    "max_tiers_down": 1,
+    "max_tiers_up": 1,
+    # Price ceiling as a multiple of monthly ARPU (catalogue prices and ARPU use different units)
+    "price_ceiling_arpu_multiple": 400,
+    "order": ["device", "vas", "tier", "price"],
+}
+
+MAX_CACHED_RULES = 4
+
+def _split_values(text):
+    return [value.strip() for value in str(text).split(",") if value.strip() and value.strip().lower() != "nan"]
+
+def _column(df, column, default=""):
+    if column in df.columns:
+        # Categorical columns only accept fill values that are among their categories
+        values = df[column]
+        return (values.astype(object) if isinstance(values.dtype, pd.CategoricalDtype) else values).fillna(default)
+    return pd.Series(default, index=df.index)
+
+class EligibilityRules:
+    # Product-side arrays are compiled once per catalogue. Masks for the categorical rules depend only
+    # on (DeviceType, VASUsed, CurrentPlan), so they are computed once per distinct profile, kept,
+    # and broadcast back to rows; the ARPU price ceiling is one broadcast comparison.
+    def __init__(self, product_df, constraints=DEFAULT_CONSTRAINTS):
+        self.product_df = product_df.reset_index(drop=True)
+        self.constraints = constraints
+        self.categories = self.product_df["Category"].astype(str).str.strip().to_numpy()
+        self.tiers = self.product_df["Tier"].astype(str).str.strip().map(TIER_LEVELS).to_numpy(dtype=float)
+        self.prices = pd.to_numeric(self.product_df["ProductPrice"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        self._profile_masks = {}
+        self._lock = threading.Lock()
+
+    def _device_mask(self, device):
+        excluded = self.constraints["device_excluded_categories"].get(device, [])
+        return ~np.isin(self.categories, excluded)
+
+    def _vas_mask(self, vas_used):
+        covered = [category for vas in _split_values(vas_used)
+                   for category in self.constraints["vas_covered_categories"].get(vas, [])]
+        max_tier = TIER_LEVELS[self.constraints["vas_covered_max_tier"]]
+        return ~(np.isin(self.categories, covered) & (self.tiers <= max_tier))
+
+    def _tier_mask(self, plan):
+        plan_tier = self.constraints["plan_tiers"].get(plan)
+        if plan_tier is None:
+            return np.ones(len(self.categories), dtype=bool)
+        level = TIER_LEVELS[plan_tier]
+        # Products with an unknown tier are never ruled out by tier progression
+        return np.isnan(self.tiers) | (
+            (self.tiers >= level - self.constraints["max_tiers_down"])
+            & (self.tiers <= level + self.constraints["max_tiers_up"])
+        )
+
+    # Categorical rule masks for one (DeviceType, VASUsed, CurrentPlan) profile, keyed by rule
+    def _profile_mask(self, profile):
+        with self._lock:
+            masks = self._profile_masks.get(profile)
+        if masks is None:
+            device, vas_used, plan = profile
+            masks = {"device": self._device_mask(device), "vas": self._vas_mask(vas_used), "tier": self._tier_mask(plan)}
+            with self._lock:
+                self._profile_masks[profile] = masks
+        return masks
+
+    # Eligibility of every subscriber for every product, shape (subscribers, products)
+    def mask(self, selected_subscribers):
+        n, m = len(selected_subscribers), len(self.categories)
+        eligible = np.ones((n, m), dtype=bool)
+        if n == 0 or m == 0:
+            return eligible
+
+        profiles = pd.MultiIndex.from_arrays([
+            _column(selected_subscribers, "DeviceType").astype(str).str.strip().to_numpy(),
+            _column(selected_subscribers, "VASUsed").astype(str).to_numpy(),
+            _column(selected_subscribers, "CurrentPlan").astype(str).str.strip().to_numpy(),
+        ])
+        codes, uniques = profiles.factorize()
+        profile_masks = [self._profile_mask(profile) for profile in uniques]
+
+        for rule in self.constraints["order"]:
+            if rule == "price":
+                arpu = pd.to_numeric(_column(selected_subscribers, "ARPU", 0), errors="coerce").fillna(0).to_numpy(dtype=float)
+                rule_mask = self.prices[None, :] <= arpu[:, None] * self.constraints["price_ceiling_arpu_multiple"]
+            else:
+                rule_mask = np.stack([masks[rule] for masks in profile_masks])[codes]
+            narrowed = eligible & rule_mask
+            # Relax the rule for subscribers it would leave with nothing to recommend
+            keep = narrowed.any(axis=1)
+            eligible = np.where(keep[:, None], narrowed, eligible)
+        return eligible
+
+# === RULES CACHE ===
+# One compiled rule set per catalogue version, shared by every caller in the process
+_rules = {}
+_rules_lock = threading.Lock()
+
+def get_eligibility_rules(product_df):
+    version = catalogue_version(product_df)
+    with _rules_lock:
+        rules = _rules.get(version)
+        if rules is None:
+            rules = EligibilityRules(product_df)
+            if len(_rules) >= MAX_CACHED_RULES:
+                _rules.pop(next(iter(_rules)))
+            _rules[version] = rules
+        return rules
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Fault Injection and Local Model
+Wraps a GenerativeModel-like object to add latency and transient failures, and provides a deterministic
+local stand-in for Gemini so the whole pipeline can be benchmarked and load tested offline
+"""
+
+import re
+import json
+import time
+import zlib
+import random
+import asyncio
+import threading
+import pandas as pd
+from io import StringIO
+from types import SimpleNamespace
+from prompt_serializer import estimate_tokens
+from catalogue_index import DATA_HEAVY_GB, VOICE_HEAVY_MIN, SMS_HEAVY, ARPU_PREMIUM, ARPU_LOW
+
+# Local model defaults: time to first token, generation speed and size of each streamed chunk
+DEFAULT_LATENCY_SECONDS = 0.5
+DEFAULT_TOKENS_PER_SECOND = 150.0
+DEFAULT_CHUNK_TOKENS = 20
+
+class TransientModelError(Exception):
+    # Stand-in for a quota or 5xx error from the Gemini endpoint
+    def __init__(self, message="Injected transient model failure", code=503):
+        super().__init__(message)
+        self.code = code
+
+class FaultInjectingModel:
+    def __init__(self, model, latency_seconds=0.0, failure_rate=0.0, failure_factory=TransientModelError, seed=None):
+        self.model = model
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.failure_factory = failure_factory
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    # Decide whether this call fails, counting calls and injected failures
+    def _should_fail(self):
+        with self._lock:
+            self.calls += 1
+            failed = self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+            return failed
+
+    def generate_content(self, *args, **kwargs):
+        time.sleep(self.latency_seconds)
+        if self._should_fail():
+            raise self.failure_factory()
+        return self.model.generate_content(*args, **kwargs)
+
+    async def generate_content_async(self, *args, **kwargs):
+        await asyncio.sleep(self.latency_seconds)
+        if self._should_fail():
+            raise self.failure_factory()
+        return await self.model.generate_content_async(*args, **kwargs)
+
+# === LOCAL MODEL ===
+class LocalResponse:
+    # Mimics a Gemini response (or one streamed chunk): text plus usage metadata
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens, candidates_token_count=estimate_tokens(text)
+        )
+
+# Pipe-delimited blocks of the prompt whose header starts with one of the given column names
+def _prompt_table(prompt, first_columns):
+    for block in re.split(r"\n\s*\n", prompt):
+        block = block.strip()
+        if "|" in block and block.split("|", 1)[0].strip() in first_columns:
+            try:
+                return pd.read_csv(StringIO(block), sep="|")
+            except Exception:
+                return None
+    return None
+
+def _stable_pick(options, key):
+    return options[zlib.crc32(key.encode("utf-8")) % len(options)]
+
+def _number(row, column):
+    value = pd.to_numeric(str(row.get(column, "")).split("/")[0], errors="coerce")
+    return 0.0 if pd.isna(value) else float(value)
+
+# Service a subscriber uses most, relative to the heavy-user thresholds
+def _dominant_category(row):
+    usage = {
+        "Data": _number(row, "AvgDataLast90Days (GB)") / DATA_HEAVY_GB,
+        "Voice": _number(row, "AvgVoiceLast90Days (min)") / VOICE_HEAVY_MIN,
+        "SMS": _number(row, "AvgSMSLast90Days") / SMS_HEAVY,
+    }
+    return max(usage, key=usage.get)
+
+def _target_tier(row):
+    arpu = _number(row, "ARPU")
+    if arpu >= ARPU_PREMIUM:
+        return "Premium"
+    return "Low" if arpu <= ARPU_LOW else "Mid"
+
+# Deterministic recommendation for one subscriber: same prompt, same answer
+def _recommend(row, catalogue):
+    msisdn = str(row["MSISDN"])
+    category = _dominant_category(row)
+    tier = _target_tier(row)
+
+    in_category = catalogue[catalogue["Category"] == category]
+    if in_category.empty:
+        in_category = catalogue[catalogue["Category"] == "Bundle"] if (catalogue["Category"] == "Bundle").any() else catalogue
+    in_tier = in_category[in_category["Tier"] == tier]
+    chosen = _stable_pick((in_tier if not in_tier.empty else in_category).to_dict("records"), msisdn)
+
+    # Upsell: the next pricier product in the same category, else the priciest product overall
+    pricier = in_category[in_category["ProductPrice"] > chosen["ProductPrice"]].sort_values("ProductPrice")
+    upsell = pricier.iloc[0] if not pricier.empty else catalogue.sort_values("ProductPrice").iloc[-1]
+    others = catalogue[catalogue["Category"] != chosen["Category"]]
+    cross_sell = _stable_pick((others if not others.empty else catalogue).to_dict("records"), msisdn + ":cross")
+
+    segment = str(row.get("DemographicSegment", "Subscriber"))
+    reason = (
+        f"{segment} user with {category}-led usage "
+        f"({_number(row, 'AvgDataLast90Days (GB)'):g} GB, {_number(row, 'AvgVoiceLast90Days (min)'):g} min) "
+        f"and ARPU {_number(row, 'ARPU'):g} fits a {chosen['Tier']} {chosen['Category']} product"
+    )
+    return {
+        "MSISDN": msisdn,
+        "ProductID": chosen.get("ProductID"),
+        "RecommendedProduct": chosen["ProductName"],
+        "Category": chosen["Category"],
+        "Tier": chosen["Tier"],
+        "ProductPrice": chosen["ProductPrice"],
+        "Reason": reason,
+        "UpsellProductID": upsell.get("ProductID"),
+        "UpsellOption": upsell["ProductName"],
+        "CrossSellProductID": cross_sell.get("ProductID"),
+        "CrossSellOption": cross_sell["ProductName"],
+    }
+
+def _insights(records):
+    categories = pd.Series([record["Category"] for record in records]).value_counts()
+    upsells = pd.Series([record["UpsellOption"] for record in records]).value_counts()
+    cross_sells = pd.Series([record["CrossSellOption"] for record in records]).value_counts()
+    return [
+        f"{categories.index[0]} products suit {categories.iloc[0]} of {len(records)} subscribers; lead campaigns with them.",
+        f"Offer {upsells.index[0]} as the upgrade path once recommended bundles are adopted.",
+        f"Pair recommendations with {cross_sells.index[0]} to lift ARPU through cross-sell.",
+    ]
+
+class LocalModel:
+    # Deterministic GenerativeModel stand-in. It reads the subscriber and catalogue tables out of the
+    # prompt and answers in the format the generation config asks for (markdown table plus bullets,
+    # full JSON or ProductID-only JSON). Latency is time to first token, after which text arrives at
+    # tokens_per_second; failure_rate injects transient errors from a seeded generator.
+    def __init__(self, latency_seconds=DEFAULT_LATENCY_SECONDS, tokens_per_second=DEFAULT_TOKENS_PER_SECOND,
+                 failure_rate=0.0, chunk_tokens=DEFAULT_CHUNK_TOKENS, failure_factory=TransientModelError, seed=0):
+        self.latency_seconds = latency_seconds
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = chunk_tokens
+        self.faults = FaultInjectingModel(None, failure_rate=failure_rate, failure_factory=failure_factory, seed=seed)
+
+    @property
+    def calls(self):
+        return self.faults.calls
+
+    @property
+    def failures(self):
+        return self.faults.failures
+
+    # Full response text for a prompt and generation config
+    def render(self, prompt, generation_config=None):
+        generation_config = generation_config or {}
+        subscribers = _prompt_table(prompt, ("MSISDN",))
+        schema = json.dumps(generation_config.get("response_schema") or {})
+        if subscribers is not None and '"reasons"' in schema:
+            return self._render_reasons(subscribers)
+        catalogue = _prompt_table(prompt, ("ProductID", "ProductName"))
+        if subscribers is None or catalogue is None or catalogue.empty:
+            return "Hello! I am ready to recommend products for your subscribers."
+
+        records = [_recommend(row, catalogue) for row in subscribers.to_dict("records")]
+        insights = _insights(records) if records else []
+
+        if generation_config.get("response_mime_type") == "application/json":
+            if "ProductID" in schema:
+                fields = ["MSISDN", "ProductID", "UpsellProductID", "CrossSellProductID"]
+                records = [dict({k: r[k] for k in fields}, Reason=f"{r['Category']} fit for this usage and spend")
+                           for r in records]
+            else:
+                fields = ["MSISDN", "RecommendedProduct", "Category", "Tier", "ProductPrice", "Reason",
+                          "UpsellOption", "CrossSellOption"]
+                records = [{k: r[k] for k in fields} for r in records]
+            return json.dumps({"recommendations": records, "insights": insights}, default=str)
+
+        columns = ["MSISDN", "RecommendedProduct", "Category", "Tier", "ProductPrice", "Reason",
+                   "UpsellOption", "CrossSellOption"]
+        lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        lines += ["| " + " | ".join(str(r[col]) for col in columns) + " |" for r in records]
+        bullets = [f"- {tip}" for tip in insights]
+        return "\n".join(lines) + "\n\n" + "\n".join(bullets) + "\n"
+
+    # Reasons for products chosen elsewhere (the fast path's explanation prompts)
+    def _render_reasons(self, subscribers):
+        reasons = [
+            {"MSISDN": str(row["MSISDN"]),
+             "Reason": f"{_dominant_category(row)} usage and ARPU {_number(row, 'ARPU'):g} make this product a natural fit"}
+            for row in subscribers.to_dict("records")
+        ]
+        insights = [
+            "Time upsell offers to the week after a recharge, when balances are highest.",
+            "Bundle the cross-sell product as a discounted add-on to lift adoption.",
+        ]
+        return json.dumps({"reasons": reasons, "insights": insights})
+
+    def _chunks(self, text):
+        size = max(1, self.chunk_tokens) * 4
+        return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+    def _generation_seconds(self, text):
+        return estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _start(self, prompt, generation_config):
+        if self.faults._should_fail():
+            raise self.faults.failure_factory()
+        return self.render(str(prompt), generation_config), estimate_tokens(str(prompt))
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        time.sleep(self.latency_seconds)
+        text, prompt_tokens = self._start(prompt, generation_config)
+        if stream:
+            return self._stream(text, prompt_tokens)
+        time.sleep(self._generation_seconds(text))
+        return LocalResponse(text, prompt_tokens)
+
+    def _stream(self, text, prompt_tokens):
+        for chunk in self._chunks(text):
+            time.sleep(self._generation_seconds(chunk))
+            yield LocalResponse(chunk, prompt_tokens)
+
+    async def generate_content_async(self, prompt, generation_config=None, stream=False, **kwargs):
+        await asyncio.sleep(self.latency_seconds)
+        text, prompt_tokens = self._start(prompt, generation_config)
+        if stream:
+            return self._stream_async(text, prompt_tokens)
+        await asyncio.sleep(self._generation_seconds(text))
+        return LocalResponse(text, prompt_tokens)
+
+    async def _stream_async(self, text, prompt_tokens):
+        for chunk in self._chunks(text):
+            await asyncio.sleep(self._generation_seconds(chunk))
+            yield LocalResponse(chunk, prompt_tokens)
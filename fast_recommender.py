@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Fast-Path Recommender
+Scores every subscriber against every product in one vectorized NumPy pass, with the model optional
+and only used to phrase the reasons and insights for rows that are already chosen
+"""
+
+import json
+import time
+import asyncio
+import threading
+import numpy as np
+import pandas as pd
+from prompt_serializer import serialize_rows, serialize_subscribers
+from eligibility import get_eligibility_rules, TIER_LEVELS
+from catalogue_index import (
+    get_catalogue_index, catalogue_version, profile_query, DATA_HEAVY_GB, VOICE_HEAVY_MIN, SMS_HEAVY,
+    ARPU_PREMIUM, ARPU_LOW
+)
+from recommendation_pipeline import (
+    split_batches, run_coroutine, RESULT_COLUMNS, NO_INSIGHTS_TEXT, DEFAULT_MAX_CONCURRENCY
+)
+
+USAGE_COLUMNS = ["AvgDataLast90Days (GB)", "AvgVoiceLast90Days (min)", "AvgSMSLast90Days"]
+USAGE_NAMES = np.array(["Data", "Voice", "SMS"])
+USAGE_THRESHOLDS = np.array([DATA_HEAVY_GB, VOICE_HEAVY_MIN, SMS_HEAVY])
+
+# Usage is capped at this multiple of the heavy-user threshold so one outlier metric cannot dominate
+MAX_USAGE_RATIO = 3.0
+
+# How much data, voice and SMS usage each catalogue category serves
+CATEGORY_USAGE_WEIGHTS = {
+    "Data": (1.0, 0.0, 0.0),
+    "Voice": (0.0, 1.0, 0.3),
+    "SMS": (0.0, 0.3, 1.0),
+    "Bundle": (0.7, 0.7, 0.2),
+    "Video": (0.8, 0.0, 0.0),
+    "Gaming": (0.6, 0.0, 0.0),
+    "Education": (0.4, 0.0, 0.0),
+    "Health": (0.2, 0.2, 0.0),
+}
+DEFAULT_USAGE_WEIGHTS = (0.3, 0.3, 0.1)
+
+DEFAULT_TIER_LEVEL = 1.0
+
+# Weight of each affinity term in the final score
+SCORE_WEIGHTS = {"usage": 1.0, "content": 1.0, "tier": 0.5, "price": 0.5}
+
+MAX_CACHED_SCORERS = 4
+
+# Subscribers per explanation prompt when the model phrases the reasons
+DEFAULT_EXPLAIN_BATCH_SIZE = 25
+
+EXPLAIN_PROMPT_TEMPLATE = """
+Explain product recommendations that have already been made for the following subscribers (pipe-delimited, first line is the header):
+
+{subscriber_data}
+
+The chosen products (pipe-delimited, first line is the header):
+
+{recommendation_data}
+
+Return JSON with a "reasons" list holding one record per subscriber with the fields MSISDN and Reason
+(at most 25 words on why the recommended product fits this subscriber's usage and spend),
+and an "insights" list of short upsell and cross-sell strategy tips.
+Do not change or question the chosen products.
+"""
+
+EXPLAIN_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "reasons": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"MSISDN": {"type": "STRING"}, "Reason": {"type": "STRING"}},
+                "required": ["MSISDN", "Reason"],
+            },
+        },
+        "insights": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["reasons", "insights"],
+}
+
+# Column as floats; text such as "6/mo" is parsed once per distinct value
+def _numeric(df, column):
+    if column not in df.columns:
+        return np.zeros(len(df))
+    if pd.api.types.is_numeric_dtype(df[column]):
+        return df[column].fillna(0).to_numpy(dtype=float)
+    codes, uniques = pd.factorize(df[column].astype(str))
+    parsed = pd.to_numeric(pd.Series(uniques).str.extract(r"([-+]?\d*\.?\d+)", expand=False), errors="coerce")
+    return parsed.fillna(0).to_numpy(dtype=float)[codes]
+
+# "%g"-formatted text for each value, formatting every distinct value once
+def _format_numbers(values):
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return np.array([f"{value:g}" for value in uniques], dtype=object)[inverse]
+
+# MSISDNs as nullable integers, as in parsed model responses
+def _msisdn_values(selected_subscribers):
+    msisdn = selected_subscribers["MSISDN"]
+    if not pd.api.types.is_integer_dtype(msisdn):
+        msisdn = pd.to_numeric(msisdn.astype(str).str.replace(r"\D", "", regex=True), errors="coerce")
+    return msisdn.astype("Int64").array
+
+# Spend level on the same 0 (Low) .. 2 (Premium) scale as product tiers
+def spend_levels(selected_subscribers):
+    arpu = _numeric(selected_subscribers, "ARPU")
+    return np.clip((arpu - ARPU_LOW) / (ARPU_PREMIUM - ARPU_LOW), 0, 1) * 2
+
+class AffinityScorer:
+    # Product-side features are computed once per catalogue; scoring a batch is then a handful of
+    # matrix operations over subscribers x products
+    def __init__(self, product_df):
+        self.product_df = product_df.reset_index(drop=True)
+        categories = self.product_df["Category"].astype(str).str.strip()
+        self.categories = categories.to_numpy()
+        self.usage_weights = np.array([CATEGORY_USAGE_WEIGHTS.get(c, DEFAULT_USAGE_WEIGHTS) for c in categories])
+        self.tier_levels = self.product_df["Tier"].astype(str).str.strip().map(TIER_LEVELS).fillna(DEFAULT_TIER_LEVEL).to_numpy()
+        self.prices = pd.to_numeric(self.product_df["ProductPrice"], errors="coerce").fillna(0).to_numpy(dtype=float)
+        # Price position within the catalogue, on the tier scale
+        self.price_levels = pd.Series(self.prices).rank(pct=True).to_numpy() * 2
+        self.catalogue_index = get_catalogue_index(self.product_df)
+
+    # Usage of each subscriber relative to the heavy-user thresholds, shape (subscribers, 3)
+    @staticmethod
+    def usage_ratios(selected_subscribers):
+        usage = np.column_stack([_numeric(selected_subscribers, col) for col in USAGE_COLUMNS])
+        return np.minimum(usage / USAGE_THRESHOLDS, MAX_USAGE_RATIO)
+
+    # TF-IDF similarity of each subscriber's VAS and segment profile, scored once per distinct profile
+    def content_affinity(self, selected_subscribers, variables=None):
+        variables = variables or {}
+        vas = selected_subscribers["VASUsed"] if variables.get("VASUsed", True) and "VASUsed" in selected_subscribers else None
+        segment = (selected_subscribers["DemographicSegment"]
+                   if variables.get("DemographicSegment", True) and "DemographicSegment" in selected_subscribers else None)
+        profiles = pd.DataFrame({
+            "vas": vas.astype(str).to_numpy() if vas is not None else "",
+            "segment": segment.astype(str).to_numpy() if segment is not None else "",
+        }, index=range(len(selected_subscribers)))
+        codes, uniques = pd.MultiIndex.from_frame(profiles).factorize()
+        scores = self.catalogue_index.score_texts([profile_query(v, s) for v, s in uniques])
+        return scores[codes]
+
+    # Affinity of every subscriber for every product, shape (subscribers, products)
+    def score(self, selected_subscribers, variables=None):
+        usage = self.usage_ratios(selected_subscribers) @ self.usage_weights.T / MAX_USAGE_RATIO
+        spend = spend_levels(selected_subscribers)[:, None]
+        return (
+            SCORE_WEIGHTS["usage"] * usage
+            + SCORE_WEIGHTS["content"] * self.content_affinity(selected_subscribers, variables)
+            - SCORE_WEIGHTS["tier"] * np.abs(spend - self.tier_levels[None, :]) / 2
+            - SCORE_WEIGHTS["price"] * np.abs(spend - self.price_levels[None, :]) / 2
+        )
+
+    # Best-scoring product per row among the allowed ones, -1 where none is allowed
+    # (products scored -inf, i.e. ineligible, are never allowed)
+    @staticmethod
+    def _best(scores, allowed):
+        allowed = allowed & np.isfinite(scores)
+        masked = np.where(allowed, scores, -np.inf)
+        best = masked.argmax(axis=1)
+        return np.where(allowed.any(axis=1), best, -1)
+
+    # Top product, upsell and cross-sell positions for every subscriber
+    def pick(self, scores, top=None):
+        if top is None:
+            top = scores.argmax(axis=1)
+        top_category = self.categories[top][:, None]
+        top_price = self.prices[top][:, None]
+        pricier = self.prices[None, :] > top_price
+        same_category = self.categories[None, :] == top_category
+
+        # Upsell within the same category when possible, otherwise any pricier product
+        upsell = self._best(scores, pricier & same_category)
+        upsell = np.where(upsell >= 0, upsell, self._best(scores, pricier))
+        # Cross-sell from another category, never the product already offered as the upsell
+        not_upsell = np.arange(len(self.prices))[None, :] != upsell[:, None]
+        cross_sell = self._best(scores, ~same_category & not_upsell)
+        return top, upsell, cross_sell
+
+    # Recommendations table with the same columns and types as a parsed model response;
+    # with an eligibility mask (subscribers x products) ineligible products are never picked, and
+    # with top_categories (one per subscriber) the top pick stays in that category where possible
+    def recommend(self, selected_subscribers, variables=None, eligible=None, top_categories=None):
+        if selected_subscribers.empty:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        scores = self.score(selected_subscribers, variables)
+        if eligible is not None:
+            scores = np.where(eligible, scores, -np.inf)
+        top = None
+        if top_categories is not None:
+            in_category = self.categories[None, :] == np.asarray(top_categories, dtype=object)[:, None]
+            top = self._best(scores, in_category)
+            top = np.where(top >= 0, top, scores.argmax(axis=1))
+        top, upsell, cross_sell = self.pick(scores, top)
+        names = self.product_df["ProductName"].astype(str).to_numpy()
+        chosen = self.product_df.iloc[top]
+
+        table_df = pd.DataFrame({
+            "MSISDN": _msisdn_values(selected_subscribers),
+            "RecommendedProduct": chosen["ProductName"].to_numpy(),
+            "Category": chosen["Category"].to_numpy(),
+            "Tier": chosen["Tier"].to_numpy(),
+            "ProductPrice": pd.to_numeric(chosen["ProductPrice"], errors="coerce").to_numpy(),
+            "Reason": self.reasons(selected_subscribers, chosen),
+            "UpsellOption": np.where(upsell >= 0, names[np.maximum(upsell, 0)], None),
+            "CrossSellOption": np.where(cross_sell >= 0, names[np.maximum(cross_sell, 0)], None),
+        })
+        text_columns = [col for col in RESULT_COLUMNS if col not in ("MSISDN", "ProductPrice")]
+        table_df[text_columns] = table_df[text_columns].astype("string")
+        return table_df
+
+    # Templated reason per row, built column-wise
+    def reasons(self, selected_subscribers, chosen):
+        ratios = self.usage_ratios(selected_subscribers)
+        usage = [_format_numbers(_numeric(selected_subscribers, col)) for col in USAGE_COLUMNS]
+        arpu = _format_numbers(_numeric(selected_subscribers, "ARPU"))
+        return (
+            USAGE_NAMES.astype(object)[ratios.argmax(axis=1)] + "-led usage (" + usage[0] + " GB, "
+            + usage[1] + " min, " + usage[2] + " SMS) and ARPU " + arpu + " fit this "
+            + chosen["Tier"].astype(str).to_numpy(dtype=object) + " "
+            + chosen["Category"].astype(str).to_numpy(dtype=object) + " product"
+        )
+
+# Rule-based bullet points summarizing a recommendations table
+def summarize_insights(table_df):
+    if table_df is None or table_df.empty:
+        return NO_INSIGHTS_TEXT
+    categories = table_df["Category"].value_counts()
+    upsells = table_df["UpsellOption"].dropna().value_counts()
+    cross_sells = table_df["CrossSellOption"].dropna().value_counts()
+    tips = [f"{categories.index[0]} products lead for {categories.iloc[0]} of {len(table_df)} subscribers."]
+    if not upsells.empty:
+        tips.append(f"Upsell {upsells.index[0]} as the most common upgrade path ({upsells.iloc[0]} subscribers).")
+    if not cross_sells.empty:
+        tips.append(f"Cross-sell {cross_sells.index[0]} alongside the main recommendation ({cross_sells.iloc[0]} subscribers).")
+    return "\n".join(f"- {tip}" for tip in tips)
+
+# === SCORER CACHE ===
+# One scorer per catalogue version, shared by every caller in the process
+_scorers = {}
+_scorers_lock = threading.Lock()
+
+def get_affinity_scorer(product_df):
+    version = catalogue_version(product_df)
+    with _scorers_lock:
+        scorer = _scorers.get(version)
+        if scorer is None:
+            scorer = AffinityScorer(product_df)
+            if len(_scorers) >= MAX_CACHED_SCORERS:
+                _scorers.pop(next(iter(_scorers)))
+            _scorers[version] = scorer
+        return scorer
+
+# === MODEL EXPLANATIONS ===
+def _normalize_msisdn(values):
+    return pd.Series(values).astype(str).str.replace(r"\D", "", regex=True).to_numpy()
+
+async def _explain_batch(model, rows, subscribers, variables, semaphore):
+    prompt = EXPLAIN_PROMPT_TEMPLATE.format(
+        subscriber_data=serialize_subscribers(subscribers, variables),
+        recommendation_data=serialize_rows(rows.drop(columns=["Reason"]))
+    )
+    generation_config = {"response_mime_type": "application/json", "response_schema": EXPLAIN_RESPONSE_SCHEMA}
+    async with semaphore:
+        response = await model.generate_content_async(prompt, generation_config=generation_config)
+    payload = json.loads(response.text)
+    records = payload.get("reasons") or []
+    keys = _normalize_msisdn([record.get("MSISDN") for record in records])
+    reasons = {key: str(record.get("Reason", "")).strip() for key, record in zip(keys, records)}
+    insights = [str(tip).strip() for tip in payload.get("insights") or [] if str(tip).strip()]
+    return reasons, insights
+
+async def explain_async(model, table_df, selected_subscribers, variables,
+                        batch_size=DEFAULT_EXPLAIN_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    subscriber_keys = _normalize_msisdn(selected_subscribers["MSISDN"])
+    batches = split_batches(table_df, batch_size)
+    results = await asyncio.gather(
+        *(_explain_batch(model, rows, selected_subscribers[np.isin(subscriber_keys, _normalize_msisdn(rows["MSISDN"]))],
+                         variables, semaphore)
+          for rows in batches),
+        return_exceptions=True
+    )
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures and len(failures) == len(results):
+        raise failures[0]
+
+    reasons, insights = {}, []
+    for result in results:
+        if not isinstance(result, BaseException):
+            reasons.update(result[0])
+            insights.extend(result[1])
+    return reasons, insights, failures
+
+# Replace the templated reasons and insights with model-written ones; rows the model skipped keep theirs
+def explain_recommendations(model, table_df, selected_subscribers, variables,
+                            batch_size=DEFAULT_EXPLAIN_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    reasons, insights, failures = run_coroutine(explain_async(
+        model, table_df, selected_subscribers, variables, batch_size=batch_size, max_concurrency=max_concurrency
+    ))
+    table_df = table_df.copy()
+    written = pd.Series(_normalize_msisdn(table_df["MSISDN"])).map(reasons).fillna("")
+    table_df["Reason"] = pd.array(
+        np.where(written.str.len() > 0, written, table_df["Reason"].fillna("").to_numpy()), dtype="string"
+    )
+    # Batches tend to repeat the same tips; keep each once, in order
+    insights = list(dict.fromkeys(insights))
+    explanation_text = "\n".join(f"- {tip}" for tip in insights) if insights else summarize_insights(table_df)
+    if failures:
+        explanation_text += f"\n\n{len(failures)} explanation batch(es) failed; their rows keep the rule-based reasons: {failures[0]}"
+    return table_df, explanation_text
+
+# Drop-in counterpart of generate_batched: returns (table_df, explanation_text, full_response)
+# without any model call unless a model is passed to phrase the reasons
+def recommend_fast(selected_subscribers, product_df, variables=None, model=None,
+                   batch_size=DEFAULT_EXPLAIN_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                   apply_eligibility=False):
+    started = time.perf_counter()
+    eligible = get_eligibility_rules(product_df).mask(selected_subscribers) if apply_eligibility else None
+    table_df = get_affinity_scorer(product_df).recommend(selected_subscribers, variables, eligible)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    full_response = (
+        f"Scored {len(selected_subscribers):,} subscribers against {len(product_df):,} products "
+        f"locally in {elapsed_ms:.1f} ms"
+    )
+    if model is None or table_df.empty:
+        return table_df, summarize_insights(table_df), full_response
+    table_df, explanation_text = explain_recommendations(
+        model, table_df, selected_subscribers, variables or {}, batch_size=batch_size, max_concurrency=max_concurrency
+    )
+    return table_df, explanation_text, full_response + "; reasons and insights written by the model"
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Background Health Monitor
+Runs integration probes on a background thread and keeps the latest results in memory
+"""
+
+import time
+import threading
+
+# Probe defaults
+DEFAULT_INTERVAL_SECONDS = 300
+
+class HealthMonitor:
+    def __init__(self, probes, interval_seconds=DEFAULT_INTERVAL_SECONDS):
+        # probes maps a service name to a callable returning True when the service is healthy
+        self.probes = probes
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._refresh_event = threading.Event()
+        self._thread = None
+        self._probing = False
+        self._results = {
+            name: {"ok": False, "checked_at": None, "latency_ms": None, "error": None}
+            for name in probes
+        }
+
+    # Start the probe thread once; later calls are no-ops
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+                self._thread.start()
+        return self
+
+    # Ask the probe thread to re-check now without waiting for the result
+    def refresh(self):
+        self._refresh_event.set()
+
+    # Copy of the latest results, safe to render from any thread
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(result) for name, result in self._results.items()}
+
+    @property
+    def probing(self):
+        return self._probing
+
+    def _run(self):
+        while True:
+            self._probe_all()
+            self._refresh_event.wait(self.interval_seconds)
+            self._refresh_event.clear()
+
+    def _probe_all(self):
+        self._probing = True
+        try:
+            for name, probe in self.probes.items():
+                started = time.perf_counter()
+                ok, error = False, None
+                try:
+                    ok = bool(probe())
+                except Exception as e:
+                    error = str(e)
+                result = {
+                    "ok": ok,
+                    "checked_at": time.time(),
+                    "latency_ms": (time.perf_counter() - started) * 1000,
+                    "error": error
+                }
+                with self._lock:
+                    self._results[name] = result
+        finally:
+            self._probing = False
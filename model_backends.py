@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Model Backends
+Pluggable source of the generative model: Vertex AI Gemini, or a deterministic local stand-in for offline runs
+"""
+
+import os
+from fake_model import LocalModel, DEFAULT_LATENCY_SECONDS, DEFAULT_TOKENS_PER_SECOND
+
+BACKEND_VERTEX = "vertex"
+BACKEND_LOCAL = "local"
+
+# Backend and local model settings can be switched per deployment without code changes
+DEFAULT_BACKEND = os.environ.get("MTN_MODEL_BACKEND", BACKEND_VERTEX)
+LOCAL_LATENCY_SECONDS = float(os.environ.get("MTN_LOCAL_LATENCY_SECONDS", DEFAULT_LATENCY_SECONDS))
+LOCAL_TOKENS_PER_SECOND = float(os.environ.get("MTN_LOCAL_TOKENS_PER_SECOND", DEFAULT_TOKENS_PER_SECOND))
+LOCAL_FAILURE_RATE = float(os.environ.get("MTN_LOCAL_FAILURE_RATE", 0.0))
+
+class ModelBackend:
+    # What the apps program against: initialize() prepares credentials and raises if the backend is
+    # unusable, get_model() returns an object with generate_content / generate_content_async, and
+    # health_check() sends a trivial prompt through it
+    name = None
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    # Identifies the backend and model in cache keys, rate limiter buckets and circuit breakers,
+    # so local runs never share state with real Gemini calls
+    @property
+    def model_id(self):
+        return f"{self.name}:{self.model_name}"
+
+    def initialize(self):
+        raise NotImplementedError
+
+    def get_model(self):
+        raise NotImplementedError
+
+    def health_check(self):
+        return bool(self.get_model().generate_content("Hello"))
+
+class VertexBackend(ModelBackend):
+    name = BACKEND_VERTEX
+
+    def __init__(self, model_name, credentials_file, project=None, location=None):
+        super().__init__(model_name)
+        self.credentials_file = credentials_file
+        self.project = project
+        self.location = location
+
+    def initialize(self):
+        # Imported here so the local backend runs without the Vertex AI SDK installed
+        from model_clients import init_cloud
+        init_cloud(self.credentials_file, project=self.project, location=self.location)
+
+    def get_model(self):
+        from model_clients import get_model
+        self.initialize()
+        return get_model(self.model_name)
+
+class LocalBackend(ModelBackend):
+    name = BACKEND_LOCAL
+
+    def __init__(self, model_name, latency_seconds=LOCAL_LATENCY_SECONDS, tokens_per_second=LOCAL_TOKENS_PER_SECOND,
+                 failure_rate=LOCAL_FAILURE_RATE, seed=0):
+        super().__init__(model_name)
+        self.model = LocalModel(
+            latency_seconds=latency_seconds, tokens_per_second=tokens_per_second, failure_rate=failure_rate, seed=seed
+        )
+
+    def initialize(self):
+        pass
+
+    def get_model(self):
+        return self.model
+
+# Build the backend named by kind; local-only options (latency_seconds, tokens_per_second,
+# failure_rate, seed) are ignored by Vertex
+def create_backend(kind, model_name, credentials_file=None, project=None, location=None, **local_options):
+    if kind == BACKEND_VERTEX:
+        return VertexBackend(model_name, credentials_file, project=project, location=location)
+    if kind == BACKEND_LOCAL:
+        return LocalBackend(model_name, **local_options)
+    raise ValueError(f"Unknown model backend: {kind}")
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Model Client Registry
+Process-wide Google Cloud initialization and reusable Gemini model clients
+"""
+
+import os
+import threading
+import vertexai
+from vertexai.generative_models import GenerativeModel
+
+_lock = threading.Lock()
+_cloud_config = None
+_models = {}
+
+# Initialize Google Cloud once per process; repeated calls with the same settings are free
+def init_cloud(credentials_file, project=None, location=None):
+    global _cloud_config
+    config = (credentials_file, project, location)
+    with _lock:
+        if _cloud_config == config:
+            return
+        if not os.path.exists(credentials_file):
+            raise FileNotFoundError(f"Google Cloud credentials file not found: {credentials_file}")
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = credentials_file
+        vertexai.init(project=project, location=location)
+        _cloud_config = config
+        # Clients built under other settings must not be reused
+        _models.clear()
+
+def is_cloud_initialized():
+    return _cloud_config is not None
+
+# Return the shared client for a model, creating it on first use
+def get_model(model_name):
+    with _lock:
+        model = _models.get(model_name)
+        if model is None:
+            model = GenerativeModel(model_name)
+            _models[model_name] = model
+        return model
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - MSISDN Index
+MSISDN to row-position lookup over a sorted key array, with a Bloom filter that rejects unknown
+numbers before the binary search
+"""
+
+import re
+import csv
+import threading
+import numpy as np
+import pandas as pd
+from io import BytesIO, StringIO
+
+# Bloom filter defaults: at least 10 bits per key and 4 probes keep false positives near 1% or below;
+# fewer probes mean fewer random writes into the bit array while building
+DEFAULT_BITS_PER_KEY = 10
+DEFAULT_NUM_PROBES = 4
+MAX_CACHED_INDEXES = 4
+
+# Bulk input: separators between pasted MSISDNs, the shortest digit run a space-separated part needs
+# to count as a number of its own (so "+256 771 000 001" stays one number), and the longest country
+# code stripped in front of a national number
+MSISDN_SEPARATORS = r"[\r\n\t,;|]+"
+MIN_MSISDN_DIGITS = 7
+MAX_COUNTRY_CODE_DIGITS = 3
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+UPLOAD_DELIMITERS = ",;\t|"
+
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+_MASK_64 = (1 << 64) - 1
+
+# splitmix64 finalizer over a uint64 array (wrapping arithmetic)
+def _mix(values):
+    with np.errstate(over="ignore"):
+        z = values + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX_1
+        z = (z ^ (z >> np.uint64(27))) * _MIX_2
+        return z ^ (z >> np.uint64(31))
+
+# The same finalizer on one Python int, which is much cheaper than a one-element array
+def _mix_int(value):
+    z = (value + int(_GOLDEN)) & _MASK_64
+    z = ((z ^ (z >> 30)) * int(_MIX_1)) & _MASK_64
+    z = ((z ^ (z >> 27)) * int(_MIX_2)) & _MASK_64
+    return z ^ (z >> 31)
+
+class BloomFilter:
+    # Set membership with no false negatives; probes are derived by double hashing one 64-bit mix.
+    # The bit count is a power of two so a probe is reduced with a mask instead of a 64-bit modulo.
+    def __init__(self, keys, bits_per_key=DEFAULT_BITS_PER_KEY, num_probes=DEFAULT_NUM_PROBES):
+        keys = np.asarray(keys, dtype=np.uint64)
+        self.num_bits = 1 << max(6, int(len(keys) * bits_per_key - 1).bit_length())
+        self.num_probes = num_probes
+        # Set bits one byte per bit (plain fancy assignment), then pack eight to a byte
+        flags = np.zeros(self.num_bits, dtype=bool)
+        for bit in self._probes(keys):
+            flags[bit.astype(np.intp)] = True
+        self.bits = np.packbits(flags, bitorder="little")
+
+    def _probes(self, keys):
+        h1 = _mix(keys)
+        h2 = _mix(h1) | np.uint64(1)
+        mask = np.uint64(self.num_bits - 1)
+        with np.errstate(over="ignore"):
+            for i in range(self.num_probes):
+                yield (h1 + np.uint64(i) * h2) & mask
+
+    # Boolean array: False means the key is certainly absent
+    def might_contain(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        present = np.ones(len(keys), dtype=bool)
+        for bit in self._probes(keys):
+            present &= (self.bits[bit >> np.uint64(3)] >> (bit & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return present
+
+    def might_contain_one(self, key):
+        h1 = _mix_int(key & _MASK_64)
+        h2 = _mix_int(h1) | 1
+        mask = self.num_bits - 1
+        bits = self.bits
+        for i in range(self.num_probes):
+            bit = (h1 + i * h2) & mask
+            if not (bits[bit >> 3] >> (bit & 7)) & 1:
+                return False
+        return True
+
+# === BULK INPUT ===
+def split_msisdn_text(text):
+    tokens = []
+    for line in re.split(MSISDN_SEPARATORS, text or ""):
+        # A space starts a new number only between two runs that are each long enough to be one
+        group, group_digits = [], 0
+        for part in line.split():
+            digits = len(re.sub(r"\D", "", part))
+            if group and group_digits >= MIN_MSISDN_DIGITS and digits >= MIN_MSISDN_DIGITS:
+                tokens.append(" ".join(group))
+                group, group_digits = [], 0
+            group.append(part)
+            group_digits += digits
+        if group:
+            tokens.append(" ".join(group))
+    return pd.Series(tokens, dtype=object)
+
+# MSISDN values from an uploaded CSV, TXT or Excel file: the first column whose header mentions
+# MSISDN, otherwise every token in the file
+def read_msisdn_upload(data, filename):
+    if filename.lower().endswith(EXCEL_EXTENSIONS):
+        frame = pd.read_excel(BytesIO(data), dtype=str)
+        tokens = pd.concat([pd.Series(frame.columns.astype(str)), frame.stack()], ignore_index=True)
+    else:
+        text = data.decode("utf-8-sig", errors="ignore")
+        lines = text.strip().splitlines()
+        header_delimiters = [char for char in UPLOAD_DELIMITERS if lines and char in lines[0]]
+        try:
+            if not lines:
+                frame = pd.DataFrame()
+            elif len(lines) < 2 or not header_delimiters:
+                # A single column or a header-only file; sniffing these would split "MSISDN" on a letter
+                frame = pd.read_csv(StringIO(text), dtype=str, sep=(header_delimiters or [","])[0])
+            else:
+                frame = pd.read_csv(StringIO(text), dtype=str, sep=None, engine="python")
+        except (ValueError, pd.errors.ParserError, csv.Error):
+            frame = pd.DataFrame()
+        tokens = split_msisdn_text(text)
+    msisdn_columns = [col for col in frame.columns if "msisdn" in str(col).lower()]
+    if msisdn_columns:
+        return frame[msisdn_columns[0]].dropna().reset_index(drop=True)
+    return tokens
+
+# Digits-only national numbers, vectorized: "+256 771-000-001", "00256771000001", "0771000001" and
+# "771000001.0" (a number read from Excel) all become "771000001". A prefix of up to
+# MAX_COUNTRY_CODE_DIGITS digits in front of a national_length number is taken as the country code;
+# pass country_codes to strip only those. Values without digits become "".
+def normalize_msisdns(values, national_length=None, country_codes=None):
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+    digits = text.str.replace(r"\.0+$", "", regex=True).str.replace(r"\D", "", regex=True).str.lstrip("0")
+    if national_length:
+        lengths = digits.str.len()
+        prefix = digits.str[:-national_length]
+        strip = (lengths > national_length) & (
+            prefix.isin([str(code) for code in country_codes]) if country_codes
+            else lengths <= national_length + MAX_COUNTRY_CODE_DIGITS
+        )
+        digits = digits.where(~strip, digits.str[-national_length:].str.lstrip("0"))
+    return digits
+
+class MsisdnIndex:
+    # Keys are the MSISDNs sorted once next to the row positions they came from; a lookup is one Bloom
+    # check and two binary searches
+    def __init__(self, msisdn):
+        values = pd.to_numeric(pd.Series(msisdn), errors="coerce").to_numpy(dtype=float)
+        valid = np.flatnonzero(np.isfinite(values) & (values >= 0))
+        keys = values[valid].astype(np.int64)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.positions = valid[order]
+        self.bloom = BloomFilter(self.keys)
+        self.size = len(values)
+        # Most common digit count of the stored MSISDNs, i.e. the national number length
+        lengths = np.char.str_len(self.keys.astype(str)) if len(self.keys) else np.array([0])
+        self.national_length = int(np.bincount(lengths).argmax())
+
+    # Row positions of every subscriber with this MSISDN (empty when unknown)
+    def lookup(self, msisdn):
+        try:
+            key = int(msisdn)
+        except (TypeError, ValueError, OverflowError):
+            return self.positions[:0]
+        if key < 0 or key > np.iinfo(np.int64).max or not self.bloom.might_contain_one(key):
+            return self.positions[:0]
+        start = np.searchsorted(self.keys, key, side="left")
+        stop = np.searchsorted(self.keys, key, side="right")
+        # Duplicate MSISDNs come back in file order
+        return np.sort(self.positions[start:stop])
+
+    def __contains__(self, msisdn):
+        return len(self.lookup(msisdn)) > 0
+
+    # Vectorized lookup of many MSISDNs: (query positions, row positions) for every match, in
+    # query order. Entries that are not non-negative integers never match.
+    def lookup_many(self, msisdns):
+        queries = pd.to_numeric(pd.Series(msisdns, dtype=object), errors="coerce").to_numpy(dtype=float)
+        candidates = np.flatnonzero(
+            np.isfinite(queries) & (queries >= 0) & (queries < 2.0 ** 63) & (queries == np.floor(queries))
+        )
+        query_keys = queries[candidates].astype(np.int64)
+        maybe = self.bloom.might_contain(query_keys)
+        candidates, query_keys = candidates[maybe], query_keys[maybe]
+
+        start = np.searchsorted(self.keys, query_keys, side="left")
+        stop = np.searchsorted(self.keys, query_keys, side="right")
+        counts = stop - start
+        query_positions = np.repeat(candidates, counts)
+        # Offsets start..stop-1 for every query, flattened
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        row_positions = self.positions[np.repeat(start, counts) + offsets]
+        # Duplicate MSISDNs come back in file order within each query
+        order = np.lexsort((row_positions, query_positions))
+        return query_positions[order], row_positions[order]
+
+    # Normalize a bulk list and resolve it in one join. Returns the row positions of the matched
+    # subscribers (each once, in the order first requested) and a frame of the inputs not found.
+    def resolve(self, values, country_codes=None):
+        values = pd.Series(values, dtype=object).reset_index(drop=True)
+        normalized = normalize_msisdns(values, self.national_length, country_codes)
+        query_positions, row_positions = self.lookup_many(normalized.where(normalized != "", None))
+        found = np.zeros(len(values), dtype=bool)
+        found[query_positions] = True
+        _, first = np.unique(row_positions, return_index=True)
+        misses = pd.DataFrame({"Input": values, "Normalized": normalized})[~found].reset_index(drop=True)
+        return row_positions[np.sort(first)], misses
+
+# === INDEX CACHE ===
+# One index per subscriber data version, shared by every run in the process
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_msisdn_index(msisdn, version):
+    with _indexes_lock:
+        index = _indexes.get(version)
+        if index is None:
+            index = MsisdnIndex(msisdn)
+            if len(_indexes) >= MAX_CACHED_INDEXES:
+                _indexes.pop(next(iter(_indexes)))
+            _indexes[version] = index
+        return index
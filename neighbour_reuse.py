@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Nearest-Neighbour Reuse
+In-process index over the feature vectors of subscribers the model has already answered (refreshed
+from the persistent result store), so a new subscriber with a near-identical profile reuses the
+nearest cached recommendation instead of a call
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from segmentation import SubscriberFeatures
+from recommendation_cache import normalize_msisdn_text, make_subscriber_keys
+from eligibility import get_eligibility_rules
+
+# Reuse defaults; distances are Euclidean in the standardized feature space of SubscriberFeatures
+DEFAULT_MAX_DISTANCE = 0.25
+DEFAULT_MAX_VECTORS = 100000
+MAX_CONTEXTS = 8
+SEARCH_CHUNK_ROWS = 4096
+
+class NeighbourIndex:
+    # Exact nearest-neighbour search over the answered subscribers of each request context (catalogue,
+    # variables, model, prompt and settings, i.e. make_context_key), since an answer is only valid
+    # under the context it was produced in. Vectors are kept as one float32 matrix per context and
+    # searched in chunks with a single matrix product; the oldest vectors go first past max_vectors.
+    def __init__(self, reference_df=None, max_vectors=DEFAULT_MAX_VECTORS):
+        self.max_vectors = max_vectors
+        self._lock = threading.Lock()
+        self._contexts = {}
+        self._refreshed = {}
+        self.encoder = None
+        self.queries = 0
+        self.hits = 0
+        if reference_df is not None:
+            self.fit(reference_df)
+
+    # Learn the feature scaling from the full subscriber base; drops anything indexed before
+    def fit(self, reference_df):
+        with self._lock:
+            self.encoder = SubscriberFeatures().fit(reference_df)
+            self._contexts = {}
+            self._refreshed = {}
+        return self
+
+    def size(self, context_key):
+        with self._lock:
+            entry = self._contexts.get(context_key)
+            return 0 if entry is None else len(entry["records"])
+
+    # Remember each fresh table row under the feature vector of the subscriber it belongs to
+    def add(self, table_df, subscribers, context_key):
+        if table_df is None or table_df.empty or "MSISDN" not in table_df.columns or subscribers.empty:
+            return
+        position = {msisdn: i for i, msisdn in enumerate(subscribers["MSISDN"].map(normalize_msisdn_text))}
+        rows = table_df.assign(_position=table_df["MSISDN"].map(lambda value: position.get(normalize_msisdn_text(value))))
+        rows = rows.dropna(subset=["_position"]).drop_duplicates("_position")
+        if rows.empty:
+            return
+        vectors = self.encoder.transform(subscribers.iloc[rows["_position"].astype(int).to_numpy()]).astype(np.float32)
+        records = rows.drop(columns=["_position"]).to_dict(orient="records")
+
+        with self._lock:
+            entry = self._contexts.pop(context_key, None)
+            if entry is None:
+                if len(self._contexts) >= MAX_CONTEXTS:
+                    self._contexts.pop(next(iter(self._contexts)))
+                entry = {"vectors": np.empty((0, vectors.shape[1]), dtype=np.float32), "records": []}
+            entry["vectors"] = np.vstack([entry["vectors"], vectors])[-self.max_vectors:]
+            entry["records"] = (entry["records"] + records)[-self.max_vectors:]
+            entry["norms"] = (entry["vectors"] ** 2).sum(axis=1)
+            # Most recently used context last, so the least recently used one is evicted first
+            self._contexts[context_key] = entry
+
+    # Index the answers a SubscriberResultStore holds for context_key that this index has not seen yet:
+    # on first use everything stored before a restart or by other replicas, later only newer rows.
+    # subscriber_df supplies the profiles, fetched by msisdn_index (an MsisdnIndex over it); a stored
+    # answer is only used while the profile it was given for is unchanged (its result key still matches).
+    def refresh(self, store, context_key, subscriber_df, msisdn_index):
+        with self._lock:
+            since = self._refreshed.get(context_key, 0.0)
+            entry = self._contexts.get(context_key)
+            known = {normalize_msisdn_text(record["MSISDN"]) for record in entry["records"]} if entry else set()
+        stored, newest = store.records_for_context(context_key, since)
+        with self._lock:
+            self._refreshed[context_key] = newest
+        msisdns = {normalize_msisdn_text(record.get("MSISDN")) for record in stored.values()} - known
+        if not msisdns:
+            return
+        _, row_positions = msisdn_index.lookup_many(sorted(msisdns))
+        candidates = subscriber_df.iloc[np.unique(row_positions)]
+        keys = make_subscriber_keys(candidates, context_key)
+        current = [key in stored for key in keys]
+        self.add(pd.DataFrame([stored[key] for key in keys if key in stored]), candidates[current], context_key)
+
+    # (positions into the context's records, distances) of the nearest cached subscriber for every
+    # query row; positions are -1 when the context has nothing cached
+    def nearest(self, subscribers, context_key):
+        with self._lock:
+            entry = self._contexts.get(context_key)
+        if entry is None or not len(entry["records"]) or subscribers.empty:
+            return np.full(len(subscribers), -1), np.full(len(subscribers), np.inf), []
+        X = self.encoder.transform(subscribers).astype(np.float32)
+        vectors, norms = entry["vectors"], entry["norms"]
+        positions = np.empty(len(X), dtype=np.int64)
+        distances = np.empty(len(X))
+        for start in range(0, len(X), SEARCH_CHUNK_ROWS):
+            chunk = X[start:start + SEARCH_CHUNK_ROWS]
+            d = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ vectors.T + norms[None, :]
+            positions[start:start + len(d)] = d.argmin(axis=1)
+            distances[start:start + len(d)] = np.sqrt(np.maximum(d.min(axis=1), 0))
+        return positions, distances, entry["records"]
+
+    # Split a selection into rows answered by a neighbour within max_distance and the subscribers that
+    # still need the model. With apply_eligibility, a neighbour's product must also be eligible for
+    # the new subscriber. Returns (reused table, remaining subscribers, stats).
+    def reuse(self, subscribers, context_key, max_distance=DEFAULT_MAX_DISTANCE, product_df=None,
+              apply_eligibility=False):
+        positions, distances, records = self.nearest(subscribers, context_key)
+        hit = (positions >= 0) & (distances <= max_distance)
+
+        if apply_eligibility and product_df is not None and hit.any():
+            names = product_df["ProductName"].astype(str).str.strip().reset_index(drop=True)
+            product_position = pd.Series(names.index, index=names).groupby(level=0).first()
+            hit_rows = np.flatnonzero(hit)
+            eligible = get_eligibility_rules(product_df).mask(subscribers.iloc[hit_rows])
+            products = pd.Series([str(records[p].get("RecommendedProduct", "")).strip() for p in positions[hit_rows]])
+            columns = products.map(product_position)
+            known = columns.notna().to_numpy()
+            allowed = np.ones(len(hit_rows), dtype=bool)
+            allowed[known] = eligible[np.flatnonzero(known), columns[known].astype(int).to_numpy()]
+            hit[hit_rows[~allowed]] = False
+
+        reused = None
+        if hit.any():
+            reused = pd.DataFrame([records[p] for p in positions[hit]])
+            reused["MSISDN"] = subscribers["MSISDN"].to_numpy()[hit]
+        found = distances[positions >= 0]
+        with self._lock:
+            self.queries += len(subscribers)
+            self.hits += int(hit.sum())
+        stats = {
+            "queries": len(subscribers),
+            "hits": int(hit.sum()),
+            "hit_rate": float(hit.mean()) if len(hit) else 0.0,
+            "mean_hit_distance": float(distances[hit].mean()) if hit.any() else None,
+            "mean_nearest_distance": float(found.mean()) if len(found) else None,
+        }
+        return reused, subscribers[~hit], stats
+
+    # Hit rate over every query since the index was created
+    def hit_rate(self):
+        with self._lock:
+            return self.hits / self.queries if self.queries else 0.0
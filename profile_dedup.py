@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Profile Deduplication
+Groups subscribers whose selected profiling variables and bucketed usage match, so one
+representative per group is sent to the model and its answer is shared by the whole group
+"""
+
+import numpy as np
+import pandas as pd
+from prompt_serializer import PROFILE_VARIABLE_COLUMNS
+
+# Upper bucket edges per usage column; values in the same bucket count as the same profile
+USAGE_BUCKET_EDGES = {
+    "AvgDataLast90Days (GB)": [1, 3, 5, 10, 20, 50],
+    "AvgVoiceLast90Days (min)": [30, 60, 120, 240, 500],
+    "AvgSMSLast90Days": [5, 10, 20, 40],
+    "RechargeFreq": [1, 2, 4, 8],
+    "ARPU": [5, 10, 20, 30, 45, 75],
+}
+
+def _numeric(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    # Text such as "6/mo" keeps its leading number
+    values = series.astype(str).str.extract(r"([-+]?\d*\.?\d+)", expand=False)
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype=float)
+
+# Bucket index per row for one usage column; missing values get their own bucket (-1)
+def bucket_usage(series, edges):
+    values = _numeric(series)
+    buckets = np.searchsorted(np.asarray(edges, dtype=float), values, side="left")
+    return np.where(np.isnan(values), -1, buckets)
+
+# Canonical profile key columns: the profiling variables switched on plus every bucketed usage column
+def profile_key_frame(selected_subscribers, variables):
+    columns = {}
+    for col in PROFILE_VARIABLE_COLUMNS:
+        if variables.get(col) and col in selected_subscribers.columns:
+            columns[col] = selected_subscribers[col].astype(object).fillna("").astype(str).str.strip().str.lower().to_numpy()
+    for col, edges in USAGE_BUCKET_EDGES.items():
+        if col in selected_subscribers.columns:
+            columns[col] = bucket_usage(selected_subscribers[col], edges)
+    return pd.DataFrame(columns, index=range(len(selected_subscribers)))
+
+def _msisdn_text(values):
+    return pd.Series(values).astype(str).str.replace(r"\D", "", regex=True).to_numpy()
+
+class ProfileGroups:
+    # Subscribers grouped by profile key; the first member of each group is its representative
+    def __init__(self, selected_subscribers, variables):
+        self.selected_subscribers = selected_subscribers
+        keys = profile_key_frame(selected_subscribers, variables)
+        if keys.empty or keys.shape[1] == 0:
+            codes = np.arange(len(selected_subscribers))
+        else:
+            codes, _ = pd.MultiIndex.from_frame(keys).factorize()
+        _, first = np.unique(codes, return_index=True)
+        first = np.sort(first)
+        self.representatives = selected_subscribers.iloc[first]
+
+        first_of_group = pd.Series(first, index=codes[first])
+        self.members = group_members(selected_subscribers, first_of_group.reindex(codes).to_numpy())
+
+    @property
+    def size(self):
+        return len(self.selected_subscribers)
+
+    @property
+    def num_groups(self):
+        return len(self.representatives)
+
+    # Copy each representative's result row to every member of its group, keeping member order;
+    # works on a partial table too (e.g. rows streamed from one batch)
+    def fan_out(self, table_df):
+        return fan_out(table_df, self.members)
+
+# Members frame (representative MSISDN text, member MSISDN) for a grouping given as one
+# representative row position per subscriber
+def group_members(selected_subscribers, representative_positions):
+    msisdn_text = _msisdn_text(selected_subscribers["MSISDN"])
+    return pd.DataFrame({
+        "representative": msisdn_text[representative_positions],
+        "MSISDN": selected_subscribers["MSISDN"].to_numpy(),
+    })
+
+# Expand a representatives' result table to every member listed in members
+def fan_out(table_df, members):
+    if table_df is None or table_df.empty:
+        return table_df
+    rows = table_df.assign(representative=_msisdn_text(table_df["MSISDN"]))
+    rows = rows.drop_duplicates("representative").drop(columns=["MSISDN"])
+    fanned = members.merge(rows, on="representative", how="inner").drop(columns=["representative"])
+    try:
+        fanned["MSISDN"] = fanned["MSISDN"].astype(table_df["MSISDN"].dtype)
+    except (TypeError, ValueError):
+        pass
+    return fanned[list(table_df.columns)].reset_index(drop=True)
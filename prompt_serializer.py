@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Prompt Serializer
+Compact pipe-delimited serialization of subscriber and catalogue rows for Gemini prompts
+"""
+
+import math
+import pandas as pd
+
+# Columns the model always needs to size a recommendation
+SUBSCRIBER_METRIC_COLUMNS = [
+    "MSISDN",
+    "AvgDataLast90Days (GB)",
+    "AvgVoiceLast90Days (min)",
+    "AvgSMSLast90Days",
+    "RechargeFreq",
+    "ARPU"
+]
+
+# Compact subscriber frames hold RechargeFreq as a count; prompts show it with its unit
+RECHARGE_FREQ_UNIT = "/mo"
+
+# Columns controlled by the "Profiling Variables" checkboxes
+PROFILE_VARIABLE_COLUMNS = ["DemographicSegment", "DeviceType", "CurrentPlan", "VASUsed"]
+
+PRODUCT_PROMPT_COLUMNS = ["ProductName", "ProductDescription", "Category", "Tier", "ProductPrice"]
+PRODUCT_ID_PROMPT_COLUMNS = ["ProductID"] + PRODUCT_PROMPT_COLUMNS
+
+# Rough characters-per-token ratio for Gemini on English and tabular text
+CHARS_PER_TOKEN = 4
+
+# Keep the metric columns plus the profiling variables that are switched on
+def project_subscriber_columns(selected_subscribers, variables):
+    wanted = set(SUBSCRIBER_METRIC_COLUMNS) | {k for k, v in variables.items() if v and k in PROFILE_VARIABLE_COLUMNS}
+    return selected_subscribers[[col for col in selected_subscribers.columns if col in wanted]]
+
+# Header line plus one "|"-separated line per row, without padding or index
+def serialize_rows(df):
+    return df.to_csv(index=False, sep="|", float_format="%g", lineterminator="\n").strip()
+
+def serialize_subscribers(selected_subscribers, variables):
+    projected = project_subscriber_columns(selected_subscribers, variables)
+    if "RechargeFreq" in projected.columns and pd.api.types.is_integer_dtype(projected["RechargeFreq"]):
+        projected = projected.assign(RechargeFreq=projected["RechargeFreq"].astype(str) + RECHARGE_FREQ_UNIT)
+    return serialize_rows(projected)
+
+def serialize_products(product_df, columns=PRODUCT_PROMPT_COLUMNS):
+    return serialize_rows(product_df[[col for col in product_df.columns if col in columns]])
+
+# Estimated token count for a piece of prompt text
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
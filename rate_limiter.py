@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Shared Rate Limiter
+Token-bucket limiter for model quota whose state lives in SQLite, so every Streamlit session,
+process and docker-compose replica sharing the file draws from the same requests/tokens per minute
+"""
+
+import time
+import sqlite3
+import asyncio
+from contextlib import closing
+from prompt_serializer import estimate_tokens
+
+# Limiter defaults
+DEFAULT_LIMITER_FILE = "rate_limit.db"
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+
+# Waiting callers re-check at most this often, and a ticket not refreshed for STALE_SECONDS
+# belongs to a caller that died and is dropped from the queue
+POLL_SECONDS = 0.25
+STALE_SECONDS = 30.0
+
+class SharedRateLimiter:
+    def __init__(self, name, path=DEFAULT_LIMITER_FILE, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self.name = name
+        self.path = path
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS waiters (
+                    ticket INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    heartbeat REAL NOT NULL
+                )
+            """)
+            conn.execute(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?, ?, ?)",
+                (name, requests_per_minute, tokens_per_minute, time.time())
+            )
+
+    def _connect(self):
+        # Autocommit mode so BEGIN IMMEDIATE below controls the write lock explicitly
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    # Bucket levels after refilling for the time elapsed since the last update
+    def _refill(self, conn, now):
+        requests, tokens, updated_at = conn.execute(
+            "SELECT requests, tokens, updated_at FROM buckets WHERE name = ?", (self.name,)
+        ).fetchone()
+        elapsed = max(0.0, now - updated_at)
+        requests = min(self.requests_per_minute, requests + elapsed * self.requests_per_minute / 60)
+        tokens = min(self.tokens_per_minute, tokens + elapsed * self.tokens_per_minute / 60)
+        return requests, tokens
+
+    def _take_ticket(self):
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("INSERT INTO waiters (name, heartbeat) VALUES (?, ?)", (self.name, time.time()))
+            return cursor.lastrowid
+
+    def _release_ticket(self, ticket):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM waiters WHERE ticket = ?", (ticket,))
+
+    # One attempt for the caller holding ticket: returns (0 when granted else seconds to wait, the
+    # caller's ticket from now on)
+    def _try_acquire(self, ticket, cost):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM waiters WHERE heartbeat < ?", (now - STALE_SECONDS,))
+                conn.execute("UPDATE waiters SET heartbeat = ? WHERE ticket = ?", (now, ticket))
+                head = conn.execute("SELECT MIN(ticket) FROM waiters WHERE name = ?", (self.name,)).fetchone()[0]
+                if not conn.execute("SELECT 1 FROM waiters WHERE ticket = ?", (ticket,)).fetchone():
+                    # Our ticket went stale while we slept; queue again at the back with a new one
+                    ticket = conn.execute(
+                        "INSERT INTO waiters (name, heartbeat) VALUES (?, ?)", (self.name, now)
+                    ).lastrowid
+                    head = head if head is not None else ticket
+                if head != ticket:
+                    conn.execute("COMMIT")
+                    return POLL_SECONDS, ticket
+
+                # Head of the queue: take from the buckets once both can cover the cost
+                requests, tokens = self._refill(conn, now)
+                cost = min(cost, self.tokens_per_minute)
+                if requests >= 1 and tokens >= cost:
+                    conn.execute(
+                        "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                        (requests - 1, tokens - cost, now, self.name)
+                    )
+                    conn.execute("DELETE FROM waiters WHERE ticket = ?", (ticket,))
+                    conn.execute("COMMIT")
+                    return 0, ticket
+                conn.execute("COMMIT")
+                wait_requests = (1 - requests) * 60 / self.requests_per_minute if requests < 1 else 0
+                wait_tokens = (cost - tokens) * 60 / self.tokens_per_minute if tokens < cost else 0
+                return max(wait_requests, wait_tokens, 0.01), ticket
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # Block until one request and `cost` tokens are available; callers are served in arrival order
+    def acquire(self, cost=0):
+        ticket = self._take_ticket()
+        try:
+            while True:
+                wait, ticket = self._try_acquire(ticket, cost)
+                if wait == 0:
+                    return
+                time.sleep(min(wait, POLL_SECONDS))
+        except BaseException:
+            self._release_ticket(ticket)
+            raise
+
+    async def acquire_async(self, cost=0):
+        ticket = await asyncio.to_thread(self._take_ticket)
+        try:
+            while True:
+                wait, ticket = await asyncio.to_thread(self._try_acquire, ticket, cost)
+                if wait == 0:
+                    return
+                await asyncio.sleep(min(wait, POLL_SECONDS))
+        except BaseException:
+            await asyncio.to_thread(self._release_ticket, ticket)
+            raise
+
+    # Charge tokens after the fact (e.g. actual output tokens); the bucket may go negative
+    def debit(self, tokens):
+        if tokens <= 0:
+            return
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                requests, level = self._refill(conn, now)
+                conn.execute(
+                    "UPDATE buckets SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                    (requests, level - tokens, now, self.name)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+# Output tokens reported by a Gemini response, if any
+def _output_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", 0) or 0
+
+def _text(chunk):
+    try:
+        return chunk.text or ""
+    except (AttributeError, ValueError):
+        return ""
+
+class RateLimitedModel:
+    # Wraps a GenerativeModel-like object: each call waits its turn for one request plus the
+    # prompt's estimated input tokens, and actual output tokens are charged once the response is in
+    # (for a stream, once it has been read to the end or abandoned)
+    def __init__(self, model, limiter):
+        self.model = model
+        self.limiter = limiter
+
+    def generate_content(self, prompt, *args, **kwargs):
+        self.limiter.acquire(estimate_tokens(str(prompt)))
+        response = self.model.generate_content(prompt, *args, **kwargs)
+        if kwargs.get("stream"):
+            return self._debit_stream(response)
+        self.limiter.debit(_output_tokens(response))
+        return response
+
+    async def generate_content_async(self, prompt, *args, **kwargs):
+        await self.limiter.acquire_async(estimate_tokens(str(prompt)))
+        response = await self.model.generate_content_async(prompt, *args, **kwargs)
+        if kwargs.get("stream"):
+            return self._debit_stream_async(response)
+        await asyncio.to_thread(self.limiter.debit, _output_tokens(response))
+        return response
+
+    # Gemini reports the running output total on each chunk and the local stand-in a per-chunk count,
+    # so the charge is the larger of the last report and an estimate from the streamed text
+    def _debit_stream(self, stream):
+        reported, text = 0, []
+        try:
+            for chunk in stream:
+                reported = _output_tokens(chunk) or reported
+                text.append(_text(chunk))
+                yield chunk
+        finally:
+            self.limiter.debit(max(reported, estimate_tokens("".join(text))))
+
+    async def _debit_stream_async(self, stream):
+        reported, text = 0, []
+        try:
+            async for chunk in stream:
+                reported = _output_tokens(chunk) or reported
+                text.append(_text(chunk))
+                yield chunk
+        finally:
+            await asyncio.to_thread(self.limiter.debit, max(reported, estimate_tokens("".join(text))))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Recommendation Response Cache
+Disk-backed SQLite cache of Gemini recommendation results with TTL and LRU eviction
+"""
+
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from io import StringIO
+from contextlib import closing
+
+# Cache defaults
+DEFAULT_CACHE_FILE = "recommendation_cache.db"
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_MAX_SUBSCRIBER_ENTRIES = 100000
+SQLITE_BATCH = 500
+
+# Hash the parts of a request shared by every subscriber in it; settings holds any other run
+# options that change what the model is shown (JSON-serializable)
+def make_context_key(product_df, variables, model_name, prompt_template, settings=None):
+    digest = hashlib.sha256()
+    digest.update(product_df.to_csv(index=False).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(json.dumps(sorted(k for k, v in variables.items() if v)).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt_template.encode("utf-8"))
+    if settings:
+        digest.update(b"\x00")
+        digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+# One key per subscriber row, so a changed profile is never served a stale answer
+def make_subscriber_keys(selected_subscribers, context_key):
+    row_hashes = pd.util.hash_pandas_object(selected_subscribers, index=False)
+    return [f"{context_key}:{int(h):016x}" for h in row_hashes]
+
+# Digits-only MSISDN text, so model output like " 771000001 " or a float column's "771000001.0"
+# matches the source row
+def normalize_msisdn_text(value):
+    return re.sub(r"\D", "", re.sub(r"\.0+$", "", str(value).strip()))
+
+# Hash everything that changes the model's answer into one cache key
+def make_cache_key(selected_subscribers, product_df, variables, model_name, prompt_template, settings=None):
+    # Row hashes as in make_subscriber_keys; sorted, so the same set of subscribers in a different
+    # order is the same request
+    row_hashes = pd.util.hash_pandas_object(selected_subscribers, index=False).to_numpy()
+    digest = hashlib.sha256()
+    digest.update(np.sort(row_hashes).tobytes())
+    digest.update(b"\x00")
+    digest.update(make_context_key(product_df, variables, model_name, prompt_template, settings).encode("utf-8"))
+    return digest.hexdigest()
+
+class RecommendationCache:
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    cache_key TEXT PRIMARY KEY,
+                    table_json TEXT,
+                    explanation_text TEXT,
+                    full_response TEXT,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_accessed ON responses (last_accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Return (table_df, explanation_text, full_response) or None on a miss or expired entry
+    def get(self, cache_key):
+        now = time.time()
+        with self._lock, closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT table_json, explanation_text, full_response, created_at FROM responses WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            table_json, explanation_text, full_response, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE cache_key = ?", (cache_key,))
+                return None
+            conn.execute("UPDATE responses SET last_accessed = ? WHERE cache_key = ?", (now, cache_key))
+
+        table_df = pd.read_json(StringIO(table_json), orient="split", dtype=False, convert_dates=False) if table_json else None
+        return table_df, explanation_text, full_response
+
+    # Store a result and evict expired and least recently used entries
+    def put(self, cache_key, table_df, explanation_text, full_response):
+        now = time.time()
+        table_json = table_df.to_json(orient="split", index=False) if table_df is not None else None
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, table_json, explanation_text, full_response, now, now)
+            )
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute("""
+                DELETE FROM responses WHERE cache_key IN (
+                    SELECT cache_key FROM responses ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def clear(self):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM responses")
+
+class SubscriberResultStore:
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_SUBSCRIBER_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS subscriber_results (
+                    result_key TEXT PRIMARY KEY,
+                    msisdn TEXT,
+                    record_json TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriber_results_last_accessed ON subscriber_results (last_accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    # Fetch unexpired records for the given keys as {key: record}
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock, closing(self._connect()) as conn, conn:
+            for start in range(0, len(keys), SQLITE_BATCH):
+                chunk = keys[start:start + SQLITE_BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT result_key, record_json FROM subscriber_results "
+                    f"WHERE result_key IN ({placeholders}) AND created_at >= ?",
+                    (*chunk, now - self.ttl_seconds)
+                ).fetchall()
+                found.update((key, json.loads(record_json)) for key, record_json in rows)
+                conn.execute(
+                    f"UPDATE subscriber_results SET last_accessed = ? WHERE result_key IN ({placeholders})",
+                    (now, *chunk)
+                )
+        return found
+
+    # Store records given as {key: (msisdn, record)} and evict old entries
+    def put_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        rows = [
+            (key, msisdn, json.dumps(record, default=str), now, now)
+            for key, (msisdn, record) in items.items()
+        ]
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO subscriber_results VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("DELETE FROM subscriber_results WHERE created_at < ?", (now - self.ttl_seconds,))
+            conn.execute("""
+                DELETE FROM subscriber_results WHERE result_key IN (
+                    SELECT result_key FROM subscriber_results ORDER BY last_accessed DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    # Unexpired records stored under context_key after `since`, as ({key: record}, newest created_at).
+    # Keys of one context share the "context_key:" prefix, so this is a range scan of the primary key.
+    def records_for_context(self, context_key, since=0.0):
+        now = time.time()
+        with self._lock, closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT result_key, record_json, created_at FROM subscriber_results "
+                "WHERE result_key >= ? AND result_key < ? AND created_at > ? AND created_at >= ?",
+                (f"{context_key}:", f"{context_key};", since, now - self.ttl_seconds)
+            ).fetchall()
+        records = {key: json.loads(record_json) for key, record_json, _ in rows}
+        return records, max((created_at for _, _, created_at in rows), default=since)
+
+    # Split a selection into cached records and the subscribers that still need the model
+    def lookup(self, selected_subscribers, context_key):
+        keys = make_subscriber_keys(selected_subscribers, context_key)
+        cached = self.get_many(keys)
+        missing_mask = [key not in cached for key in keys]
+        return keys, cached, selected_subscribers[missing_mask]
+
+    # Remember each fresh table row under the key of the subscriber it belongs to
+    def record(self, table_df, subscribers, context_key):
+        if table_df is None or table_df.empty or "MSISDN" not in table_df.columns:
+            return
+        keys = make_subscriber_keys(subscribers, context_key)
+        key_by_msisdn = dict(zip(subscribers["MSISDN"].map(normalize_msisdn_text), keys))
+        items = {}
+        for record in table_df.to_dict(orient="records"):
+            msisdn = normalize_msisdn_text(record["MSISDN"])
+            if msisdn in key_by_msisdn:
+                items[key_by_msisdn[msisdn]] = (msisdn, record)
+        self.put_many(items)
+
+    def clear(self):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM subscriber_results")
+
+# True when every selected subscriber has a row in table_df
+def covers_subscribers(table_df, selected_subscribers):
+    if table_df is None or "MSISDN" not in table_df.columns:
+        return selected_subscribers.empty
+    answered = set(table_df["MSISDN"].map(normalize_msisdn_text))
+    return bool(selected_subscribers["MSISDN"].map(normalize_msisdn_text).isin(answered).all())
+
+# Merge cached records and fresh rows into one table in the order of the selection
+def stitch_results(selected_subscribers, keys, cached, fresh_table_df):
+    frames = []
+    cached_records = [cached[key] for key in keys if key in cached]
+    if cached_records:
+        frames.append(pd.DataFrame(cached_records))
+    if fresh_table_df is not None and not fresh_table_df.empty:
+        frames.append(fresh_table_df)
+    if not frames:
+        return None
+
+    table_df = pd.concat(frames, ignore_index=True)
+    position = {msisdn: i for i, msisdn in enumerate(selected_subscribers["MSISDN"].map(normalize_msisdn_text))}
+    order = table_df["MSISDN"].map(lambda value: position.get(normalize_msisdn_text(value), len(position)))
+    return table_df.iloc[order.argsort(kind="stable")].reset_index(drop=True)
@@ -0,0 +1,531 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Batched Recommendation Pipeline
+Shared by the web and desktop apps to run Gemini recommendations in concurrent batches
+"""
+
+import re
+import json
+import queue
+import asyncio
+import threading
+import pandas as pd
+from io import StringIO
+from prompt_serializer import serialize_subscribers, serialize_products, estimate_tokens, PRODUCT_PROMPT_COLUMNS, PRODUCT_ID_PROMPT_COLUMNS
+from catalogue_index import get_catalogue_index
+from eligibility import get_eligibility_rules
+from profile_dedup import ProfileGroups
+
+# Batching defaults
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 4
+STREAM_POLL_SECONDS = 0.1
+
+# Output modes: a markdown table parsed by regex, JSON constrained by RESPONSE_SCHEMA,
+# or JSON holding only ProductIDs that are joined back to the catalogue locally
+OUTPUT_MODE_MARKDOWN = "markdown"
+OUTPUT_MODE_JSON = "json"
+OUTPUT_MODE_IDS = "ids"
+DEFAULT_OUTPUT_MODE = OUTPUT_MODE_JSON
+
+NO_INSIGHTS_TEXT = "No additional upsell/cross-sell insights were provided."
+# Starts every note about batches that failed or were cut short, so partial results can be recognized
+INCOMPLETE_NOTE_PREFIX = "Incomplete results:"
+
+RESULT_COLUMNS = [
+    "MSISDN", "RecommendedProduct", "Category", "Tier", "ProductPrice", "Reason", "UpsellOption", "CrossSellOption"
+]
+
+PROMPT_TEMPLATE = """
+Compare the data and use it to compare with the product catalogue below. Recommend one product for each of the following subscribers (pipe-delimited, first line is the header):
+
+{subscriber_data}
+
+Use the product catalogue below (pipe-delimited, first line is the header):
+
+{product_data}
+
+Variables to consider for profiling:
+{filters}
+
+Output a clean markdown-style table with the following columns exactly:
+MSISDN | RecommendedProduct  | Category | Tier | ProductPrice | Reason | UpsellOption | CrossSellOption
+use product names instead of product codes
+After the table, include a short bullet-point section with additional upsell and cross-sell insights or strategy tips. Do not include general commentary—just the table and the follow-up list.
+always make the recommendations always.
+"""
+
+JSON_PROMPT_TEMPLATE = """
+Compare the data and use it to compare with the product catalogue below. Recommend one product for each of the following subscribers (pipe-delimited, first line is the header):
+
+{subscriber_data}
+
+Use the product catalogue below (pipe-delimited, first line is the header):
+
+{product_data}
+
+Variables to consider for profiling:
+{filters}
+
+Return JSON with a "recommendations" list holding one record per subscriber, with the fields
+MSISDN, RecommendedProduct, Category, Tier, ProductPrice, Reason, UpsellOption, CrossSellOption,
+and an "insights" list of short upsell and cross-sell strategy tips.
+use product names instead of product codes
+always make the recommendations always.
+"""
+
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "recommendations": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "MSISDN": {"type": "STRING"},
+                    "RecommendedProduct": {"type": "STRING"},
+                    "Category": {"type": "STRING"},
+                    "Tier": {"type": "STRING"},
+                    "ProductPrice": {"type": "NUMBER"},
+                    "Reason": {"type": "STRING"},
+                    "UpsellOption": {"type": "STRING"},
+                    "CrossSellOption": {"type": "STRING"},
+                },
+                "required": RESULT_COLUMNS,
+            },
+        },
+        "insights": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["recommendations", "insights"],
+}
+
+ID_PROMPT_TEMPLATE = """
+Compare the data and use it to compare with the product catalogue below. Recommend one product for each of the following subscribers (pipe-delimited, first line is the header):
+
+{subscriber_data}
+
+Use the product catalogue below (pipe-delimited, first line is the header):
+
+{product_data}
+
+Variables to consider for profiling:
+{filters}
+
+Return JSON with a "recommendations" list holding one record per subscriber, with the fields
+MSISDN, ProductID, UpsellProductID, CrossSellProductID and a Reason of at most 15 words,
+and an "insights" list of short upsell and cross-sell strategy tips.
+Use ProductID values from the catalogue only; do not repeat product names, categories, tiers or prices.
+always make the recommendations always.
+"""
+
+ID_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "recommendations": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "MSISDN": {"type": "STRING"},
+                    "ProductID": {"type": "STRING"},
+                    "UpsellProductID": {"type": "STRING"},
+                    "CrossSellProductID": {"type": "STRING"},
+                    "Reason": {"type": "STRING"},
+                },
+                "required": ["MSISDN", "ProductID", "UpsellProductID", "CrossSellProductID", "Reason"],
+            },
+        },
+        "insights": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["recommendations", "insights"],
+}
+
+def prompt_template_for(output_mode):
+    if output_mode == OUTPUT_MODE_IDS:
+        return ID_PROMPT_TEMPLATE
+    return JSON_PROMPT_TEMPLATE if output_mode == OUTPUT_MODE_JSON else PROMPT_TEMPLATE
+
+# Catalogue columns the prompt shows; ID mode adds the ProductID the model answers with
+def product_columns_for(output_mode):
+    return PRODUCT_ID_PROMPT_COLUMNS if output_mode == OUTPUT_MODE_IDS else PRODUCT_PROMPT_COLUMNS
+
+# Add the JSON response settings to a generation config when structured output is on
+def generation_config_for(output_mode, generation_config=None):
+    generation_config = dict(generation_config or {})
+    if output_mode in (OUTPUT_MODE_JSON, OUTPUT_MODE_IDS):
+        generation_config["response_mime_type"] = "application/json"
+        generation_config["response_schema"] = ID_RESPONSE_SCHEMA if output_mode == OUTPUT_MODE_IDS else RESPONSE_SCHEMA
+    return generation_config or None
+
+# Build the Gemini prompt for one group of subscribers
+def build_prompt(selected_subscribers, product_df, variables, output_mode=OUTPUT_MODE_MARKDOWN):
+    subscriber_data_str = serialize_subscribers(selected_subscribers, variables)
+    product_data_str = serialize_products(product_df, columns=product_columns_for(output_mode))
+    filters = "\n".join(f"- Include {k}" for k, v in variables.items() if v)
+    return prompt_template_for(output_mode).format(
+        subscriber_data=subscriber_data_str,
+        product_data=product_data_str,
+        filters=filters
+    )
+
+# Catalogue rows to send with one batch: the TF-IDF shortlist, or everything when top_k is None,
+# limited to products eligible for at least one subscriber in the batch when rules are given
+def batch_catalogue(batch, product_df, candidate_top_k=None, catalogue_index=None, eligibility_rules=None):
+    eligible = eligibility_rules.mask(batch) if eligibility_rules is not None else None
+    if not candidate_top_k and eligible is None:
+        return product_df
+    catalogue_index = catalogue_index or get_catalogue_index(product_df)
+    return catalogue_index.candidates(batch, top_k=candidate_top_k or None, eligible=eligible)
+
+# Estimated input tokens of each batch prompt for a run
+def estimate_prompt_tokens(selected_subscribers, product_df, variables, batch_size=DEFAULT_BATCH_SIZE,
+                           candidate_top_k=None, output_mode=OUTPUT_MODE_MARKDOWN, apply_eligibility=False,
+                           dedupe_profiles=False):
+    if dedupe_profiles:
+        selected_subscribers = ProfileGroups(selected_subscribers, variables).representatives
+    catalogue_index = get_catalogue_index(product_df) if candidate_top_k else None
+    eligibility_rules = get_eligibility_rules(product_df) if apply_eligibility else None
+    return [
+        estimate_tokens(build_prompt(
+            batch, batch_catalogue(batch, product_df, candidate_top_k, catalogue_index, eligibility_rules),
+            variables, output_mode
+        ))
+        for batch in split_batches(selected_subscribers, batch_size)
+    ]
+
+# Split the markdown table and the insights out of a model response
+def parse_response(response_text):
+    potential_table_match = re.search(r"((?:\|.+\|\n)+)", response_text)
+    table_df = None
+    if potential_table_match:
+        table_text = potential_table_match.group(1)
+        try:
+            table_df = pd.read_csv(StringIO(table_text), sep="|", engine='python')
+            table_df = table_df.dropna(axis=1, how='all').dropna(axis=0, how='all')
+            table_df.columns = [col.strip() for col in table_df.columns]
+            # Drop the markdown separator row (|---|---|)
+            first_col = table_df.columns[0]
+            table_df = table_df[~table_df[first_col].astype(str).str.fullmatch(r"\s*:?-+:?\s*")]
+        except:
+            table_df = None
+
+    explanation_text = response_text.replace(table_text, "") if potential_table_match else NO_INSIGHTS_TEXT
+    return table_df, explanation_text
+
+# Typed recommendations table and bullet-point insights from a structured JSON response
+def parse_json_response(response_text):
+    try:
+        payload = json.loads(response_text)
+    except ValueError:
+        table_df, explanation_text = salvage_json_response(response_text, OUTPUT_MODE_JSON)
+        return (_type_json_table(table_df) if table_df is not None else None), explanation_text
+
+    table_df = _type_json_table(
+        pd.DataFrame.from_records(payload.get("recommendations") or [], columns=RESULT_COLUMNS)
+    )
+    insights = [str(tip).strip() for tip in payload.get("insights") or [] if str(tip).strip()]
+    explanation_text = "\n".join(f"- {tip}" for tip in insights) if insights else NO_INSIGHTS_TEXT
+    return table_df, explanation_text
+
+def _type_json_table(table_df):
+    table_df["MSISDN"] = pd.to_numeric(
+        table_df["MSISDN"].astype(str).str.replace(r"\D", "", regex=True), errors="coerce"
+    ).astype("Int64")
+    table_df["ProductPrice"] = pd.to_numeric(table_df["ProductPrice"], errors="coerce")
+    text_columns = [col for col in RESULT_COLUMNS if col not in ("MSISDN", "ProductPrice")]
+    table_df[text_columns] = table_df[text_columns].astype("string")
+    return table_df
+
+# Complete records of a JSON response that does not parse as a whole (typically cut off at
+# max_output_tokens), with a note saying the batch was only partly parsed or not at all
+def salvage_json_response(response_text, output_mode, product_lookup=None):
+    table_df = StreamingRowParser(output_mode, product_lookup).feed(response_text)
+    if table_df is None or table_df.empty:
+        return None, f"{INCOMPLETE_NOTE_PREFIX} a batch response could not be parsed and its rows were skipped."
+    return table_df, (
+        f"{INCOMPLETE_NOTE_PREFIX} a batch response was cut off or malformed; "
+        f"{len(table_df)} complete row(s) were kept."
+    )
+
+# Catalogue indexed by ProductID for hydrating ID-only responses
+def index_products(product_df):
+    product_lookup = product_df.copy()
+    product_lookup["ProductID"] = product_lookup["ProductID"].astype(str).str.strip().str.upper()
+    return product_lookup.drop_duplicates("ProductID").set_index("ProductID")
+
+# Fill names, category, tier and price for ID-only records from the indexed catalogue
+def hydrate_recommendations(records_df, product_lookup):
+    def product_ids(col):
+        return records_df[col].astype(str).str.strip().str.upper()
+
+    chosen = product_lookup.reindex(product_ids("ProductID"))
+    table_df = pd.DataFrame({
+        "MSISDN": pd.to_numeric(
+            records_df["MSISDN"].astype(str).str.replace(r"\D", "", regex=True), errors="coerce"
+        ).astype("Int64"),
+        "RecommendedProduct": chosen["ProductName"].to_numpy(),
+        "Category": chosen["Category"].to_numpy(),
+        "Tier": chosen["Tier"].to_numpy(),
+        "ProductPrice": pd.to_numeric(chosen["ProductPrice"], errors="coerce").to_numpy(),
+        "Reason": records_df["Reason"].to_numpy(),
+        "UpsellOption": product_lookup["ProductName"].reindex(product_ids("UpsellProductID")).to_numpy(),
+        "CrossSellOption": product_lookup["ProductName"].reindex(product_ids("CrossSellProductID")).to_numpy(),
+    })
+    text_columns = ["RecommendedProduct", "Category", "Tier", "Reason", "UpsellOption", "CrossSellOption"]
+    table_df[text_columns] = table_df[text_columns].astype("string")
+    return table_df
+
+# Hydrated recommendations table and insights from an ID-only JSON response
+def parse_id_response(response_text, product_lookup):
+    try:
+        payload = json.loads(response_text)
+    except ValueError:
+        return salvage_json_response(response_text, OUTPUT_MODE_IDS, product_lookup)
+
+    records_df = pd.DataFrame.from_records(
+        payload.get("recommendations") or [],
+        columns=["MSISDN", "ProductID", "UpsellProductID", "CrossSellProductID", "Reason"]
+    )
+    table_df = hydrate_recommendations(records_df, product_lookup)
+
+    insights = [str(tip).strip() for tip in payload.get("insights") or [] if str(tip).strip()]
+    explanation_text = "\n".join(f"- {tip}" for tip in insights) if insights else NO_INSIGHTS_TEXT
+    return table_df, explanation_text
+
+# Turn a typed record list from a JSON response into the recommendations table
+def _records_to_table(records, output_mode, product_lookup=None):
+    if output_mode == OUTPUT_MODE_IDS:
+        records_df = pd.DataFrame.from_records(
+            records, columns=["MSISDN", "ProductID", "UpsellProductID", "CrossSellProductID", "Reason"]
+        )
+        return hydrate_recommendations(records_df, product_lookup)
+    return pd.DataFrame.from_records(records, columns=RESULT_COLUMNS)
+
+class StreamingRowParser:
+    # Picks completed recommendation rows out of a response while it is still being generated
+    def __init__(self, output_mode, product_lookup=None):
+        self.output_mode = output_mode
+        self.product_lookup = product_lookup
+        self._buffer = ""
+        self._position = 0
+        self._header = None
+        # JSON scanner state
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    # Feed the next chunk of text; returns a DataFrame of rows completed by it, or None
+    def feed(self, text):
+        self._buffer += text
+        if self.output_mode in (OUTPUT_MODE_JSON, OUTPUT_MODE_IDS):
+            records = self._scan_json()
+            return _records_to_table(records, self.output_mode, self.product_lookup) if records else None
+        return self._scan_markdown()
+
+    def _scan_markdown(self):
+        rows = []
+        while True:
+            line_end = self._buffer.find("\n", self._position)
+            if line_end == -1:
+                break
+            line = self._buffer[self._position:line_end].strip()
+            self._position = line_end + 1
+            if not (line.startswith("|") and line.endswith("|")):
+                continue
+            cells = [cell.strip() for cell in line.strip("|").split("|")]
+            if self._header is None:
+                self._header = cells
+            elif not all(re.fullmatch(r":?-+:?", cell) for cell in cells) and len(cells) == len(self._header):
+                rows.append(cells)
+        return pd.DataFrame(rows, columns=self._header) if rows else None
+
+    # Track brace depth outside strings; every object closing at depth 2 is one recommendation record
+    def _scan_json(self):
+        records = []
+        for i in range(self._position, len(self._buffer)):
+            char = self._buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if char == "{" and self._depth == 3:
+                    self._object_start = i
+            elif char in "}]":
+                if char == "}" and self._depth == 3 and self._object_start is not None:
+                    try:
+                        records.append(json.loads(self._buffer[self._object_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._object_start = None
+                self._depth -= 1
+        self._position = len(self._buffer)
+        return records
+
+# Split subscribers into row batches of at most batch_size
+def split_batches(selected_subscribers, batch_size=DEFAULT_BATCH_SIZE):
+    batch_size = max(1, int(batch_size))
+    return [
+        selected_subscribers.iloc[start:start + batch_size]
+        for start in range(0, len(selected_subscribers), batch_size)
+    ]
+
+# Merge per-batch results back into one table, one insights text and one raw response
+def merge_batch_results(results):
+    tables = [table_df for table_df, _, _ in results if table_df is not None]
+    table_df = pd.concat(tables, ignore_index=True) if tables else None
+
+    explanations = [text.strip() for _, text, _ in results if text and text.strip() != NO_INSIGHTS_TEXT]
+    explanation_text = "\n\n".join(explanations) if explanations else NO_INSIGHTS_TEXT
+
+    full_response = "\n\n".join(response_text for _, _, response_text in results if response_text)
+    return table_df, explanation_text, full_response
+
+# Text of one streamed chunk; chunks carrying only a finish reason have none
+def _chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+# Run a single batch once the concurrency semaphore allows it
+async def _run_batch(model, batch, product_df, variables, semaphore, candidate_top_k=None, catalogue_index=None,
+                     generation_config=None, output_mode=OUTPUT_MODE_MARKDOWN, product_lookup=None, on_rows=None,
+                     eligibility_rules=None):
+    prompt = build_prompt(
+        batch, batch_catalogue(batch, product_df, candidate_top_k, catalogue_index, eligibility_rules),
+        variables, output_mode
+    )
+    generation_config = generation_config_for(output_mode, generation_config)
+    async with semaphore:
+        if on_rows is None:
+            response = await model.generate_content_async(prompt, generation_config=generation_config)
+            response_text = response.text
+        else:
+            # Stream the response and hand each completed row to on_rows as soon as it parses
+            parser = StreamingRowParser(output_mode, product_lookup)
+            chunks = []
+            stream = await model.generate_content_async(prompt, generation_config=generation_config, stream=True)
+            async for chunk in stream:
+                text = _chunk_text(chunk)
+                chunks.append(text)
+                rows = parser.feed(text)
+                if rows is not None and not rows.empty:
+                    on_rows(rows)
+            response_text = "".join(chunks)
+    if output_mode == OUTPUT_MODE_IDS:
+        table_df, explanation_text = parse_id_response(response_text, product_lookup)
+    elif output_mode == OUTPUT_MODE_JSON:
+        table_df, explanation_text = parse_json_response(response_text)
+    else:
+        table_df, explanation_text = parse_response(response_text)
+    return table_df, explanation_text, response_text
+
+def add_incomplete_note(explanation_text, note):
+    return f"{explanation_text}\n\n{INCOMPLETE_NOTE_PREFIX} {note}"
+
+# True when some batch failed or was only partly answered
+def is_incomplete(explanation_text):
+    return INCOMPLETE_NOTE_PREFIX in (explanation_text or "")
+
+# Fire all batches concurrently, at most max_concurrency in flight at once
+async def generate_batched_async(model, selected_subscribers, product_df, variables,
+                                 batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                                 candidate_top_k=None, generation_config=None, output_mode=OUTPUT_MODE_MARKDOWN,
+                                 on_rows=None, apply_eligibility=False, dedupe_profiles=False):
+    # Only one representative per distinct profile goes to the model; its rows are fanned out to the group
+    groups = ProfileGroups(selected_subscribers, variables) if dedupe_profiles else None
+    if groups is not None:
+        selected_subscribers = groups.representatives
+        if on_rows is not None:
+            emit_rows = on_rows
+            on_rows = lambda rows: emit_rows(groups.fan_out(rows))
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+    batches = split_batches(selected_subscribers, batch_size)
+    catalogue_index = get_catalogue_index(product_df) if candidate_top_k or apply_eligibility else None
+    eligibility_rules = get_eligibility_rules(product_df) if apply_eligibility else None
+    product_lookup = index_products(product_df) if output_mode == OUTPUT_MODE_IDS else None
+    results = await asyncio.gather(
+        *(_run_batch(model, batch, product_df, variables, semaphore,
+                     candidate_top_k=candidate_top_k, catalogue_index=catalogue_index,
+                     generation_config=generation_config, output_mode=output_mode,
+                     product_lookup=product_lookup, on_rows=on_rows, eligibility_rules=eligibility_rules)
+          for batch in batches),
+        return_exceptions=True
+    )
+
+    # A batch that still fails after its own retries does not throw away the others
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures and len(failures) == len(results):
+        raise failures[0]
+    table_df, explanation_text, full_response = merge_batch_results(
+        [result for result in results if not isinstance(result, BaseException)]
+    )
+    if groups is not None:
+        table_df = groups.fan_out(table_df)
+    if failures:
+        explanation_text = add_incomplete_note(
+            explanation_text, f"{len(failures)} of {len(results)} batches failed and were skipped: {failures[0]}"
+        )
+    return table_df, explanation_text, full_response
+
+# === BACKGROUND EVENT LOOP ===
+# Streamlit script threads and Tkinter worker threads have no event loop of their own,
+# and the async Gemini client binds its channel to the loop it was first used on,
+# so every run is scheduled on one long-lived loop.
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="recommendation-pipeline", daemon=True).start()
+        return _loop
+
+# Run a coroutine on the background loop and wait for its result
+def run_coroutine(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# Blocking entry point used by the apps
+def generate_batched(model, selected_subscribers, product_df, variables,
+                     batch_size=DEFAULT_BATCH_SIZE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                     candidate_top_k=None, generation_config=None, output_mode=OUTPUT_MODE_MARKDOWN,
+                     apply_eligibility=False, dedupe_profiles=False):
+    return run_coroutine(generate_batched_async(
+        model, selected_subscribers, product_df, variables,
+        batch_size=batch_size, max_concurrency=max_concurrency, candidate_top_k=candidate_top_k,
+        generation_config=generation_config, output_mode=output_mode, apply_eligibility=apply_eligibility,
+        dedupe_profiles=dedupe_profiles
+    ))
+
+class BatchStream:
+    # Runs the batched pipeline in streaming mode; iterate it on the caller's thread to receive
+    # DataFrames of newly completed rows, then call result() for the merged final output
+    def __init__(self, model, selected_subscribers, product_df, variables, **options):
+        self._rows = queue.Queue()
+        self._future = asyncio.run_coroutine_threadsafe(
+            generate_batched_async(model, selected_subscribers, product_df, variables, on_rows=self._rows.put, **options),
+            get_event_loop()
+        )
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self._rows.get(timeout=STREAM_POLL_SECONDS)
+            except queue.Empty:
+                if self._future.done():
+                    break
+        while not self._rows.empty():
+            yield self._rows.get_nowait()
+
+    def result(self):
+        return self._future.result()
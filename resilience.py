@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Resilient Model Invocation
+Jittered exponential backoff, retryable error classification and a circuit breaker around Gemini calls
+"""
+
+import time
+import random
+import asyncio
+import threading
+
+# Retry defaults
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 30.0
+
+# Circuit breaker defaults
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+# HTTP statuses and google.api_core exception names worth retrying
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted", "RetryError"
+}
+
+class CircuitOpenError(Exception):
+    pass
+
+# True for quota, timeout, connection and 5xx errors; False for bad requests, auth and the like
+def is_retryable(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+# "Full jitter" backoff: a random delay up to base * 2^attempt, capped at max_delay
+def backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive failures and fails fast until reset_timeout has
+    # passed; then one trial call is let through (half-open) to decide whether to close again
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    # True when this call is the half-open trial; the caller must then end it with record_success,
+    # record_failure or release_trial
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError("Gemini endpoint is unavailable; failing fast until it recovers")
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    # End a trial that gave no verdict on the endpoint (a non-retryable error or a cancellation), so
+    # the next call is let through as a new trial
+    def release_trial(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+# Call an async function with retries; only retryable errors count against the breaker
+async def call_with_retry_async(call, breaker=None, max_retries=DEFAULT_MAX_RETRIES,
+                                base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    attempt = 0
+    while True:
+        trial = breaker.before_call() if breaker is not None else False
+        try:
+            result = await call()
+        except Exception as e:
+            retryable = is_retryable(e)
+            if breaker is not None and retryable:
+                breaker.record_failure()
+                trial = False
+            if not retryable or attempt >= max_retries:
+                raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+                trial = False
+            return result
+        finally:
+            # Every other way out of the trial (non-retryable error, cancellation) releases it
+            if trial:
+                breaker.release_trial()
+        await asyncio.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+# Blocking counterpart of call_with_retry_async
+def call_with_retry(call, breaker=None, max_retries=DEFAULT_MAX_RETRIES,
+                    base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    attempt = 0
+    while True:
+        trial = breaker.before_call() if breaker is not None else False
+        try:
+            result = call()
+        except Exception as e:
+            retryable = is_retryable(e)
+            if breaker is not None and retryable:
+                breaker.record_failure()
+                trial = False
+            if not retryable or attempt >= max_retries:
+                raise
+        else:
+            if breaker is not None:
+                breaker.record_success()
+                trial = False
+            return result
+        finally:
+            # Every other way out of the trial (non-retryable error, cancellation) releases it
+            if trial:
+                breaker.release_trial()
+        time.sleep(backoff_delay(attempt, base_delay, max_delay))
+        attempt += 1
+
+class ResilientModel:
+    # Wraps a GenerativeModel-like object so every generate call is retried and guarded by the breaker.
+    # A streamed call is retried until the stream opens; errors after that surface to the caller.
+    def __init__(self, model, breaker=None, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.model = model
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.retry_options = dict(max_retries=max_retries, base_delay=base_delay, max_delay=max_delay)
+
+    def generate_content(self, *args, **kwargs):
+        return call_with_retry(lambda: self.model.generate_content(*args, **kwargs), self.breaker, **self.retry_options)
+
+    async def generate_content_async(self, *args, **kwargs):
+        return await call_with_retry_async(
+            lambda: self.model.generate_content_async(*args, **kwargs), self.breaker, **self.retry_options
+        )
+
+# === SHARED BREAKERS ===
+# One breaker per model name, so every caller in the process sees the same endpoint state
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(model_name):
+    with _breakers_lock:
+        breaker = _breakers.get(model_name)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[model_name] = breaker
+        return breaker
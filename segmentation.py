@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Subscriber Segmentation
+Mini-batch k-means over standardized usage and one-hot profile features, so the model is asked once
+per behavioural segment and the answer is personalized locally for each member
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+from profile_dedup import group_members, fan_out
+from fast_recommender import get_affinity_scorer
+from eligibility import get_eligibility_rules
+from recommendation_pipeline import generate_batched
+
+NUMERIC_FEATURES = [
+    "AvgDataLast90Days (GB)", "AvgVoiceLast90Days (min)", "AvgSMSLast90Days", "RechargeFreq", "ARPU"
+]
+CATEGORICAL_FEATURES = ["DemographicSegment", "DeviceType", "CurrentPlan", "VASUsed"]
+# Columns holding comma-separated lists, encoded multi-hot
+MULTI_VALUE_FEATURES = ["VASUsed"]
+
+# Segmentation defaults
+DEFAULT_NUM_CLUSTERS = 24
+DEFAULT_MINI_BATCH_SIZE = 1024
+DEFAULT_MAX_ITER = 100
+INIT_SAMPLE_SIZE = 10000
+# One-hot columns are scaled down so profile labels do not swamp the usage features
+CATEGORICAL_WEIGHT = 0.5
+ASSIGN_CHUNK_ROWS = 65536
+
+# Leading number of a value such as "6/mo"
+def parse_numeric(series):
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype=float)
+    codes, uniques = pd.factorize(series.astype(str))
+    parsed = pd.to_numeric(pd.Series(uniques).str.extract(r"([-+]?\d*\.?\d+)", expand=False), errors="coerce")
+    return parsed.to_numpy(dtype=float)[codes]
+
+def _category_values(series, multi_value):
+    text = series.astype(object).fillna("").astype(str)
+    if multi_value:
+        return text.str.split(",").map(lambda values: [v.strip() for v in values if v.strip()])
+    return text.str.strip().map(lambda value: [value] if value else [])
+
+class SubscriberFeatures:
+    # Standardized log usage (missing = mean) followed by weighted one-hot profile columns. fit()
+    # learns the scaling and the category vocabulary; values outside the vocabulary encode as zeros.
+    def fit(self, df):
+        numeric = np.log1p(np.clip(self._numeric_matrix(df), 0, None))
+        means = np.nanmean(numeric, axis=0) if len(df) else np.zeros(len(NUMERIC_FEATURES))
+        scales = np.nanstd(numeric, axis=0) if len(df) else np.ones(len(NUMERIC_FEATURES))
+        scales[~(scales > 0)] = 1.0
+        self.means = np.nan_to_num(means)
+        self.scales = scales
+        self.vocabulary = {}
+        for col in CATEGORICAL_FEATURES:
+            if col in df.columns:
+                values = _category_values(df[col], col in MULTI_VALUE_FEATURES)
+                self.vocabulary[col] = sorted({value for row in values for value in row})
+        return self
+
+    @staticmethod
+    def _numeric_matrix(df):
+        return np.column_stack([
+            parse_numeric(df[col]) if col in df.columns else np.full(len(df), np.nan) for col in NUMERIC_FEATURES
+        ])
+
+    @property
+    def dimensions(self):
+        return len(NUMERIC_FEATURES) + sum(len(vocabulary) for vocabulary in self.vocabulary.values())
+
+    def transform(self, df):
+        numeric = (np.log1p(np.clip(self._numeric_matrix(df), 0, None)) - self.means) / self.scales
+        blocks = [np.nan_to_num(numeric)]
+        for col, vocabulary in self.vocabulary.items():
+            onehot = np.zeros((len(df), len(vocabulary)))
+            if col in df.columns and vocabulary:
+                position = {value: i for i, value in enumerate(vocabulary)}
+                # Encode each distinct cell once and broadcast back to rows
+                codes, uniques = pd.factorize(df[col].astype(object).fillna("").astype(str))
+                unique_rows = np.zeros((len(uniques), len(vocabulary)))
+                for i, values in enumerate(_category_values(pd.Series(uniques), col in MULTI_VALUE_FEATURES)):
+                    for value in values:
+                        if value in position:
+                            unique_rows[i, position[value]] = 1.0
+                onehot = unique_rows[codes] if len(uniques) else onehot
+            blocks.append(onehot * CATEGORICAL_WEIGHT)
+        return np.hstack(blocks)
+
+class SubscriberSegmenter:
+    # fit() learns the feature scaling, the category vocabulary and the centroids; predict() assigns
+    # rows to the nearest centroid; partial_fit() folds new subscribers into the centroids with the
+    # usual decaying per-centroid learning rate instead of refitting, and fold_in() does so only for
+    # MSISDNs the segmenter has not seen yet
+    def __init__(self, num_clusters=DEFAULT_NUM_CLUSTERS, batch_size=DEFAULT_MINI_BATCH_SIZE,
+                 max_iter=DEFAULT_MAX_ITER, seed=0):
+        self.num_clusters = num_clusters
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self._random = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.encoder = SubscriberFeatures()
+        self.centers = None
+        self.counts = None
+        self.seen = pd.Index([])
+
+    def features(self, df):
+        return self.encoder.transform(df)
+
+    # === CLUSTERING ===
+    @staticmethod
+    def _distances(X, centers):
+        return (X ** 2).sum(axis=1)[:, None] - 2 * X @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+
+    def _nearest(self, X, centers):
+        labels = np.empty(len(X), dtype=np.int64)
+        distances = np.empty(len(X))
+        for start in range(0, len(X), ASSIGN_CHUNK_ROWS):
+            d = self._distances(X[start:start + ASSIGN_CHUNK_ROWS], centers)
+            labels[start:start + len(d)] = d.argmin(axis=1)
+            distances[start:start + len(d)] = np.maximum(d.min(axis=1), 0)
+        return labels, np.sqrt(distances)
+
+    # k-means++ seeding on a sample of the rows
+    def _init_centers(self, X, k):
+        sample = X[self._random.choice(len(X), min(len(X), INIT_SAMPLE_SIZE), replace=False)]
+        centers = [sample[self._random.integers(len(sample))]]
+        closest = ((sample - centers[0]) ** 2).sum(axis=1)
+        for _ in range(1, k):
+            total = closest.sum()
+            if total <= 0:
+                break
+            centers.append(sample[self._random.choice(len(sample), p=closest / total)])
+            closest = np.minimum(closest, ((sample - centers[-1]) ** 2).sum(axis=1))
+        return np.array(centers)
+
+    # Mini-batch step: each centroid moves towards its batch members by count / total count
+    def _update(self, batch):
+        labels, _ = self._nearest(batch, self.centers)
+        batch_counts = np.bincount(labels, minlength=len(self.centers))
+        sums = np.zeros_like(self.centers)
+        np.add.at(sums, labels, batch)
+        self.counts += batch_counts
+        moved = batch_counts > 0
+        self.centers[moved] += (
+            sums[moved] - batch_counts[moved, None] * self.centers[moved]
+        ) / self.counts[moved, None]
+
+    def fit(self, df):
+        with self._lock:
+            self.encoder.fit(df)
+            X = self.features(df)
+            self.centers = self._init_centers(X, min(self.num_clusters, len(X)))
+            self.counts = np.zeros(len(self.centers))
+            for _ in range(self.max_iter):
+                self._update(X[self._random.choice(len(X), min(self.batch_size, len(X)), replace=False)])
+            self.seen = pd.Index(self._msisdn_keys(df).unique())
+        return self
+
+    def partial_fit(self, df):
+        if df.empty:
+            return self
+        if self.centers is None:
+            return self.fit(df)
+        with self._lock:
+            X = self.features(df)
+            for start in range(0, len(X), self.batch_size):
+                self._update(X[start:start + self.batch_size])
+        return self
+
+    # MSISDNs as digit strings, so "771000001.0" read from a float column matches "771000001"
+    @staticmethod
+    def _msisdn_keys(df):
+        if "MSISDN" not in df.columns:
+            return pd.Series([], dtype=str)
+        return df["MSISDN"].astype(str).str.strip().str.replace(r"\.0+$", "", regex=True)
+
+    # The unseen MSISDNs are claimed under the lock before they are folded in, so concurrent requests
+    # for the same new subscribers count them once
+    def fold_in(self, df):
+        if self.centers is None:
+            return self.fit(df)
+        msisdn = self._msisdn_keys(df)
+        with self._lock:
+            unseen = ~msisdn.isin(self.seen).to_numpy()
+            new_rows = df[unseen & ~msisdn.duplicated().to_numpy()]
+            if not new_rows.empty:
+                self.seen = self.seen.append(pd.Index(msisdn[unseen].unique()))
+        self.partial_fit(new_rows)
+        return self
+
+    # (cluster label, distance to its centroid) for every row
+    def predict(self, df):
+        with self._lock:
+            return self._nearest(self.features(df), self.centers)
+
+# Position of each subscriber's segment representative: the member closest to the segment centroid
+def segment_representatives(labels, distances):
+    order = np.lexsort((distances, labels))
+    segment_ids, first = np.unique(labels[order], return_index=True)
+    representative_of = pd.Series(order[first], index=segment_ids)
+    return representative_of.reindex(labels).to_numpy(), order[first]
+
+# Every member keeps the segment's product and the model's reason; the local scorer only picks each
+# member's own upsell and cross-sell around that product. Where the segment's product is not in the
+# catalogue or not eligible for a member, the scorer's pick within the segment's category replaces
+# it. The representatives keep the model's row exactly as answered.
+def personalize(segment_df, selected_subscribers, product_df, variables, representatives, apply_eligibility=False):
+    if segment_df is None or segment_df.empty:
+        return segment_df
+    scorer = get_affinity_scorer(product_df)
+    eligible = get_eligibility_rules(product_df).mask(selected_subscribers) if apply_eligibility else None
+    scores = scorer.score(selected_subscribers, variables)
+    if eligible is not None:
+        scores = np.where(eligible, scores, -np.inf)
+
+    names = scorer.product_df["ProductName"].astype(str).str.strip()
+    product_position = pd.Series(names.index, index=names).groupby(level=0).first()
+    segment_top = (
+        segment_df["RecommendedProduct"].astype(str).str.strip().map(product_position).fillna(-1).astype(int).to_numpy()
+    )
+    usable = segment_top >= 0
+    if eligible is not None:
+        usable &= eligible[np.arange(len(segment_top)), np.maximum(segment_top, 0)]
+    is_representative = np.zeros(len(segment_top), dtype=bool)
+    is_representative[representatives] = True
+    personal_rows = usable & ~is_representative
+    replaced_rows = ~usable & ~is_representative
+
+    personal_df = segment_df.copy()
+    if personal_rows.any():
+        _, upsell, cross_sell = scorer.pick(scores[personal_rows], segment_top[personal_rows])
+        product_names = scorer.product_df["ProductName"].astype(str).to_numpy()
+        for col, picks in (("UpsellOption", upsell), ("CrossSellOption", cross_sell)):
+            personal_df.loc[personal_rows, col] = pd.array(
+                np.where(picks >= 0, product_names[np.maximum(picks, 0)], None), dtype="string"
+            )
+    if replaced_rows.any():
+        local_df = scorer.recommend(
+            selected_subscribers[replaced_rows], variables, eligible[replaced_rows] if eligible is not None else None,
+            top_categories=segment_df["Category"].astype(str).str.strip().to_numpy()[replaced_rows]
+        )
+        personal_df.loc[replaced_rows, local_df.columns] = local_df.to_numpy()
+    return personal_df
+
+# Ask the model once per segment (via its most central member), give every member the segment's
+# answer and personalize its upsell and cross-sell locally. New subscribers are folded into the centroids as they arrive.
+def generate_segmented(model, selected_subscribers, product_df, variables, segmenter, personalize_rows=True,
+                       apply_eligibility=False, **options):
+    segmenter.fold_in(selected_subscribers)
+    labels, distances = segmenter.predict(selected_subscribers)
+    representative_positions, representatives = segment_representatives(labels, distances)
+
+    table_df, explanation_text, full_response = generate_batched(
+        model, selected_subscribers.iloc[representatives], product_df, variables,
+        apply_eligibility=apply_eligibility, **options
+    )
+    members = group_members(selected_subscribers, representative_positions)
+    table_df = fan_out(table_df, members)
+    if personalize_rows and table_df is not None and len(table_df) == len(selected_subscribers):
+        table_df = personalize(
+            table_df, selected_subscribers, product_df, variables, representatives, apply_eligibility
+        )
+    summary = (
+        f"{len(selected_subscribers):,} subscribers in {len(representatives):,} segments; "
+        f"mean distance to segment centre {distances.mean():.2f}"
+    )
+    return table_df, explanation_text, f"{summary}\n\n{full_response}"
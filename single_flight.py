@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Single-Flight Request Coalescing
+Concurrent callers with the same key share one in-flight computation and its result
+"""
+
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    # Run fn for key unless an identical call is already running, in which case wait for it.
+    # Returns (result, shared) where shared is True for callers that joined another's call;
+    # an exception raised by fn is re-raised in every caller.
+    def do(self, key, fn):
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Interrupts such as a Streamlit rerun belong to the leader's session only
+            future.set_exception(RuntimeError("The shared analysis was interrupted; please run it again"))
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+MTN Recommendation System - Columnar Subscriber Store
+Converts the subscriber CSV once into a Parquet dataset with an explicit schema and reads it back
+column-projected; falls back to the CSV when pyarrow is not installed
+"""
+
+import os
+import json
+import glob
+import re
+import time
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from prompt_serializer import RECHARGE_FREQ_UNIT
+
+SUBSCRIBER_COLUMNS = [
+    "MSISDN", "DemographicSegment", "AvgDataLast90Days (GB)", "AvgVoiceLast90Days (min)", "AvgSMSLast90Days",
+    "RechargeFreq", "DeviceType", "CurrentPlan", "VASUsed", "ARPU"
+]
+# Column types, so neither path infers them from the data. Usage columns are float so a missing
+# value does not change the type; RechargeFreq stays text ("6/mo").
+SUBSCRIBER_DTYPES = {
+    "MSISDN": "int64",
+    "DemographicSegment": "text",
+    "AvgDataLast90Days (GB)": "float64",
+    "AvgVoiceLast90Days (min)": "float64",
+    "AvgSMSLast90Days": "float64",
+    "RechargeFreq": "text",
+    "DeviceType": "text",
+    "CurrentPlan": "text",
+    "VASUsed": "text",
+    "ARPU": "float64",
+}
+TEXT_COLUMNS = [col for col in SUBSCRIBER_COLUMNS if SUBSCRIBER_DTYPES[col] == "text"]
+
+# Compact in-memory layout: low-cardinality text as categoricals, usage metrics as float32
+CATEGORY_COLUMNS = ["DemographicSegment", "DeviceType", "CurrentPlan", "VASUsed"]
+FLOAT32_COLUMNS = ["AvgDataLast90Days (GB)", "AvgVoiceLast90Days (min)", "AvgSMSLast90Days", "ARPU"]
+RECHARGE_FREQ_PATTERN = r"^\s*(\d+)\s*" + re.escape(RECHARGE_FREQ_UNIT) + r"\s*$"
+
+# Dataset defaults
+DEFAULT_DATASET_SUFFIX = ".parquet"
+DEFAULT_PART_ROWS = 1000000
+DEFAULT_ROW_GROUP_ROWS = 131072
+DEFAULT_CHUNK_ROWS = 50000
+PART_PATTERN = "part-*.parquet"
+
+# Every conversion writes a new version directory inside the dataset directory and then atomically
+# replaces CURRENT_FILE, which names the version and the source it came from. Readers in any process
+# (web replicas, the desktop app) only ever see a complete version; the previous one is kept for
+# readers still on it, and staging directories of crashed conversions are removed after an hour.
+CURRENT_FILE = "_current.json"
+VERSION_PREFIX = "v-"
+STAGING_PREFIX = ".staging-"
+STAGING_MAX_AGE_SECONDS = 60 * 60
+READ_ATTEMPTS = 3
+
+_convert_lock = threading.Lock()
+
+def dataset_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + DEFAULT_DATASET_SUFFIX
+
+def pyarrow_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+# dictionary_columns are read dictionary-encoded, which pandas turns into categoricals
+def subscriber_schema(dictionary_columns=()):
+    import pyarrow as pa
+    arrow_types = {"int64": pa.int64(), "float64": pa.float64(), "text": pa.string()}
+    return pa.schema([
+        (col, pa.dictionary(pa.int32(), pa.string()) if col in dictionary_columns else arrow_types[SUBSCRIBER_DTYPES[col]])
+        for col in SUBSCRIBER_COLUMNS
+    ])
+
+# Cast one raw CSV chunk to the schema: stripped text, missing columns added as NaN and unparseable
+# numbers read as NaN instead of failing the whole load
+def conform_chunk(chunk, columns=None):
+    chunk = chunk.rename(columns=lambda col: str(col).strip())
+    typed = {}
+    for col in columns or SUBSCRIBER_COLUMNS:
+        values = chunk[col] if col in chunk.columns else pd.Series(np.nan, index=chunk.index, dtype=object)
+        if SUBSCRIBER_DTYPES[col] == "text":
+            typed[col] = values.str.strip() if col in chunk.columns else values
+        else:
+            typed[col] = pd.to_numeric(values, errors="coerce").astype("float64")
+    if "MSISDN" in typed:
+        # Rows without a usable MSISDN cannot be looked up or recommended for
+        usable = typed["MSISDN"].notna()
+        if not usable.all():
+            typed = {col: values[usable] for col, values in typed.items()}
+        typed["MSISDN"] = typed["MSISDN"].astype("int64")
+    return pd.DataFrame(typed).reset_index(drop=True)
+
+# Chunks of the CSV with the schema's types given to the parser. With typed_numbers=False numbers
+# are read as text and parsed by conform_chunk, which turns a bad cell into NaN instead of an error.
+def read_csv_chunks(csv_path, chunk_rows=DEFAULT_PART_ROWS, columns=None, typed_numbers=True):
+    header = pd.read_csv(csv_path, nrows=0).columns
+    dtype = {
+        raw: "float64" if typed_numbers and SUBSCRIBER_DTYPES[str(raw).strip()] != "text" else str
+        for raw in header if str(raw).strip() in SUBSCRIBER_DTYPES
+    }
+    usecols = (lambda col: str(col).strip() in columns) if columns else None
+    return pd.read_csv(csv_path, on_bad_lines="skip", dtype=dtype, chunksize=chunk_rows, usecols=usecols)
+
+# Run consume over the conformed chunks, retrying with numbers read as text if a cell is unparseable
+def _consume_chunks(csv_path, consume, chunk_rows=DEFAULT_PART_ROWS, columns=None):
+    try:
+        return consume(conform_chunk(chunk, columns) for chunk in read_csv_chunks(csv_path, chunk_rows, columns))
+    except ValueError:
+        chunks = read_csv_chunks(csv_path, chunk_rows, columns, typed_numbers=False)
+        return consume(conform_chunk(chunk, columns) for chunk in chunks)
+
+# Changes whenever the CSV is replaced or edited; keys caches built over the loaded subscribers
+def source_version(csv_path):
+    stat = os.stat(csv_path)
+    return f"{os.path.abspath(csv_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "columns": SUBSCRIBER_COLUMNS}
+
+def _read_current(dataset_dir):
+    try:
+        with open(os.path.join(dataset_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Part files of the dataset's current version (empty when there is none). FileNotFoundError means the
+# version was removed, or is being removed, by a newer conversion after the pointer was read; read again.
+def dataset_parts(dataset_dir):
+    current = _read_current(dataset_dir)
+    if current is None:
+        return []
+    version_dir = os.path.join(dataset_dir, current["version"])
+    parts = sorted(glob.glob(os.path.join(version_dir, PART_PATTERN)))
+    if not os.path.isdir(version_dir) or len(parts) != current.get("parts", len(parts)):
+        raise FileNotFoundError(version_dir)
+    return parts
+
+# True when the current version of dataset_dir was converted from the current version of csv_path
+def dataset_is_current(csv_path, dataset_dir):
+    current = _read_current(dataset_dir)
+    return (
+        current is not None
+        and current.get("source") == json.loads(json.dumps(_source_stamp(csv_path)))
+        and os.path.isdir(os.path.join(dataset_dir, current["version"]))
+    )
+
+# Replace CURRENT_FILE in one step, so a reader sees either the old or the new version
+def _publish_version(dataset_dir, version, source, parts):
+    pointer_path = os.path.join(dataset_dir, f"{STAGING_PREFIX}{CURRENT_FILE}-{os.getpid()}-{threading.get_ident()}")
+    with open(pointer_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "source": source, "parts": parts}, f)
+    os.replace(pointer_path, os.path.join(dataset_dir, CURRENT_FILE))
+
+# Remove versions older than keep (and files of the old flat layout) plus stale staging directories;
+# anything another process still holds open is left for a later conversion
+def _remove_old_versions(dataset_dir, keep):
+    now = time.time()
+    for name in os.listdir(dataset_dir):
+        path = os.path.join(dataset_dir, name)
+        if name == CURRENT_FILE or name in keep:
+            continue
+        if name.startswith(VERSION_PREFIX) and name > min(keep):
+            continue
+        try:
+            if name.startswith(STAGING_PREFIX) and now - os.path.getmtime(path) < STAGING_MAX_AGE_SECONDS:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+# Convert the CSV into part files of part_rows rows each (row groups of row_group_rows) in a new version
+# of dataset_dir; the version is written to a staging directory and published once complete
+def convert_csv_to_parquet(csv_path, dataset_dir=None, part_rows=DEFAULT_PART_ROWS, row_group_rows=DEFAULT_ROW_GROUP_ROWS):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    dataset_dir = dataset_dir or dataset_path_for(csv_path)
+    os.makedirs(dataset_dir, exist_ok=True)
+    source = _source_stamp(csv_path)
+    staging_dir = os.path.join(dataset_dir, f"{STAGING_PREFIX}{os.getpid()}-{time.time_ns()}")
+    os.makedirs(staging_dir)
+    schema = subscriber_schema()
+
+    def write_parts(chunks):
+        rows = 0
+        for part, chunk in enumerate(chunks):
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            pq.write_table(table, os.path.join(staging_dir, f"part-{part:05d}.parquet"), row_group_size=row_group_rows)
+            rows += table.num_rows
+        return rows
+
+    try:
+        rows = _consume_chunks(csv_path, write_parts, part_rows)
+        parts = len(glob.glob(os.path.join(staging_dir, PART_PATTERN)))
+        # Version names sort by the time they were published; the pid keeps concurrent ones apart
+        version = f"{VERSION_PREFIX}{time.time_ns():020d}-{os.getpid()}"
+        os.replace(staging_dir, os.path.join(dataset_dir, version))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    # A conversion that finished after a newer one was published leaves the newer one in place
+    previous = _read_current(dataset_dir)
+    if previous is None or version > previous["version"]:
+        _publish_version(dataset_dir, version, source, parts)
+        _remove_old_versions(dataset_dir, {version, previous["version"]} if previous else {version})
+    return rows
+
+def ensure_dataset(csv_path, dataset_dir=None):
+    dataset_dir = dataset_dir or dataset_path_for(csv_path)
+    with _convert_lock:
+        if not dataset_is_current(csv_path, dataset_dir):
+            convert_csv_to_parquet(csv_path, dataset_dir)
+    return dataset_dir
+
+# categories=True reads the text columns dictionary-encoded, so they arrive as categoricals without
+# ever materializing one string per row
+def read_parquet_dataset(dataset_dir, columns=None, categories=False):
+    import pyarrow.parquet as pq
+    schema = subscriber_schema(TEXT_COLUMNS if categories else ())
+    # A version can be replaced and removed by another process mid-read; the next attempt reads its successor
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            parts = dataset_parts(dataset_dir)
+            table = pq.ParquetDataset(parts, schema=schema).read(columns=columns) if parts else schema.empty_table()
+            break
+        except OSError:
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+    # Arrow buffers are released column by column as they are converted, so the peak stays near one copy
+    df = table.select(columns or SUBSCRIBER_COLUMNS).to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    return _missing_text_as_nan(df)
+
+# Missing text comes back from Arrow as None; make it NaN like a CSV read
+def _missing_text_as_nan(df):
+    for col in df.columns.intersection(TEXT_COLUMNS):
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+def read_csv_typed(csv_path, columns=None):
+    chunks = _consume_chunks(csv_path, list, columns=columns)
+    if not chunks:
+        return conform_chunk(pd.DataFrame(), columns)
+    return chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+
+# === COMPACT LAYOUT ===
+# "6/mo" as the smallest unsigned integer type that holds every count. Left as text when a value is
+# missing or in another unit, so nothing is silently reinterpreted.
+def compact_recharge_freq(series):
+    if pd.api.types.is_integer_dtype(series):
+        counts = series.to_numpy()
+    else:
+        codes, uniques = pd.factorize(series)
+        parsed = pd.Series(uniques, dtype=object).astype(str).str.extract(RECHARGE_FREQ_PATTERN, expand=False)
+        if (codes < 0).any() or parsed.isna().any():
+            return series
+        counts = parsed.astype(np.int64).to_numpy()[codes]
+    if len(counts) == 0 or counts.min() < 0:
+        return series
+    return pd.Series(counts.astype(np.min_scalar_type(counts.max())), index=series.index, name=series.name)
+
+# MSISDNs as uint32 when every number fits (national format); left as int64 otherwise
+def compact_msisdn(series):
+    if not pd.api.types.is_integer_dtype(series) or series.empty:
+        return series
+    if series.min() >= 0 and series.max() <= np.iinfo(np.uint32).max:
+        return series.astype(np.uint32)
+    return series
+
+def compact_subscribers(subscriber_df):
+    columns = {}
+    for col in subscriber_df.columns:
+        values = subscriber_df[col]
+        if col in CATEGORY_COLUMNS:
+            values = values.astype("category")
+        elif col in FLOAT32_COLUMNS:
+            values = pd.to_numeric(values, errors="coerce").astype(np.float32)
+        elif col == "RechargeFreq":
+            values = compact_recharge_freq(values)
+        elif col == "MSISDN":
+            values = compact_msisdn(values)
+        columns[col] = values
+    return pd.DataFrame(columns, index=subscriber_df.index)
+
+# Deep memory per column (and "Total"), scaled to one million rows
+def memory_per_million_rows(df):
+    usage = df.memory_usage(deep=True, index=False)
+    usage["Total"] = usage.sum()
+    return usage * (1000000 / max(len(df), 1))
+
+# === CHUNKED READS ===
+# Every part file of the dataset's current version, opened. Open files stay readable after a newer
+# conversion removes their version (the removal leaves them alone where the OS refuses), so this pins
+# the version for a reader; a version removed before it could be opened is retried with its successor.
+def _open_current_parts(dataset_dir, read_dictionary=None):
+    import pyarrow.parquet as pq
+    for attempt in range(READ_ATTEMPTS):
+        parquet_files = []
+        try:
+            for part in dataset_parts(dataset_dir):
+                parquet_files.append(pq.ParquetFile(part, read_dictionary=read_dictionary))
+            return parquet_files
+        except OSError:
+            for parquet_file in parquet_files:
+                parquet_file.close()
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+
+# Subscribers as a sequence of frames of at most chunk_rows rows, so only one chunk is in memory at a
+# time: batches of the Parquet row groups when pyarrow is available, otherwise CSV chunks. The Parquet
+# parts are opened up front, so the whole stream comes from one version. The CSV is read with numbers
+# as text, since a bad cell cannot be retried halfway through the stream.
+def iter_subscribers(csv_path, chunk_rows=DEFAULT_CHUNK_ROWS, columns=None, use_parquet=True, compact=False):
+    if use_parquet and pyarrow_available() and os.path.isfile(csv_path):
+        parquet_files = _open_current_parts(ensure_dataset(csv_path), TEXT_COLUMNS if compact else None)
+        try:
+            for parquet_file in parquet_files:
+                for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns or SUBSCRIBER_COLUMNS):
+                    chunk = _missing_text_as_nan(batch.to_pandas())
+                    yield compact_subscribers(chunk) if compact else chunk
+        finally:
+            for parquet_file in parquet_files:
+                parquet_file.close()
+    else:
+        for chunk in read_csv_chunks(csv_path, chunk_rows, columns, typed_numbers=False):
+            chunk = conform_chunk(chunk, columns)
+            yield compact_subscribers(chunk) if compact else chunk
+
+# Load subscribers with the given columns (default: all of SUBSCRIBER_COLUMNS). The Parquet dataset
+# next to the CSV is built or refreshed first when pyarrow is available and the CSV is a local file;
+# compact=True converts the frame to the compact layout.
+def load_subscribers(csv_path, columns=None, use_parquet=True, compact=False):
+    if use_parquet and pyarrow_available() and os.path.isfile(csv_path):
+        subscriber_df = read_parquet_dataset(ensure_dataset(csv_path), columns, categories=compact)
+    else:
+        subscriber_df = read_csv_typed(csv_path, columns)
+    return compact_subscribers(subscriber_df) if compact else subscriber_df